@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Benchmark de filter-service y aggregate-service con datos sintéticos
+Levanta un ROBLE falso (fake_roble.py) y los dos servicios como procesos
+locales apuntando a él, lanza cada escenario con concurrencia fija y guarda en
+JSON el throughput, las latencias p50/p95/p99, los bytes por respuesta, el
+pico de memoria (RSS) del servicio y las llamadas que llegaron a ROBLE.
+Funciona sin red externa
+
+    python benchmarks/bench.py run --rows 100000 --concurrency 8 --duration 10
+    python benchmarks/bench.py run --rows 1000000 --scenarios aggregate_city,filter_top_k
+    python benchmarks/bench.py run --env FILTER_SNAPSHOT_TTL=0 --env AGGREGATE_CACHE_TTL=0
+    python benchmarks/bench.py compare benchmarks/results/antes.json benchmarks/results/despues.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import subprocess
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MICROSERVICES = os.path.join(ROOT, 'microservices')
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+TOKEN = 'bench-token'
+
+# Escenarios: servicio, ruta y cuerpo de la petición
+SCENARIOS = {
+    'filter_city_eq': ('filter', '/filter', {'filter_field': 'city', 'filter_value': 'Cali', 'limit': 100}),
+    'filter_range': ('filter', '/filter', {
+        'where': {'and': [{'field': 'age', 'op': 'between', 'value': [25, 35]},
+                          {'field': 'active', 'op': 'eq', 'value': True}]},
+        'limit': 500}),
+    'filter_top_k': ('filter', '/filter', {
+        'where': {'field': 'active', 'op': 'eq', 'value': True}, 'order_by': '-age', 'limit': 100}),
+    'filter_stream_all': ('filter', '/filter', {'where': {'field': 'age', 'op': 'gte', 'value': 18}, 'stream': True}),
+    'aggregate_city': ('aggregate', '/aggregate', {'group_by': 'city', 'metrics': {'age': ['mean', 'p50', 'p95']}}),
+    'aggregate_city_age_buckets': ('aggregate', '/aggregate', {
+        'group_by': ['city', 'age'], 'buckets': {'age': {'width': 10}}, 'metrics': {'age': ['count']}}),
+    'aggregate_approx_email': ('aggregate', '/aggregate', {
+        'group_by': 'email', 'approximate': True, 'top': 10, 'distinct': ['city']}),
+    'pipeline_filter_group': ('aggregate', '/pipeline', {'stages': [
+        {'filter': {'field': 'active', 'op': 'eq', 'value': True}},
+        {'group': {'group_by': 'city', 'metrics': {'age': ['mean']}}},
+        {'sort': '-age.mean'},
+        {'limit': 10}]})
+}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url}: el proceso terminó con código {process.returncode}")
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} no respondió en {timeout}s")
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """Pico de memoria residente del proceso (VmHWM, solo Linux)"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss(pid: int) -> bool:
+    """Reinicia VmHWM para medir el pico de cada escenario (Linux >= 4.0)"""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentil por rango más cercano sobre valores ordenados"""
+    if not values:
+        return None
+    rank = max(1, int(-(-q * len(values) // 100)))  # techo de q% de n
+    return round(values[min(rank, len(values)) - 1], 2)
+
+class Stack:
+    """ROBLE falso y servicios en procesos locales"""
+
+    def __init__(self, args):
+        self.args = args
+        self.processes = {}
+        self.urls = {}
+        self.logs = []
+
+    def _spawn(self, name: str, command: List[str], cwd: str, env: Dict) -> subprocess.Popen:
+        log = open(os.path.join(self.args.log_dir, f'{name}.log'), 'w')
+        self.logs.append(log)
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.processes[name] = process
+        return process
+
+    def start(self):
+        args = self.args
+        os.makedirs(args.log_dir, exist_ok=True)
+        roble_port = free_port()
+        roble = self._spawn('roble', [sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_roble.py'),
+                                      '--rows', str(args.rows), '--cities', str(args.cities), '--seed', str(args.seed),
+                                      '--latency-ms', str(args.roble_latency_ms), '--port', str(roble_port)],
+                            ROOT, dict(os.environ))
+        self.urls['roble'] = f'http://127.0.0.1:{roble_port}'
+        # Generar 1M filas tarda; se espera más que a los servicios
+        wait_ready(f"{self.urls['roble']}/health", roble, timeout=max(60, args.rows / 10000))
+
+        for name in ('filter', 'aggregate'):
+            port = free_port()
+            service_dir = os.path.join(MICROSERVICES, f'{name}_service')
+            env = dict(os.environ, PORT=str(port), ROBLE_BASE_HOST=self.urls['roble'],
+                       PYTHONPATH=os.pathsep.join([service_dir, os.path.join(MICROSERVICES, 'common')]))
+            env.update(args.env)
+            process = self._spawn(name, [sys.executable, 'app.py'], service_dir, env)
+            self.urls[name] = f'http://127.0.0.1:{port}'
+            wait_ready(f"{self.urls[name]}/health", process, timeout=60)
+
+    def roble_stats(self) -> Dict:
+        return requests.get(f"{self.urls['roble']}/_stats", timeout=5).json()
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log in self.logs:
+            log.close()
+
+def run_load(url: str, body: Dict, concurrency: int, duration: float, max_requests: Optional[int],
+             accept_encoding: str) -> Dict:
+    """Carga de lazo cerrado: `concurrency` clientes encadenando peticiones hasta el tiempo o el total"""
+    headers = {'Authorization': f'Bearer {TOKEN}', 'Accept-Encoding': accept_encoding}
+    payload = json.dumps(body)
+    latencies, sizes = [], []
+    errors = [0]
+    lock = threading.Lock()
+    issued = [0]
+    deadline = time.perf_counter() + duration
+
+    def client():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            started = time.perf_counter()
+            size = 0
+            ok = False
+            try:
+                with session.post(url, data=payload, headers=dict(headers, **{'Content-Type': 'application/json'}),
+                                  stream=True, timeout=300) as response:
+                    # Bytes tal como viajan (comprimidos si el servicio comprime)
+                    for chunk in response.raw.stream(64 * 1024, decode_content=False):
+                        size += len(chunk)
+                    ok = response.status_code == 200
+            except requests.RequestException:
+                pass
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                    sizes.append(size)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'wall_seconds': round(wall, 2),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            'max': round(latencies[-1], 2) if latencies else None
+        },
+        'bytes_per_response': int(sum(sizes) / len(sizes)) if sizes else None
+    }
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def command_run(args) -> int:
+    names = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        print(f"❌ Escenarios desconocidos: {', '.join(unknown)}. Disponibles: {', '.join(SCENARIOS)}")
+        return 2
+
+    stack = Stack(args)
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'rows': args.rows,
+            'cities': args.cities,
+            'seed': args.seed,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'max_requests': args.requests,
+            'accept_encoding': args.accept_encoding,
+            'roble_latency_ms': args.roble_latency_ms,
+            'env': args.env
+        },
+        'scenarios': {},
+        'services': {}
+    }
+    try:
+        print(f"🚀 Iniciando ROBLE falso ({args.rows} filas) y servicios...")
+        stack.start()
+        for name in names:
+            service, path, body = SCENARIOS[name]
+            pid = stack.processes[service].pid
+            url = stack.urls[service] + path
+            per_scenario_rss = reset_peak_rss(pid)
+
+            # Primera petición (snapshot, caché y pool en frío), medida aparte
+            before = stack.roble_stats()
+            cold = run_load(url, body, 1, 300, 1, args.accept_encoding)
+            warm_reads = stack.roble_stats()['read'] - before['read']
+            before = stack.roble_stats()
+
+            result = run_load(url, body, args.concurrency, args.duration, args.requests, args.accept_encoding)
+            after = stack.roble_stats()
+            result.update({
+                'service': service,
+                'path': path,
+                'first_request_ms': cold['latency_ms']['p50'],
+                'first_request_roble_reads': warm_reads,
+                # Lecturas de la tabla y verificaciones de token por petición durante la carga
+                'roble_reads_per_request': round((after['read'] - before['read']) / max(1, result['requests']), 3),
+                'roble_verifies': after['verify'] - before['verify'],
+                'peak_rss_mb': peak_rss_mb(pid),
+                'peak_rss_scope': 'scenario' if per_scenario_rss else 'process'
+            })
+            results['scenarios'][name] = result
+            latency = result['latency_ms']
+            print(f"  {name:28} {result['throughput_rps'] or 0:8.1f} req/s  p50 {latency['p50']}ms  "
+                  f"p95 {latency['p95']}ms  p99 {latency['p99']}ms  RSS {result['peak_rss_mb']} MB"
+                  f"{'  errores: ' + str(result['errors']) if result['errors'] else ''}")
+        for service in ('filter', 'aggregate'):
+            results['services'][service] = {'peak_rss_mb': peak_rss_mb(stack.processes[service].pid)}
+    except Exception as e:
+        print(f"❌ {e} (logs en {args.log_dir})")
+        return 1
+    finally:
+        stack.stop()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"💾 Resultados en {output}")
+    if args.compare:
+        return compare(args.compare, output, args.threshold)
+    return 0
+
+def _change(before, after) -> Optional[float]:
+    if before in (None, 0) or after is None:
+        return None
+    return (after - before) / before * 100
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """Diferencias por escenario; código 1 si alguno empeora más de `threshold` %"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    for key in ('rows', 'cities', 'concurrency', 'accept_encoding'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print(f"⚠️ {key} distinto: {baseline['meta'].get(key)} -> {current['meta'].get(key)}")
+
+    regressions = []
+    print(f"{'escenario':28} {'req/s':>24} {'p95 ms':>24} {'RSS MB':>20}")
+    for name, now in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before:
+            print(f"{name:28} (nuevo)")
+            continue
+        rps = _change(before['throughput_rps'], now['throughput_rps'])
+        p95 = _change(before['latency_ms']['p95'], now['latency_ms']['p95'])
+        rss = _change(before.get('peak_rss_mb'), now.get('peak_rss_mb'))
+        cells = []
+        for value, previous, delta in ((now['throughput_rps'], before['throughput_rps'], rps),
+                                       (now['latency_ms']['p95'], before['latency_ms']['p95'], p95),
+                                       (now.get('peak_rss_mb'), before.get('peak_rss_mb'), rss)):
+            cells.append(f"{previous}->{value} ({delta:+.0f}%)" if delta is not None else f"{previous}->{value}")
+        worse = (rps is not None and rps < -threshold) or (p95 is not None and p95 > threshold) or \
+            (rss is not None and rss > threshold)
+        if worse:
+            regressions.append(name)
+        print(f"{name:28} {cells[0]:>24} {cells[1]:>24} {cells[2]:>20}{'  ❌' if worse else ''}")
+
+    if regressions:
+        print(f"❌ Empeoran más de {threshold}%: {', '.join(regressions)}")
+        return 1
+    print(f"✅ Sin regresiones de más de {threshold}%")
+    return 0
+
+def parse_env(value: str):
+    key, separator, setting = value.partition('=')
+    if not separator or not key:
+        raise argparse.ArgumentTypeError("use CLAVE=VALOR")
+    return key, setting
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark de filter-service y aggregate-service')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Levanta el entorno local y mide los escenarios')
+    run.add_argument('--rows', type=int, default=100000, help='Filas de la tabla usuarios (10k a 1M)')
+    run.add_argument('--cities', type=int, default=50, help='Ciudades distintas (cardinalidad de city)')
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--concurrency', type=int, default=8, help='Clientes simultáneos')
+    run.add_argument('--duration', type=float, default=10, help='Segundos de carga por escenario')
+    run.add_argument('--requests', type=int, default=None, help='Máximo de peticiones por escenario')
+    run.add_argument('--scenarios', default=None, help=f"Lista separada por comas ({', '.join(SCENARIOS)})")
+    run.add_argument('--accept-encoding', default='gzip', help="Accept-Encoding de los clientes ('identity' sin compresión)")
+    run.add_argument('--roble-latency-ms', type=float, default=0.0, help='Latencia añadida por el ROBLE falso')
+    run.add_argument('--env', type=parse_env, action='append', default=[],
+                     help='Variable de entorno de los servicios, p. ej. FILTER_SNAPSHOT_TTL=0 (repetible)')
+    run.add_argument('--output', default=None, help='Fichero JSON de resultados (por defecto benchmarks/results/)')
+    run.add_argument('--compare', default=None, help='Resultados anteriores con los que comparar al terminar')
+    run.add_argument('--threshold', type=float, default=10.0, help='Porcentaje que se considera regresión')
+    run.add_argument('--log-dir', default=os.path.join(RESULTS_DIR, 'logs'), help='Logs de los procesos')
+
+    diff = commands.add_parser('compare', help='Compara dos ficheros de resultados')
+    diff.add_argument('baseline')
+    diff.add_argument('current')
+    diff.add_argument('--threshold', type=float, default=10.0)
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        return compare(args.baseline, args.current, args.threshold)
+    args.env = dict(args.env)
+    return command_run(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
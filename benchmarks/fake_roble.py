@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Servidor ROBLE falso para benchmarks (sin red externa)
+Atiende /auth/<contrato>/verify-token y /database/<contrato>/read con una
+tabla `usuarios` sintética y reproducible (semilla), de cardinalidad
+configurable. La tabla se serializa una vez y se envía por bloques con
+transfer-encoding chunked, como una respuesta grande de ROBLE; los filtros de
+igualdad de /read se aplican como en ROBLE. GET /_stats cuenta las llamadas
+
+    python benchmarks/fake_roble.py --rows 100000 --cities 50 --port 8700
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+CHUNK_SIZE = 64 * 1024
+FIRST_NAMES = ['Ana', 'Luis', 'María', 'Carlos', 'Sofía', 'Andrés', 'Valentina', 'Jorge', 'Camila', 'Diego',
+               'Laura', 'Julián', 'Daniela', 'Mateo', 'Paula', 'Sebastián', 'Isabella', 'Felipe', 'Mariana', 'Tomás']
+LAST_NAMES = ['Gómez', 'Rodríguez', 'Martínez', 'López', 'García', 'Pérez', 'Sánchez', 'Ramírez', 'Torres', 'Díaz',
+              'Vargas', 'Rojas', 'Moreno', 'Castro', 'Ortiz', 'Herrera', 'Jiménez', 'Ruiz', 'Mendoza', 'Suárez']
+CITIES = ['Barranquilla', 'Bogotá', 'Medellín', 'Cali', 'Cartagena', 'Santa Marta', 'Bucaramanga', 'Pereira']
+
+def generate_users(rows: int, cities: int, seed: int = 42, missing_ratio: float = 0.02, active_ratio: float = 0.7):
+    """
+    Filas de `usuarios`: _id y email únicos, `cities` ciudades con reparto
+    sesgado (unas pocas concentran la mayoría, como en datos reales), edades
+    de 18 a 80 y una fracción `missing_ratio` de filas sin edad o sin ciudad
+    """
+    rng = random.Random(seed)
+    city_names = [CITIES[i] if i < len(CITIES) else f"Ciudad {i:04d}" for i in range(cities)]
+    # Pesos tipo Zipf: la ciudad i aparece con probabilidad proporcional a 1/(i+1)
+    city_weights = [1 / (i + 1) for i in range(cities)]
+    city_column = rng.choices(city_names, weights=city_weights, k=rows)
+    for i in range(rows):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield {
+            '_id': f"{i:08x}",
+            'name': sys.intern(f"{first} {last}"),
+            'email': f"{first.lower()}.{last.lower()}.{i}@example.com",
+            'age': None if rng.random() < missing_ratio else rng.randint(18, 80),
+            'city': None if rng.random() < missing_ratio else city_column[i],
+            'active': rng.random() < active_ratio
+        }
+
+FIELDS = ('_id', 'name', 'email', 'age', 'city', 'active')
+
+def _param_key(value) -> str:
+    """Valor como lo compara /read: los parámetros llegan como texto"""
+    return str(value).lower()
+
+class FakeRoble:
+    """Tabla serializada en bloques, índices para los filtros y contadores de llamadas"""
+
+    def __init__(self, rows: int, cities: int, seed: int = 42, latency_ms: float = 0.0):
+        started = time.time()
+        # Tuplas en lugar de diccionarios: con 1M filas la tabla cabe en unos cientos de MB
+        self.rows = [tuple(row[field] for field in FIELDS) for row in generate_users(rows, cities, seed)]
+        self.chunks = list(self._serialize(self.rows))
+        self.latency = latency_ms / 1000
+        self.indexes = {}  # {campo: {valor en texto: posiciones}}, se construyen al primer filtro
+        self.stats = {'verify': 0, 'read': 0, 'filtered_read': 0, 'rows_sent': 0, 'bytes_sent': 0}
+        self._lock = threading.Lock()
+        print(f"🧪 Tabla sintética: {rows} filas, {cities} ciudades, "
+              f"{sum(len(c) for c in self.chunks) // 2 ** 20} MB en {time.time() - started:.1f}s", flush=True)
+
+    @staticmethod
+    def _serialize(rows):
+        """Array JSON partido en bloques de ~CHUNK_SIZE bytes"""
+        buffer = [b'[']
+        size = 1
+        for position, row in enumerate(rows):
+            data = (b',' if position else b'') + json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False).encode()
+            buffer.append(data)
+            size += len(data)
+            if size >= CHUNK_SIZE:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+        buffer.append(b']')
+        yield b''.join(buffer)
+
+    def count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _index(self, field: str):
+        with self._lock:
+            index = self.indexes.get(field)
+            if index is None:
+                position = FIELDS.index(field)
+                index = self.indexes[field] = {}
+                for i, row in enumerate(self.rows):
+                    if row[position] is not None:
+                        index.setdefault(_param_key(row[position]), []).append(i)
+            return index
+
+    def read_chunks(self, filters):
+        if not filters:
+            self.count('rows_sent', len(self.rows))
+            return self.chunks
+        self.count('filtered_read')
+        positions = None
+        for field, expected in filters.items():
+            if field not in FIELDS:
+                positions = []
+                break
+            matched = set(self._index(field).get(expected.lower(), ()))
+            positions = matched if positions is None else positions & matched
+        rows = [self.rows[i] for i in sorted(positions)]
+        self.count('rows_sent', len(rows))
+        return self._serialize(rows)
+
+def make_handler(roble: FakeRoble):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive como la sesión de los servicios
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+            if url.path == '/health':
+                return self._send_json(200, {'status': 'ok'})
+            if url.path == '/_stats':
+                return self._send_json(200, roble.stats)
+            if not (self.headers.get('Authorization') or '').startswith('Bearer '):
+                return self._send_json(401, {'message': 'Unauthorized'})
+            if roble.latency:
+                time.sleep(roble.latency)
+
+            if len(parts) == 3 and parts[0] == 'auth' and parts[2] == 'verify-token':
+                roble.count('verify')
+                return self._send_json(200, {'valid': True, 'user': {'email': 'bench@example.com', 'role': 'admin'}})
+
+            if len(parts) == 3 and parts[0] == 'database' and parts[2] == 'read':
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                if params.pop('tableName', None) != 'usuarios':
+                    return self._send_json(404, {'message': 'Tabla no encontrada'})
+                roble.count('read')
+                chunks = roble.read_chunks(params)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                sent = 0
+                try:
+                    for chunk in chunks:
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                        sent += len(chunk)
+                    self.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # El servicio cortó la descarga (límite alcanzado)
+                    self.close_connection = True
+                roble.count('bytes_sent', sent)
+                return
+
+            self._send_json(404, {'message': 'Ruta no encontrada'})
+
+    return Handler
+
+def serve(roble: FakeRoble, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(roble))
+    server.daemon_threads = True
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor ROBLE falso con datos sintéticos')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Espera antes de cada respuesta')
+    parser.add_argument('--port', type=int, default=8700)
+    args = parser.parse_args(argv)
+
+    roble = FakeRoble(args.rows, args.cities, args.seed, args.latency_ms)
+    server = serve(roble, args.port)
+    print(f"🧪 ROBLE falso en http://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Lector del log de actividad de Nginx
+Agrega los accesos por contenedor y los aplica en lotes al monitor de actividad
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+class AccessLogTailer:
+    """
+    Sigue el log compacto de actividad que escribe Nginx (formato roble_activity)
+
+    Cada línea tiene la forma "<msec> <container_name>:<puerto>". Las líneas se
+    agregan en memoria como {container_name: {'last_seen': ts, 'count': n}} y se
+    entregan al ActivityMonitor una vez por intervalo, de modo que el tráfico de
+    los proyectos no genera ninguna llamada HTTP ni de Docker por petición.
+    """
+
+    def __init__(self, activity_monitor, log_path='/nginx_logs/activity.log',
+                 interval=5, max_bytes=10 * 1024 * 1024, reopen_log=None):
+        self.activity_monitor = activity_monitor
+        self.log_path = log_path
+        self.interval = interval  # segundos entre lotes
+        self.max_bytes = max_bytes  # tamaño a partir del cual se rota el log
+        self.reopen_log = reopen_log  # () -> None, pide a Nginx reabrir sus logs (nginx -s reopen)
+        self.offset = None
+        self.inode = None
+        self.rotated = None  # (ruta, offset) del log rotado pendiente de terminar de leer
+        self.running = False
+        self.tail_thread = None
+        self.stats = {
+            'lines_read': 0,
+            'malformed_lines': 0,
+            'batches_applied': 0,
+            'containers_woken': 0,
+            'rotations': 0,
+            'last_batch_at': None
+        }
+
+    def start(self):
+        """Inicia la lectura del log en un thread separado"""
+        if not self.running:
+            self.running = True
+            self.tail_thread = threading.Thread(target=self._tail_loop, daemon=True)
+            self.tail_thread.start()
+            logger.info(f"📜 Lector de log de actividad iniciado: {self.log_path}")
+
+    def stop(self):
+        """Detiene la lectura del log"""
+        self.running = False
+        if self.tail_thread:
+            self.tail_thread.join(timeout=5)
+        logger.info("🛑 Lector de log de actividad detenido")
+
+    def _tail_loop(self):
+        """Loop principal: leer líneas nuevas y aplicar el lote"""
+        while self.running:
+            try:
+                batch = self.read_batch()
+                if batch:
+                    self._apply_batch(batch)
+            except Exception as e:
+                logger.error(f"❌ Error procesando log de actividad: {e}")
+            time.sleep(self.interval)
+
+    def read_batch(self) -> Dict[str, Dict]:
+        """
+        Lee las líneas nuevas del log y las agrega por contenedor
+
+        Returns:
+            {container_name: {'last_seen': timestamp, 'count': peticiones}}
+        """
+        batch = {}
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return batch
+
+        # Nginx ya reabrió sus logs (existe el nuevo archivo): terminar de leer el rotado
+        if self.rotated is not None:
+            path, offset = self.rotated
+            self.rotated = None
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    # Nadie escribe ya en él: también se consume una última línea sin salto
+                    self._parse_lines(f.read().rstrip(b'\n'), batch)
+            except FileNotFoundError:
+                pass
+
+        # Primera lectura: empezar al final, el historial previo no es actividad reciente
+        if self.offset is None:
+            self.offset = stat.st_size
+            self.inode = stat.st_ino
+            return batch
+
+        # Rotación o truncado externo (logrotate): volver al inicio
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.offset = 0
+            self.inode = stat.st_ino
+
+        if stat.st_size == self.offset:
+            return batch
+
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(stat.st_size - self.offset)
+        # Solo consumir líneas completas; el resto se lee en el siguiente lote
+        end = data.rfind(b'\n')
+        if end < 0:
+            return batch
+        self.offset += end + 1
+        self._parse_lines(data[:end], batch)
+
+        self._rotate_if_needed()
+        return batch
+
+    def _parse_lines(self, data: bytes, batch: Dict[str, Dict]):
+        """Agrega al lote las líneas de `data` por contenedor"""
+        if not data:
+            return
+        for raw_line in data.split(b'\n'):
+            self.stats['lines_read'] += 1
+            parts = raw_line.split()
+            if len(parts) < 2:
+                self.stats['malformed_lines'] += 1
+                continue
+            try:
+                timestamp = float(parts[0])
+            except ValueError:
+                self.stats['malformed_lines'] += 1
+                continue
+            container_name = parts[1].decode('utf-8', 'replace').rsplit(':', 1)[0]
+            if not container_name.startswith('project_'):
+                continue
+
+            entry = batch.get(container_name)
+            if entry is None:
+                batch[container_name] = {'last_seen': timestamp, 'count': 1}
+            else:
+                entry['count'] += 1
+                if timestamp > entry['last_seen']:
+                    entry['last_seen'] = timestamp
+
+    def _rotate_if_needed(self):
+        """
+        Rota el log cuando supera max_bytes: lo renombra a <log>.1 y pide a
+        Nginx que reabra sus logs. Nginx sigue escribiendo en el archivo
+        renombrado (incluido su buffer) hasta reabrir, por eso el resto se lee
+        en el siguiente lote. Sin reopen_log no se rota (queda para logrotate)
+        """
+        if not self.max_bytes or not self.reopen_log or self.offset < self.max_bytes:
+            return
+        rotated_path = f"{self.log_path}.1"
+        try:
+            os.replace(self.log_path, rotated_path)
+        except OSError as e:
+            logger.warning(f"⚠️ No se pudo rotar el log de actividad: {e}")
+            return
+        offset, inode = self.offset, self.inode
+        self.rotated = (rotated_path, offset)
+        # El nuevo archivo lo crea Nginx al reabrir: se lee desde el principio
+        self.offset = 0
+        self.inode = None
+        try:
+            self.reopen_log()
+        except Exception as e:
+            # Nginx sigue escribiendo en el archivo renombrado: devolverlo a su sitio
+            logger.warning(f"⚠️ Nginx no pudo reabrir el log de actividad, no se rota: {e}")
+            os.replace(rotated_path, self.log_path)
+            self.rotated = None
+            self.offset, self.inode = offset, inode
+            return
+        self.stats['rotations'] += 1
+        logger.info(f"🔄 Log de actividad rotado: {rotated_path}")
+
+    def _apply_batch(self, batch: Dict[str, Dict]):
+        """Aplica un lote al monitor y despierta los contenedores detenidos por inactividad"""
+        to_wake = self.activity_monitor.apply_activity_batch(batch)
+        self.stats['batches_applied'] += 1
+        self.stats['last_batch_at'] = time.time()
+        logger.debug(f"📊 Lote de actividad aplicado: {len(batch)} contenedores")
+
+        for container_name in to_wake:
+            if self.activity_monitor.restart_container_if_stopped(container_name):
+                self.stats['containers_woken'] += 1
+
+    def get_stats(self) -> Dict:
+        """Estadísticas del lector para diagnóstico"""
+        return dict(self.stats, log_path=self.log_path, offset=self.offset)
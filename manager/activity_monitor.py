@@ -6,24 +6,47 @@ import docker
 import time
 import logging
 import threading
-from datetime import datetime, timedelta
-from typing import Dict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+HOURS_PER_WEEK = 168
+
+def hour_of_week(timestamp: float) -> int:
+    """Índice 0-167 (lunes 00h = 0) en hora local"""
+    local = time.localtime(timestamp)
+    return local.tm_wday * 24 + local.tm_hour
+
 class ActivityMonitor:
     """Monitor de actividad para auto-shutdown de contenedores"""
     
-    def __init__(self, docker_client, inactivity_timeout=1800):  # 30 minutos por defecto
+    def __init__(self, docker_client, inactivity_timeout=1800, store=None,
+                 snapshot_interval=60):  # 30 minutos por defecto
         self.docker_client = docker_client
         self.inactivity_timeout = inactivity_timeout  # segundos
         self.last_activity = {}  # {container_name: timestamp}
+        self.request_counts = {}  # {container_name: peticiones vistas en el log de Nginx}
+        self.stopped_containers = set()  # Contenedores detenidos por inactividad
+        self.idle_policies = {}  # {container_name: timeout en segundos propio del proyecto}
+        self.access_histogram = {}  # {container_name: [168 contadores, uno por hora de la semana]}
+        self.histogram_decay = 0.5  # factor aplicado una vez por semana (las semanas recientes pesan más)
+        self.histogram_decayed_at = time.time()
+        self.store = store  # ActivityStore opcional para sobrevivir reinicios del manager
+        self.snapshot_interval = snapshot_interval  # segundos entre snapshots
+        self.last_snapshot = 0
+        self.resource_budget = None  # ResourceBudget opcional, se consulta antes de reiniciar
+        self.executor = None  # ContainerExecutor opcional para detener en paralelo
+        self.prewarm_scheduler = None  # PrewarmScheduler opcional: protege proyectos con tráfico previsto
+        self.shared_state = None  # SharedState opcional: actividad registrada por cualquier worker
         self.monitoring = False
         self.monitor_thread = None
         
     def start_monitoring(self):
         """Inicia el monitoreo en un thread separado"""
         if not self.monitoring:
+            self.restore_state()
+            self._sync_shared_policies(publish=True)
             self.monitoring = True
             self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
             self.monitor_thread.start()
@@ -34,20 +57,160 @@ class ActivityMonitor:
         self.monitoring = False
         if self.monitor_thread:
             self.monitor_thread.join(timeout=5)
+        self.save_snapshot()
+        self.monitor_thread = None
         logger.info("🛑 Servicio de monitoreo de actividad detenido")
     
+    def restore_state(self):
+        """Restaura el último snapshot guardado en disco"""
+        if not self.store:
+            return
+        
+        state = self.store.load()
+        for container_name, entry in state.items():
+            if entry['last_activity'] is not None:
+                self.last_activity[container_name] = entry['last_activity']
+            if entry['request_count']:
+                self.request_counts[container_name] = entry['request_count']
+            if entry['idle_timeout'] is not None:
+                self.idle_policies[container_name] = entry['idle_timeout']
+            if entry['stopped']:
+                self.stopped_containers.add(container_name)
+            if entry.get('histogram') and len(entry['histogram']) == HOURS_PER_WEEK:
+                self.access_histogram[container_name] = entry['histogram']
+        # El reloj del decaimiento semanal sigue corriendo entre reinicios
+        decayed_at = self.store.load_meta().get('histogram_decayed_at')
+        if decayed_at is not None:
+            self.histogram_decayed_at = decayed_at
+        
+        logger.info(f"♻️ Estado de actividad restaurado: {len(state)} contenedores")
+    
+    def save_snapshot(self):
+        """Guarda el estado actual en disco"""
+        if not self.store:
+            return
+        if self.shared_state and not self.monitor_thread:
+            # Con varios workers solo el líder (el que monitorea) escribe el snapshot
+            return
+        
+        try:
+            self.store.save_snapshot(
+                dict(self.last_activity),
+                dict(self.request_counts),
+                dict(self.idle_policies),
+                set(self.stopped_containers),
+                {name: list(hist) for name, hist in self.access_histogram.items()},
+                {'histogram_decayed_at': self.histogram_decayed_at}
+            )
+            self.last_snapshot = time.time()
+        except Exception as e:
+            logger.error(f"❌ Error guardando snapshot de actividad: {e}")
+    
+    def set_idle_policy(self, container_name: str, timeout: Optional[int]):
+        """
+        Define el timeout de inactividad de un proyecto
+        
+        Args:
+            timeout: Segundos de inactividad antes de detenerlo, o None para
+                     usar el timeout global
+        """
+        if timeout is None:
+            self.idle_policies.pop(container_name, None)
+        else:
+            self.idle_policies[container_name] = int(timeout)
+        if self.shared_state:
+            # None se guarda explícitamente para que el líder también la elimine
+            self.shared_state.update_mapping('idle_policies', container_name, None if timeout is None else int(timeout))
+        logger.info(f"⚙️ Política de inactividad de {container_name}: {timeout or self.inactivity_timeout}s")
+    
+    def _sync_shared_policies(self, publish=False):
+        """Aplica las políticas definidas en otros workers; con publish deja el estado completo compartido"""
+        if not self.shared_state:
+            return
+        for container_name, timeout in self.shared_state.get('idle_policies', {}).items():
+            if timeout is None:
+                self.idle_policies.pop(container_name, None)
+            else:
+                self.idle_policies[container_name] = timeout
+        if publish:
+            self.shared_state.set('idle_policies', dict(self.idle_policies))
+    
+    def get_idle_timeout(self, container_name: str) -> int:
+        """Timeout de inactividad efectivo para un contenedor"""
+        return self.idle_policies.get(container_name, self.inactivity_timeout)
+    
     def update_activity(self, container_name: str):
         """Actualiza el timestamp de última actividad de un contenedor"""
-        self.last_activity[container_name] = time.time()
+        now = time.time()
+        self.last_activity[container_name] = now
+        if self.shared_state:
+            # El worker líder la consume en su ciclo (merge_shared_activity)
+            self.shared_state.record_activity(container_name, now)
         logger.debug(f"📊 Actividad actualizada para {container_name}")
     
+    def apply_activity_batch(self, batch: Dict[str, Dict]) -> List[str]:
+        """
+        Aplica un lote de actividad agregado desde el log de Nginx
+        
+        Args:
+            batch: {container_name: {'last_seen': timestamp, 'count': peticiones}}
+            
+        Returns:
+            Contenedores con tráfico que fueron detenidos por inactividad
+            y deben reiniciarse
+        """
+        to_wake = []
+        for container_name, entry in batch.items():
+            last_seen = entry['last_seen']
+            if last_seen > self.last_activity.get(container_name, 0):
+                self.last_activity[container_name] = last_seen
+            self.request_counts[container_name] = self.request_counts.get(container_name, 0) + entry['count']
+            
+            histogram = self.access_histogram.get(container_name)
+            if histogram is None:
+                histogram = self.access_histogram[container_name] = [0.0] * HOURS_PER_WEEK
+            histogram[hour_of_week(last_seen)] += entry['count']
+            
+            if container_name in self.stopped_containers:
+                to_wake.append(container_name)
+        
+        if self.shared_state and batch:
+            self.shared_state.publish_activity({name: self.last_activity[name] for name in batch})
+        return to_wake
+    
+    def merge_shared_activity(self):
+        """Incorpora la actividad registrada por otros workers (solo en el líder)"""
+        if not self.shared_state:
+            return
+        batch = self.shared_state.drain_activity()
+        if batch:
+            self.apply_activity_batch(batch)
+            logger.debug(f"📊 Actividad de otros workers: {len(batch)} contenedores")
+    
+    def _decay_histograms(self):
+        """Reduce el peso de semanas anteriores una vez por semana"""
+        if time.time() - self.histogram_decayed_at < 7 * 24 * 3600:
+            return
+        for container_name, histogram in list(self.access_histogram.items()):
+            decayed = [round(v * self.histogram_decay, 2) for v in histogram]
+            if any(decayed):
+                self.access_histogram[container_name] = decayed
+            else:
+                del self.access_histogram[container_name]
+        self.histogram_decayed_at = time.time()
+    
     def _monitor_loop(self):
         """Loop principal de monitoreo"""
         logger.info("🔄 Loop de monitoreo iniciado")
         
         while self.monitoring:
             try:
+                self.merge_shared_activity()
+                self._sync_shared_policies()
                 self._check_inactive_containers()
+                self._decay_histograms()
+                if time.time() - self.last_snapshot >= self.snapshot_interval:
+                    self.save_snapshot()
                 time.sleep(60)  # Verificar cada 60 segundos
             except Exception as e:
                 logger.error(f"❌ Error en loop de monitoreo: {e}")
@@ -60,27 +223,74 @@ class ActivityMonitor:
             containers = self.docker_client.containers.list(
                 filters={'name': 'project_'}
             )
+            idle_containers = []
             
             for container in containers:
                 container_name = container.name
                 
-                # Si no hay registro de actividad, crearlo con tiempo actual
-                if container_name not in self.last_activity:
-                    self.last_activity[container_name] = current_time
-                    continue
+                # El arranque del contenedor cuenta como actividad: cubre contenedores
+                # sin registro y timestamps restaurados anteriores a un reinicio
+                started_at = self._get_started_at(container)
+                last_active = self.last_activity.get(container_name)
+                if last_active is None:
+                    last_active = started_at or current_time
+                elif started_at and started_at > last_active:
+                    last_active = started_at
+                self.last_activity[container_name] = last_active
+                if container.status == 'running':
+                    self.stopped_containers.discard(container_name)
                 
                 # Calcular tiempo de inactividad
-                last_active = self.last_activity[container_name]
                 inactive_time = current_time - last_active
                 
                 # Si supera el timeout, detener contenedor
-                if inactive_time > self.inactivity_timeout:
+                if inactive_time > self.get_idle_timeout(container_name):
+                    if self.prewarm_scheduler and self.prewarm_scheduler.is_protected(container_name):
+                        logger.info(f"🔮 {container_name} inactivo pero con tráfico previsto, no se detiene")
+                        continue
                     logger.info(f"⏱️ Contenedor {container_name} inactivo por {int(inactive_time/60)} minutos")
-                    self._stop_container(container)
+                    idle_containers.append(container)
+            
+            self._stop_containers(idle_containers)
                     
         except Exception as e:
             logger.error(f"❌ Error verificando contenedores inactivos: {e}")
     
+    def _get_started_at(self, container) -> Optional[float]:
+        """Timestamp de arranque del contenedor según Docker"""
+        state = container.attrs.get('State')
+        started_at = state.get('StartedAt') if isinstance(state, dict) else None
+        if not started_at or started_at.startswith('0001-'):
+            return None
+        
+        try:
+            # Docker usa nanosegundos (2024-01-01T12:00:00.123456789Z); datetime admite microsegundos
+            base, _, fraction = started_at.rstrip('Z').partition('.')
+            fraction = ''.join(ch for ch in fraction if ch.isdigit())[:6]
+            parsed = datetime.fromisoformat(f"{base}.{fraction or '0'}")
+            return parsed.replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            return None
+    
+    def _stop_containers(self, containers):
+        """Detiene un lote de contenedores inactivos, en paralelo si hay ejecutor"""
+        if not containers:
+            return
+        
+        if not self.executor:
+            for container in containers:
+                self._stop_container(container)
+            return
+        
+        summary = self.executor.run_batch('stop', containers, timeout=30)
+        for result in summary['results']:
+            container_name = result['container_name']
+            if result['status'] == 'ok':
+                self.last_activity.pop(container_name, None)
+                self.mark_stopped(container_name)
+            else:
+                logger.error(f"❌ Error deteniendo contenedor {container_name}: {result['error']}")
+    
     def _stop_container(self, container):
         """Detiene un contenedor por inactividad"""
         try:
@@ -92,10 +302,15 @@ class ActivityMonitor:
             # Eliminar de registro de actividad
             if container_name in self.last_activity:
                 del self.last_activity[container_name]
+            self.mark_stopped(container_name)
                 
         except Exception as e:
             logger.error(f"❌ Error deteniendo contenedor {container.name}: {e}")
     
+    def mark_stopped(self, container_name: str):
+        """Registra un contenedor detenido o pausado por el manager para reiniciarlo al recibir tráfico"""
+        self.stopped_containers.add(container_name)
+    
     def restart_container_if_stopped(self, container_name: str) -> bool:
         """
         Reinicia un contenedor si está detenido
@@ -107,19 +322,37 @@ class ActivityMonitor:
         try:
             container = self.docker_client.containers.get(container_name)
             
+            if container.status in ('exited', 'paused') and self.resource_budget:
+                memory, cpus = self.resource_budget.get_container_limits(container)
+                if container.status == 'paused':
+                    memory = 0  # Un contenedor pausado ya tiene su memoria asignada
+                if not self.resource_budget.ensure_capacity(memory, cpus, 'wake', container_name):
+                    logger.warning(f"⚠️ Sin presupuesto para reiniciar {container_name}")
+                    return False
+            
+            if container.status == 'paused':
+                logger.info(f"▶️ Reanudando contenedor pausado: {container_name}")
+                container.unpause()
+                self.update_activity(container_name)
+                self.stopped_containers.discard(container_name)
+                return True
+            
             if container.status == 'exited':
                 logger.info(f"🔄 Reiniciando contenedor: {container_name}")
                 container.start()
                 self.update_activity(container_name)
+                self.stopped_containers.discard(container_name)
                 logger.info(f"✅ Contenedor {container_name} reiniciado")
                 return True
             else:
                 # Ya está corriendo, solo actualizar actividad
                 self.update_activity(container_name)
+                self.stopped_containers.discard(container_name)
                 return False
                 
         except docker.errors.NotFound:
             logger.warning(f"⚠️ Contenedor {container_name} no encontrado")
+            self.stopped_containers.discard(container_name)
             return False
         except Exception as e:
             logger.error(f"❌ Error reiniciando contenedor {container_name}: {e}")
@@ -132,6 +365,12 @@ class ActivityMonitor:
         Returns:
             Segundos de inactividad, o 0 si no hay registro
         """
+        if self.shared_state:
+            # En un worker no líder el estado local está vacío: se lee el compartido
+            shared = self.shared_state.get_activity(container_name)
+            if shared and shared > self.last_activity.get(container_name, 0):
+                self.last_activity[container_name] = shared
+        
         if container_name not in self.last_activity:
             return 0
         
@@ -0,0 +1,115 @@
+"""
+Persistencia del estado del monitor de actividad
+Guarda en SQLite los timestamps de actividad, la política de inactividad
+y el histograma de accesos por hora de la semana de cada proyecto (con la
+fecha de su último decaimiento semanal)
+"""
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ActivityStore:
+    """Snapshot en disco del estado de ActivityMonitor"""
+
+    def __init__(self, db_path='/data/activity.db'):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _init_db(self):
+        """Crea la tabla si no existe"""
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS activity (
+                    container_name TEXT PRIMARY KEY,
+                    last_activity REAL,
+                    request_count INTEGER NOT NULL DEFAULT 0,
+                    idle_timeout INTEGER,
+                    stopped INTEGER NOT NULL DEFAULT 0,
+                    histogram TEXT
+                )
+            """)
+            # Migración de bases creadas antes del histograma de accesos
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(activity)')}
+            if 'histogram' not in columns:
+                conn.execute('ALTER TABLE activity ADD COLUMN histogram TEXT')
+            # Valores globales del monitor (no son de un contenedor)
+            conn.execute('CREATE TABLE IF NOT EXISTS activity_meta (key TEXT PRIMARY KEY, value REAL)')
+
+    def load(self) -> Dict[str, Dict]:
+        """
+        Carga el último snapshot
+
+        Returns:
+            {container_name: {'last_activity', 'request_count', 'idle_timeout', 'stopped', 'histogram'}}
+        """
+        try:
+            with self._lock, self._connect() as conn:
+                rows = conn.execute(
+                    'SELECT container_name, last_activity, request_count, idle_timeout, stopped, histogram FROM activity'
+                ).fetchall()
+        except Exception as e:
+            logger.error(f"❌ Error cargando estado de actividad: {e}")
+            return {}
+
+        return {
+            name: {
+                'last_activity': last_activity,
+                'request_count': request_count,
+                'idle_timeout': idle_timeout,
+                'stopped': bool(stopped),
+                'histogram': json.loads(histogram) if histogram else None
+            }
+            for name, last_activity, request_count, idle_timeout, stopped, histogram in rows
+        }
+
+    def load_meta(self) -> Dict[str, float]:
+        """Valores globales del último snapshot, p. ej. {'histogram_decayed_at': timestamp}"""
+        try:
+            with self._lock, self._connect() as conn:
+                return dict(conn.execute('SELECT key, value FROM activity_meta').fetchall())
+        except Exception as e:
+            logger.error(f"❌ Error cargando estado de actividad: {e}")
+            return {}
+
+    def save_snapshot(self, last_activity: Dict[str, float], request_counts: Dict[str, int],
+                      idle_policies: Dict[str, int], stopped: Iterable[str],
+                      histograms: Optional[Dict[str, List[float]]] = None,
+                      meta: Optional[Dict[str, float]] = None):
+        """Reemplaza el snapshot completo en una sola transacción"""
+        stopped = set(stopped)
+        histograms = histograms or {}
+        names = set(last_activity) | set(idle_policies) | stopped | set(histograms)
+        rows = [
+            (
+                name,
+                last_activity.get(name),
+                request_counts.get(name, 0),
+                idle_policies.get(name),
+                1 if name in stopped else 0,
+                json.dumps([round(v, 2) for v in histograms[name]]) if name in histograms else None
+            )
+            for name in names
+        ]
+
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM activity')
+            conn.executemany(
+                'INSERT INTO activity (container_name, last_activity, request_count, idle_timeout, stopped, histogram) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            if meta:
+                conn.executemany('INSERT OR REPLACE INTO activity_meta (key, value) VALUES (?, ?)', meta.items())
+        logger.debug(f"💾 Snapshot de actividad guardado: {len(rows)} contenedores")
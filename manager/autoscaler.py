@@ -0,0 +1,260 @@
+"""
+Autoescalado de réplicas de microservicios
+El líder ajusta el número de contenedores de cada servicio con política de
+escalado entre min/max según peticiones por segundo, peticiones en curso y p95
+que publican los gateways de todos los workers, con cooldowns de subida y bajada
+"""
+import math
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Política por defecto; las réplicas cuentan el contenedor principal
+DEFAULT_POLICY = {
+    'min_replicas': 1,
+    'max_replicas': 1,
+    'target_rps': 20,  # peticiones por segundo que atiende cómodamente una réplica
+    'target_in_flight': 4,  # peticiones en curso por réplica
+    'max_p95_ms': 1000,  # por encima se añade una réplica aunque rps/in-flight no lo pidan
+    'scale_up_cooldown': 30,  # segundos mínimos entre subidas
+    'scale_down_cooldown': 180  # segundos mínimos desde el último cambio antes de bajar
+}
+
+class ReplicaAutoscaler:
+    """Escala réplicas de servicios (políticas y réplicas en el estado compartido)"""
+
+    def __init__(self, registry, shared_state, spawn_replica: Callable[[str, Dict], Optional[Dict]],
+                 remove_replica: Callable[[Dict], bool], list_alive: Optional[Callable[[], set]] = None,
+                 interval=15, max_replicas=8, load_ttl=30, lookup_ttl=1.0):
+        self.registry = registry
+        self.shared_state = shared_state
+        self.spawn_replica = spawn_replica  # (service_name, service_info) -> réplica o None
+        self.remove_replica = remove_replica  # (réplica) -> bool
+        self.list_alive = list_alive  # nombres de contenedores en ejecución (para descartar réplicas caídas)
+        self.interval = interval  # segundos entre evaluaciones
+        self.max_replicas = max_replicas  # tope absoluto por servicio
+        self.load_ttl = load_ttl  # segundos tras los que se ignora la carga publicada por un worker
+        self.lookup_ttl = lookup_ttl  # caché de réplicas para el gateway
+        self.decisions = {}  # {service_name: última evaluación}
+        self.metrics = {'scale_ups': 0, 'scale_downs': 0, 'spawn_failures': 0}
+        self._last_counts = {}  # {(worker_id, service_name): peticiones acumuladas}
+        self._last_tick = None
+        self._last_change = {}  # {service_name: {'up': ts, 'change': ts}}
+        self._replica_cache = ({}, 0)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.running = False
+        self.scaler_thread = None
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self._stop.clear()
+            self.scaler_thread = threading.Thread(target=self._scaling_loop, daemon=True)
+            self.scaler_thread.start()
+            logger.info(f"📈 Autoescalado de réplicas iniciado (cada {self.interval}s)")
+
+    def stop(self):
+        self.running = False
+        self._stop.set()
+
+    # --- Políticas ---
+
+    def validate_policy(self, data: Dict, current: Optional[Dict] = None) -> Tuple[Optional[Dict], Optional[str]]:
+        """Combina `data` con la política actual; devuelve (política, error)"""
+        policy = dict(current or DEFAULT_POLICY)
+        for key, value in data.items():
+            if key not in DEFAULT_POLICY:
+                return None, f"Campo de escalado desconocido: {key}"
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+                return None, f"{key} debe ser un número no negativo"
+            policy[key] = int(value) if key.endswith('_replicas') else value
+        if policy['min_replicas'] < 1:
+            return None, "min_replicas debe ser al menos 1"
+        if policy['max_replicas'] < policy['min_replicas']:
+            return None, "max_replicas debe ser mayor o igual que min_replicas"
+        if policy['max_replicas'] > self.max_replicas:
+            return None, f"max_replicas no puede superar {self.max_replicas}"
+        if policy['target_rps'] <= 0 or policy['target_in_flight'] <= 0:
+            return None, "target_rps y target_in_flight deben ser mayores que 0"
+        return policy, None
+
+    def get_policy(self, service_name: str) -> Optional[Dict]:
+        return (self.shared_state.get('scaling_policies') or {}).get(service_name)
+
+    def set_policy(self, service_name: str, policy: Optional[Dict]):
+        """Guarda la política (None la elimina; las réplicas sobrantes se retiran en el siguiente ciclo)"""
+        self.shared_state.update_mapping('scaling_policies', service_name, policy)
+
+    # --- Réplicas ---
+
+    def get_replicas(self, service_name: str) -> List[Dict]:
+        """Réplicas adicionales de un servicio (caché de lookup_ttl segundos para el gateway)"""
+        replicas, loaded_at = self._replica_cache
+        if time.time() - loaded_at >= self.lookup_ttl:
+            replicas = self.shared_state.get('service_replicas') or {}
+            self._replica_cache = (replicas, time.time())
+        return replicas.get(service_name) or []
+
+    def _update_replicas(self, service_name: str, func: Callable[[List[Dict]], List[Dict]]):
+        def apply(mapping):
+            mapping = mapping or {}
+            replicas = func(list(mapping.get(service_name) or []))
+            if replicas:
+                mapping[service_name] = replicas
+            else:
+                mapping.pop(service_name, None)
+            return mapping
+        self._replica_cache = (self.shared_state.mutate('service_replicas', apply, {}), time.time())
+
+    def remove_all(self, service_name: str):
+        """Elimina las réplicas de un servicio (al borrarlo o al cambiar su código)"""
+        for replica in self.get_replicas_fresh(service_name):
+            self.remove_replica(replica)
+        self._update_replicas(service_name, lambda replicas: [])
+
+    def get_replicas_fresh(self, service_name: str) -> List[Dict]:
+        return (self.shared_state.get('service_replicas') or {}).get(service_name) or []
+
+    # --- Carga ---
+
+    def _collect_load(self, now: float, elapsed: float) -> Dict[str, Dict]:
+        """Suma la carga publicada por los gateways de todos los workers"""
+        load = {}
+        stale = []
+        for worker_id, snapshot in (self.shared_state.get('gateway_load') or {}).items():
+            if now - snapshot.get('at', 0) > self.load_ttl:
+                if now - snapshot.get('at', 0) > self.load_ttl * 20:
+                    stale.append(worker_id)
+                continue
+            for name, stats in snapshot.get('services', {}).items():
+                service_load = load.setdefault(name, {'rps': 0.0, 'in_flight': 0, 'p95_ms': None})
+                previous = self._last_counts.get((worker_id, name))
+                self._last_counts[(worker_id, name)] = stats['requests']
+                if previous is not None and elapsed:
+                    service_load['rps'] += max(0, stats['requests'] - previous) / elapsed
+                service_load['in_flight'] += stats.get('in_flight', 0)
+                if stats.get('p95_ms') is not None:
+                    service_load['p95_ms'] = max(service_load['p95_ms'] or 0, stats['p95_ms'])
+        if stale:
+            # Workers que ya no existen
+            self.shared_state.mutate('gateway_load', lambda m: {k: v for k, v in (m or {}).items() if k not in stale}, {})
+        return load
+
+    def desired_replicas(self, policy: Dict, current: int, load: Dict) -> int:
+        """Réplicas necesarias para la carga observada, dentro de [min, max]"""
+        desired = max(
+            math.ceil(load.get('rps', 0) / policy['target_rps']),
+            math.ceil(load.get('in_flight', 0) / policy['target_in_flight'])
+        )
+        if load.get('p95_ms') is not None and load['p95_ms'] > policy['max_p95_ms']:
+            desired = max(desired, current + 1)
+        return max(policy['min_replicas'], min(policy['max_replicas'], desired))
+
+    # --- Ciclo ---
+
+    def _scaling_loop(self):
+        while self.running:
+            try:
+                self.evaluate()
+            except Exception as e:
+                logger.error(f"❌ Error en autoescalado: {e}")
+            self._stop.wait(self.interval)
+
+    def evaluate(self):
+        """Una evaluación de todos los servicios con política"""
+        now = time.time()
+        elapsed = now - self._last_tick if self._last_tick else 0
+        self._last_tick = now
+        load = self._collect_load(now, elapsed)
+        policies = self.shared_state.get('scaling_policies') or {}
+        self._drop_dead_replicas()
+
+        for service_name in set(policies) | set(self.shared_state.get('service_replicas') or {}):
+            service_info = self.registry.get(service_name)
+            if not service_info:
+                # Servicio eliminado: sus réplicas sobran
+                self.remove_all(service_name)
+                continue
+            policy = policies.get(service_name) or dict(DEFAULT_POLICY)
+            replicas = self.get_replicas_fresh(service_name)
+            current = 1 + len(replicas)
+            service_load = load.get(service_name, {})
+            desired = self.desired_replicas(policy, current, service_load)
+            with self._lock:
+                self.decisions[service_name] = {
+                    'current': current, 'desired': desired, 'evaluated_at': now,
+                    'rps': round(service_load.get('rps', 0), 2),
+                    'in_flight': service_load.get('in_flight', 0),
+                    'p95_ms': service_load.get('p95_ms')
+                }
+            self._apply(service_name, service_info, policy, current, desired, now)
+
+    def _apply(self, service_name: str, service_info: Dict, policy: Dict, current: int, desired: int, now: float):
+        # Primera vez que se ve el servicio (p. ej. nuevo líder): sin datos de carga aún, no se baja enseguida
+        changes = self._last_change.setdefault(service_name, {'up': 0, 'change': now})
+        below_min = current < policy['min_replicas']
+        above_max = current > policy['max_replicas']
+
+        if desired > current and (below_min or now - changes['up'] >= policy['scale_up_cooldown']):
+            added = 0
+            for _ in range(desired - current):
+                replica = self.spawn_replica(service_name, service_info)
+                if not replica:
+                    self.metrics['spawn_failures'] += 1
+                    break
+                self._update_replicas(service_name, lambda replicas: replicas + [replica])
+                added += 1
+            if added:
+                changes['up'] = changes['change'] = now
+                self.metrics['scale_ups'] += 1
+                logger.info(f"📈 {service_name}: {current} → {current + added} réplicas")
+
+        elif desired < current and (above_max or now - changes['change'] >= policy['scale_down_cooldown']):
+            # Bajada gradual: una réplica por ciclo (todas las sobrantes si se redujo max_replicas)
+            remove_count = current - policy['max_replicas'] if above_max else 1
+            replicas = self.get_replicas_fresh(service_name)
+            victims = replicas[-remove_count:]
+            victim_names = {r['container_name'] for r in victims}
+            self._update_replicas(service_name, lambda rs: [r for r in rs if r['container_name'] not in victim_names])
+            # El gateway deja de enviarles tráfico antes de eliminarlas
+            time.sleep(self.lookup_ttl)
+            for replica in victims:
+                self.remove_replica(replica)
+            changes['change'] = now
+            self.metrics['scale_downs'] += 1
+            logger.info(f"📉 {service_name}: {current} → {current - len(victims)} réplicas")
+
+    def _drop_dead_replicas(self):
+        """Quita del registro las réplicas cuyo contenedor ya no está en ejecución"""
+        if not self.list_alive:
+            return
+        registered = self.shared_state.get('service_replicas') or {}
+        if not registered:
+            return
+        alive = self.list_alive()
+        for service_name, replicas in registered.items():
+            dead = {r['container_name'] for r in replicas if r['container_name'] not in alive}
+            if dead:
+                logger.warning(f"⚠️ {service_name}: {len(dead)} réplicas caídas fuera del balanceo")
+                for replica in replicas:
+                    if replica['container_name'] in dead:
+                        self.remove_replica(replica)
+                self._update_replicas(service_name, lambda rs: [r for r in rs if r['container_name'] not in dead])
+
+    def get_service_stats(self, service_name: str) -> Dict:
+        with self._lock:
+            decision = dict(self.decisions.get(service_name) or {})
+        return {
+            'policy': self.get_policy(service_name),
+            'replicas': self.get_replicas_fresh(service_name),
+            'last_decision': decision or None
+        }
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            decisions = {name: dict(d) for name, d in self.decisions.items()}
+        return dict(self.metrics, running=self.running, services=decisions)
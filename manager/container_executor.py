@@ -0,0 +1,143 @@
+"""
+Ejecutor concurrente de operaciones de ciclo de vida de contenedores
+Detiene, inicia o elimina lotes de contenedores en un pool de threads acotado
+"""
+import time
+import logging
+import threading
+import docker
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ContainerExecutor:
+    """Pool de threads para operaciones Docker en lote con timeout por contenedor"""
+
+    ACTIONS = ('stop', 'start', 'remove')
+
+    def __init__(self, docker_client, max_workers=8, default_timeout=30):
+        self.docker_client = docker_client
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout  # segundos por contenedor
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='container-op')
+        self.metrics = {
+            'batches': 0,
+            'operations': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'timed_out': 0
+        }
+        self._lock = threading.Lock()
+
+    def _resolve(self, container):
+        """Acepta un objeto Container o un nombre/id"""
+        if isinstance(container, str):
+            return self.docker_client.containers.get(container)
+        return container
+
+    def _builtin_operation(self, action: str, stop_timeout: int) -> Callable:
+        def operation(container):
+            if action == 'stop':
+                container.stop(timeout=stop_timeout)
+            elif action == 'start':
+                container.start()
+            elif action == 'remove':
+                container.remove(force=True)
+            return True
+        return operation
+
+    def run_batch(self, action: str, containers: List, timeout: Optional[int] = None,
+                  operation: Optional[Callable] = None, stop_timeout: int = 10) -> Dict:
+        """
+        Ejecuta una operación sobre varios contenedores en paralelo
+
+        Args:
+            action: Nombre de la operación ('stop', 'start', 'remove' o una
+                    etiqueta libre si se pasa operation)
+            containers: Objetos Container o nombres/ids
+            timeout: Segundos máximos por contenedor, contados desde que empieza
+            operation: Función propia (container) -> bool; por defecto la acción Docker
+            stop_timeout: Timeout que se pasa a container.stop()
+
+        Returns:
+            {'action', 'total', 'succeeded', 'failed', 'timed_out', 'duration', 'results': [...]}
+        """
+        if operation is None:
+            if action not in self.ACTIONS:
+                raise ValueError(f"Acción no soportada: {action}")
+            operation = self._builtin_operation(action, stop_timeout)
+
+        timeout = timeout or self.default_timeout
+        batch_start = time.time()
+        started_at = {}  # {container_name: timestamp en que empezó a ejecutarse}
+
+        def task(container):
+            name = container if isinstance(container, str) else container.name
+            op_start = time.time()
+            started_at[name] = op_start
+            try:
+                success = operation(self._resolve(container))
+                return {'container_name': name, 'status': 'ok' if success is not False else 'failed',
+                        'error': None, 'duration': round(time.time() - op_start, 3)}
+            except docker.errors.NotFound:
+                return {'container_name': name, 'status': 'failed', 'error': 'not_found',
+                        'duration': round(time.time() - op_start, 3)}
+            except Exception as e:
+                return {'container_name': name, 'status': 'failed', 'error': str(e),
+                        'duration': round(time.time() - op_start, 3)}
+
+        pending = {}
+        for container in containers:
+            name = container if isinstance(container, str) else container.name
+            pending[self.pool.submit(task, container)] = name
+
+        results = []
+        while pending:
+            done, _ = wait(list(pending), timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                results.append(future.result())
+
+            # Timeout por contenedor: solo cuenta desde que la operación arrancó
+            now = time.time()
+            for future, name in list(pending.items()):
+                op_start = started_at.get(name)
+                if op_start and now - op_start > timeout:
+                    pending.pop(future)
+                    results.append({'container_name': name, 'status': 'timeout',
+                                    'error': f'Sin respuesta tras {timeout}s', 'duration': round(now - op_start, 3)})
+                    logger.warning(f"⏱️ {action} de {name} excedió {timeout}s")
+
+        summary = {
+            'action': action,
+            'total': len(results),
+            'succeeded': sum(1 for r in results if r['status'] == 'ok'),
+            'failed': sum(1 for r in results if r['status'] == 'failed'),
+            'timed_out': sum(1 for r in results if r['status'] == 'timeout'),
+            'duration': round(time.time() - batch_start, 3),
+            'results': results
+        }
+
+        with self._lock:
+            self.metrics['batches'] += 1
+            self.metrics['operations'] += summary['total']
+            self.metrics['succeeded'] += summary['succeeded']
+            self.metrics['failed'] += summary['failed']
+            self.metrics['timed_out'] += summary['timed_out']
+
+        if results:
+            logger.info(
+                f"⚡ Lote {action}: {summary['succeeded']}/{summary['total']} ok, "
+                f"{summary['failed']} fallidos, {summary['timed_out']} timeout en {summary['duration']}s"
+            )
+        return summary
+
+    def get_stats(self) -> Dict:
+        """Métricas acumuladas del ejecutor"""
+        with self._lock:
+            return dict(self.metrics, max_workers=self.max_workers)
+
+    def shutdown(self):
+        """Cierra el pool sin esperar operaciones colgadas"""
+        self.pool.shutdown(wait=False)
@@ -17,28 +17,52 @@ logger = logging.getLogger(__name__)
 class DeployService:
     """Servicio para desplegar proyectos desde GitHub"""
     
+    # Límites por contenedor de proyecto
+    CONTAINER_MEM_LIMIT = "256m"
+    CONTAINER_MEMORY_BYTES = 256 * 1024 * 1024
+    CONTAINER_CPU_QUOTA = 50000  # 0.5 CPU
+    CONTAINER_CPUS = 0.5
+    
     def __init__(self, docker_client, nginx_conf_dir='/nginx_configs'):
         self.docker_client = docker_client
+        self.resource_budget = None  # ResourceBudget opcional (lo asigna el manager)
         self.base_port = 7000  # Cambiado de 6000 a 7000 para evitar conflictos
         self.used_ports = set()
+        self.shared_state = None  # SharedState opcional: reserva de puertos común a todos los workers
         self.nginx_conf_dir = nginx_conf_dir
-        self._load_used_ports()
+        self.ports_loaded = False  # Los puertos en uso se cargan al primer deploy o en el arranque diferido
     
-    def _load_used_ports(self):
-        """Carga los puertos ya en uso"""
+    def load_used_ports(self):
+        """Carga los puertos ya en uso (una sola llamada de listado, sin inspeccionar cada contenedor)"""
         try:
-            containers = self.docker_client.containers.list(all=True)
+            containers = self.docker_client.containers.list(all=True, sparse=True, filters={'name': 'project_'})
             for container in containers:
-                if container.name.startswith('project_'):
-                    for port_binding in container.attrs.get('NetworkSettings', {}).get('Ports', {}).values():
-                        if port_binding:
-                            for binding in port_binding:
-                                self.used_ports.add(int(binding['HostPort']))
+                for binding in container.attrs.get('Ports') or []:
+                    if binding.get('PublicPort'):
+                        self.used_ports.add(int(binding['PublicPort']))
+            self.ports_loaded = True
+            if self.shared_state:
+                self.shared_state.sync_ports('projects', self.used_ports)
         except Exception as e:
             logger.error(f"Error cargando puertos: {e}")
     
+    def attach_shared_state(self, shared_state):
+        """Usa el estado compartido para la reserva de puertos"""
+        self.shared_state = shared_state
+        if self.ports_loaded:
+            shared_state.sync_ports('projects', self.used_ports)
+    
     def _get_next_port(self) -> int:
         """Obtiene el siguiente puerto disponible"""
+        if not self.ports_loaded:
+            self.load_used_ports()
+        
+        if self.shared_state:
+            port = self.shared_state.claim_port('projects', self.base_port, 7999)
+            if port is None:
+                raise RuntimeError("No hay puertos disponibles en el rango 7000-7999")
+            return port
+        
         port = self.base_port
         while port in self.used_ports or port > 7999:  # Rango 7000-7999
             port += 1
@@ -48,7 +72,10 @@ class DeployService:
     def _release_port(self, port: int):
         """Libera un puerto para que pueda ser reutilizado"""
         try:
-            if port in self.used_ports:
+            if self.shared_state:
+                self.shared_state.release_port('projects', port)
+                logger.info(f"🔓 Puerto {port} liberado y disponible para reutilizar")
+            elif port in self.used_ports:
                 self.used_ports.remove(port)
                 logger.info(f"🔓 Puerto {port} liberado y disponible para reutilizar")
         except Exception as e:
@@ -131,14 +158,19 @@ class DeployService:
         """
         max_retries = 10  # Intentar hasta 10 puertos diferentes
         
+        # Nombre del contenedor
+        container_name = f"project_{user_id}_{project_name}".lower().replace('@', '_').replace('.', '_')
+        
+        # Verificar presupuesto global (puede desalojar proyectos inactivos)
+        if self.resource_budget and not self.resource_budget.ensure_capacity(
+                self.CONTAINER_MEMORY_BYTES, self.CONTAINER_CPUS, 'deploy', container_name):
+            return False, "Presupuesto de recursos del host agotado", None, None
+        
         for attempt in range(max_retries):
             try:
                 # Asignar puerto
                 port = self._get_next_port()
                 
-                # Nombre del contenedor
-                container_name = f"project_{user_id}_{project_name}".lower().replace('@', '_').replace('.', '_')
-                
                 logger.info(f"Desplegando contenedor: {container_name} en puerto {port} (intento {attempt + 1})")
                 
                 # Mapear un solo puerto interno al puerto externo
@@ -156,8 +188,8 @@ class DeployService:
                     ports=port_bindings,
                     network='host_roble_microservices_network',  # Red compartida con Nginx
                     restart_policy={"Name": "no"},
-                    mem_limit="256m",
-                    cpu_quota=50000,  # 0.5 CPU
+                    mem_limit=self.CONTAINER_MEM_LIMIT,
+                    cpu_quota=self.CONTAINER_CPU_QUOTA,  # 0.5 CPU
                     labels={
                         "project_id": project_id,
                         "user_id": user_id,
@@ -376,6 +408,9 @@ server {{
     # Rate limiting: burst de 20 requests, delay después de 10
     limit_req zone=project_limit burst=20 delay=10;
 
+    # Actividad: Nginx escribe en buffer y el manager lee el log en lotes
+    access_log /var/log/nginx/roble/activity.log roble_activity buffer=32k flush=5s;
+
     location / {{
         proxy_pass http://{container_name}:80;
         proxy_set_header Host $host;
@@ -0,0 +1,61 @@
+"""
+Cliente Docker compartido por todo el manager
+Se crea una sola vez, al primer uso; si Docker no responde se reintenta
+como mucho cada RETRY_INTERVAL segundos en lugar de en cada petición.
+LazyDockerClient resuelve el cliente en cada uso, de modo que los subsistemas
+creados al importar funcionan en cuanto Docker responde
+"""
+import time
+import logging
+import threading
+import docker
+
+logger = logging.getLogger(__name__)
+
+RETRY_INTERVAL = 30
+
+_client = None
+_failed_at = 0
+_lock = threading.Lock()
+
+def get_docker_client():
+    """
+    Devuelve el cliente Docker compartido
+
+    Returns:
+        DockerClient o None si Docker no está disponible
+    """
+    global _client, _failed_at
+    if _client is not None:
+        return _client
+
+    with _lock:
+        if _client is not None:
+            return _client
+        if _failed_at and time.time() - _failed_at < RETRY_INTERVAL:
+            return None
+        try:
+            started = time.time()
+            _client = docker.from_env()
+            logger.info(f"✅ Cliente Docker conectado ({(time.time() - started) * 1000:.0f}ms)")
+        except Exception as e:
+            _failed_at = time.time()
+            logger.error(f"❌ Error conectando con Docker: {e}")
+        return _client
+
+class LazyDockerClient:
+    """
+    Cliente Docker que se obtiene con get_docker_client() en cada uso
+
+    Es falso mientras Docker no esté disponible (`if not docker_client:`) y
+    cualquier llamada lanza DockerException en ese caso; no conecta al crearse
+    """
+
+    def __bool__(self):
+        return get_docker_client() is not None
+
+    def __getattr__(self, name):
+        client = get_docker_client()
+        if client is None:
+            raise docker.errors.DockerException("Docker no disponible")
+        return getattr(client, name)
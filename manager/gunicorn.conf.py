@@ -0,0 +1,23 @@
+"""
+Configuración de gunicorn para el manager
+Varios procesos worker con threads; el estado común vive en SharedState y las
+tareas en segundo plano solo corren en el worker que tiene el lease de líder
+"""
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('MANAGER_PORT', '5000')}"
+workers = int(os.getenv('MANAGER_WORKERS', str(min(multiprocessing.cpu_count(), 4))))
+threads = int(os.getenv('MANAGER_THREADS', '8'))
+worker_class = 'gthread'
+# Los builds de imágenes y despliegues se atienden dentro de la petición
+timeout = int(os.getenv('MANAGER_TIMEOUT', '300'))
+graceful_timeout = 30
+accesslog = '-'
+
+def worker_exit(server, worker):
+    """Libera el lease al salir para que otro worker tome el rol de líder sin esperar el TTL"""
+    import sys
+    manager = sys.modules.get('manager')
+    if manager is not None:
+        manager.leader_election.stop()
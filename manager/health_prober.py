@@ -0,0 +1,156 @@
+"""
+Sondeo de salud en segundo plano para los microservicios registrados
+Consulta /health de todos los servicios en paralelo y guarda el resultado en el registro.
+Solo el líder sondea de forma periódica; con estado compartido publica los
+resultados y los demás workers los copian a su registro al leerlo
+"""
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+HEALTH_FIELDS = ('status', 'health_latency_ms', 'consecutive_failures', 'last_health_check', 'last_health_error')
+
+class HealthProber:
+    """Mantiene en caché el estado de salud de cada microservicio"""
+
+    SHARED_KEY = 'health_status'
+
+    def __init__(self, registry, interval=15, timeout=3, max_workers=8):
+        self.registry = registry  # dict {name: service_info} compartido con el manager
+        self.interval = interval  # segundos entre rondas
+        self.timeout = timeout  # timeout de cada /health
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='health-probe')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.running = False
+        self.prober_thread = None
+        self._wakeup = threading.Event()
+        self.rounds = 0
+        self.shared_state = None  # SharedState opcional: resultados visibles para todos los workers
+        self.sync_interval = 1.0  # segundos entre lecturas del estado compartido
+        self._synced_at = 0
+
+    def attach_shared_state(self, shared_state):
+        """Publica los resultados en el estado compartido y los lee de ahí si este worker no sondea"""
+        self.shared_state = shared_state
+
+    def start(self):
+        """Inicia el sondeo periódico en un thread separado"""
+        if not self.running:
+            self.running = True
+            self.prober_thread = threading.Thread(target=self._probe_loop, daemon=True)
+            self.prober_thread.start()
+            logger.info(f"🩺 Sondeo de salud iniciado (cada {self.interval}s)")
+
+    def stop(self):
+        """Detiene el sondeo"""
+        self.running = False
+        self._wakeup.set()
+        if self.prober_thread:
+            self.prober_thread.join(timeout=5)
+
+    def _probe_loop(self):
+        while self.running:
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.error(f"❌ Error en ronda de sondeo de salud: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def probe_now(self, names: Optional[Iterable[str]] = None):
+        """
+        Sondeo inmediato sin bloquear al llamador
+
+        Args:
+            names: Servicios a sondear; None adelanta la ronda completa
+        """
+        if names is None:
+            self._wakeup.set()
+            return
+        for name in names:
+            service_info = self.registry.get(name)
+            if service_info:
+                self.pool.submit(self._probe, name, service_info)
+
+    def probe_all(self):
+        """Sondea todos los servicios en paralelo y espera la ronda completa"""
+        futures = [
+            self.pool.submit(self._probe, name, service_info)
+            for name, service_info in list(self.registry.items())
+        ]
+        for future in futures:
+            future.result()
+        self.rounds += 1
+        if self.shared_state:
+            self.shared_state.set('health_rounds', self.rounds)
+
+    def _probe(self, name: str, service_info: Dict):
+        """Consulta /health de un servicio y actualiza su estado en el registro"""
+        started = time.time()
+        try:
+            response = self.session.get(f"{service_info['internal_endpoint']}/health", timeout=self.timeout)
+            healthy = response.status_code == 200
+            error = None if healthy else f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            healthy = False
+            error = type(e).__name__
+        latency_ms = round((time.time() - started) * 1000, 1)
+
+        previous_status = service_info.get('status')
+        service_info['status'] = 'running' if healthy else 'stopped'
+        service_info['health_latency_ms'] = latency_ms
+        service_info['consecutive_failures'] = 0 if healthy else service_info.get('consecutive_failures', 0) + 1
+        service_info['last_health_check'] = started
+        service_info['last_health_error'] = error
+
+        if self.shared_state:
+            try:
+                self.shared_state.update_mapping(self.SHARED_KEY, name, {field: service_info.get(field)
+                                                                         for field in HEALTH_FIELDS})
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo publicar la salud de {name}: {e}")
+
+        if previous_status != service_info['status']:
+            logger.info(f"🩺 {name}: {previous_status} -> {service_info['status']} ({latency_ms}ms)")
+
+    def sync(self):
+        """
+        Copia al registro de este worker el estado publicado por el líder
+        (como mucho cada sync_interval; el worker que sondea ya lo tiene)
+        """
+        if not self.shared_state or self.running or time.time() - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = time.time()
+        try:
+            published = self.shared_state.get(self.SHARED_KEY, {})
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo leer el estado de salud compartido: {e}")
+            return
+        for name, fields in published.items():
+            service_info = self.registry.get(name)
+            if service_info is not None:
+                service_info.update(fields)
+
+    def get_stats(self) -> Dict:
+        """Resumen del estado cacheado"""
+        self.sync()
+        services = list(self.registry.values())
+        rounds = self.rounds
+        if self.shared_state and not self.running:
+            rounds = self.shared_state.get('health_rounds', 0)
+        return {
+            'rounds': rounds,
+            'probing': self.running,
+            'interval': self.interval,
+            'healthy': sum(1 for s in services if s.get('status') == 'running'),
+            'unhealthy': sum(1 for s in services if s.get('consecutive_failures', 0) > 0)
+        }
@@ -3,11 +3,18 @@ Manager de Microservicios ROBLE - Plataforma de Hosting
 Gestiona microservicios y proyectos web con Docker SDK
 """
 import os
+import time
+STARTUP_STARTED_AT = time.time()  # Inicio del arranque, antes de importar dependencias
 import logging
 import requests
 import docker
+import io
+import hashlib
+import tarfile
+import uuid
 import tempfile
 import shutil
+import threading
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from datetime import datetime
@@ -15,8 +22,21 @@ import json
 
 # Importar blueprints de autenticación y proyectos
 from auth_routes import auth_bp
-from projects_routes import projects_bp
+from projects_routes import projects_bp, get_deploy_service, on_deploy_service_created
 from activity_monitor import ActivityMonitor
+from access_log_tailer import AccessLogTailer
+from activity_store import ActivityStore
+from resource_budget import ResourceBudget
+from container_executor import ContainerExecutor
+from prewarm_scheduler import PrewarmScheduler
+from health_prober import HealthProber
+from runtime_pool import RuntimePool
+from service_gateway import ServiceGateway
+from autoscaler import ReplicaAutoscaler
+from service_registry import ServiceRegistry
+from shared_state import SharedState, LeaderElection
+from docker_provider import get_docker_client, LazyDockerClient
+from http_encoding import setup_http_encoding, encoding_stats
 
 # Configuración
 app = Flask(__name__)
@@ -24,8 +44,22 @@ CORS(app, origins=["http://localhost:8080", "http://127.0.0.1:8080"],
      methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
      allow_headers=['Content-Type', 'Authorization'])
 logging.basicConfig(level=logging.INFO)
+setup_http_encoding(app)
 logger = logging.getLogger(__name__)
 
+# Tiempos de arranque por fase (se reportan en /ready y /api/metrics)
+startup_report = {'phases': {}, 'serving_after': None}
+_phase_started_at = STARTUP_STARTED_AT
+
+def mark_startup_phase(phase):
+    """Registra la duración de una fase del arranque desde la fase anterior"""
+    global _phase_started_at
+    now = time.time()
+    startup_report['phases'][phase] = round(now - _phase_started_at, 3)
+    _phase_started_at = now
+
+mark_startup_phase('imports')
+
 # Registrar blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(projects_bp)
@@ -35,82 +69,202 @@ logger.info("✅ Blueprints de autenticación y proyectos registrados")
 ROBLE_BASE_HOST = os.getenv('ROBLE_BASE_HOST', 'https://roble-api.openlab.uninorte.edu.co')
 ROBLE_CONTRACT = os.getenv('ROBLE_CONTRACT', 'microservices_roble_e65ac352d7')
 
-# Cliente Docker
+# Directorio persistente del manager (volumen manager_data)
+ROBLE_DATA_DIR = os.getenv('ROBLE_DATA_DIR', '/data')
+
+# Estado común a todos los procesos worker (puertos, token, actividad, líder)
+shared_state = SharedState(os.path.join(ROBLE_DATA_DIR, 'shared_state.db'))
+
+# Cliente Docker compartido con projects_routes: se resuelve en cada uso, sin
+# conectar al importar; si Docker no responde al arrancar se usa en cuanto responda
+docker_client = LazyDockerClient()
+
+# Ejecutor concurrente para operaciones de contenedores en lote
+container_executor = ContainerExecutor(
+    docker_client,
+    max_workers=int(os.getenv('CONTAINER_EXECUTOR_WORKERS', '8'))
+)
+
+# Inicializar monitor de actividad (30 minutos = 1800 segundos)
 try:
-    docker_client = docker.from_env()
-    logger.info("✅ Cliente Docker conectado")
+    activity_store = ActivityStore(os.path.join(ROBLE_DATA_DIR, 'activity.db'))
 except Exception as e:
-    logger.error(f"❌ Error conectando con Docker: {e}")
-    docker_client = None
+    logger.error(f"❌ Error abriendo almacenamiento de actividad: {e}")
+    activity_store = None
+activity_monitor = ActivityMonitor(docker_client, inactivity_timeout=1800, store=activity_store)
+activity_monitor.executor = container_executor
+activity_monitor.shared_state = shared_state
+logger.info("✅ Monitor de actividad creado (timeout: 30 minutos)")
 
-# Inicializar monitor de actividad (30 minutos = 1800 segundos)
-activity_monitor = None
-if docker_client:
-    activity_monitor = ActivityMonitor(docker_client, inactivity_timeout=1800)
-    activity_monitor.start_monitoring()
-    logger.info("✅ Monitor de actividad iniciado (timeout: 30 minutos)")
+def reopen_nginx_logs():
+    """Pide a Nginx que reabra sus logs tras rotar el de actividad (vacía antes sus buffers)"""
+    exit_code, output = docker_client.containers.get('nginx_proxy').exec_run('nginx -s reopen')
+    if exit_code != 0:
+        raise RuntimeError(output.decode('utf-8', 'replace').strip())
+
+# Actividad derivada del log de Nginx (sin llamadas HTTP por petición)
+access_log_tailer = None
+if activity_monitor:
+    access_log_tailer = AccessLogTailer(
+        activity_monitor,
+        log_path=os.getenv('ACTIVITY_LOG_PATH', '/nginx_logs/activity.log'),
+        interval=int(os.getenv('ACTIVITY_LOG_INTERVAL', '5')),
+        reopen_log=reopen_nginx_logs
+    )
+
+# Pre-calentamiento de proyectos con tráfico previsible (histograma por hora de la semana)
+prewarm_scheduler = None
+if activity_monitor:
+    prewarm_scheduler = PrewarmScheduler(
+        activity_monitor,
+        executor=container_executor,
+        max_prewarmed=int(os.getenv('PREWARM_MAX_CONTAINERS', '5')),
+        window_minutes=int(os.getenv('PREWARM_WINDOW_MINUTES', '60')),
+        lead_minutes=int(os.getenv('PREWARM_LEAD_MINUTES', '10'))
+    )
+    activity_monitor.prewarm_scheduler = prewarm_scheduler
+
+# Presupuesto global de memoria/CPU para proyectos (desalojo LRU)
+resource_budget = ResourceBudget(
+    docker_client,
+    activity_monitor,
+    memory_budget_mb=int(os.getenv('ROBLE_MEMORY_BUDGET_MB', '2048')),
+    cpu_budget=float(os.getenv('ROBLE_CPU_BUDGET', '4')),
+    eviction_mode=os.getenv('ROBLE_EVICTION_MODE', 'stop'),
+    pinned_projects=[p.strip() for p in os.getenv('ROBLE_PINNED_PROJECTS', '').split(',') if p.strip()]
+)
+activity_monitor.resource_budget = resource_budget
+logger.info(f"✅ Presupuesto de recursos: {resource_budget.memory_budget // (1024 * 1024)}MB, {resource_budget.cpu_budget} CPUs")
+
+def setup_deploy_service(deploy_service):
+    """Presupuesto de recursos y reserva de puertos compartida entre workers del servicio de deploy"""
+    deploy_service.resource_budget = resource_budget
+    deploy_service.attach_shared_state(shared_state)
+
+on_deploy_service_created(setup_deploy_service)
+
+mark_startup_phase('subsystems')
 
 def get_activity_monitor():
     """Obtiene la instancia del monitor de actividad"""
     return activity_monitor
 
 
-def cleanup_dynamic_containers():
-    """Limpia contenedores dinámicos al inicio para evitar conflictos de puertos"""
-    logger.info("🧹 Iniciando limpieza de contenedores dinámicos...")
+def sparse_container_name(container):
+    """Nombre de un contenedor obtenido con containers.list(sparse=True)"""
+    return (container.attrs.get('Names') or ['/'])[0].lstrip('/')
+
+def reconcile_dynamic_containers():
+    """
+    Re-adopta los microservicios registrados al iniciar en lugar de destruirlos
+    
+    Una sola consulta por label (sin inspeccionar cada contenedor): los
+    contenedores del registro se conservan (se inician en paralelo si estaban
+    parados), las entradas sin contenedor se descartan y los contenedores con
+    label pero sin registro (p. ej. el pool ocioso) se eliminan en paralelo.
+    Las imágenes no se tocan.
+    
+    Returns:
+        Resumen {'adopted', 'started', 'dropped', 'removed', 'replicas', 'duration'}
+    """
+    logger.info("🔄 Reconciliando microservicios dinámicos...")
     
     if not docker_client:
-        logger.warning("Docker no disponible para limpieza")
-        return
+        logger.warning("Docker no disponible para reconciliación")
+        return None
     
+    started = time.time()
     try:
-        # Buscar todos los contenedores y filtrar por nombre que contenga 'dynamic_'
-        all_containers = docker_client.containers.list(all=True)
-        containers = [c for c in all_containers if 'dynamic_' in c.name]
+        labelled = docker_client.containers.list(all=True, sparse=True, filters={'label': 'roble.registry_id'})
+        by_registry_id = {(c.attrs.get('Labels') or {}).get('roble.registry_id'): c for c in labelled}
+        adopted, dropped = [], []
+        to_start = {}  # {container_name: service_name}
         
-        logger.info(f"🔍 Encontrados {len(containers)} contenedores dinámicos")
-        
-        if containers:
-            logger.info(f"🧹 Limpiando {len(containers)} contenedores dinámicos existentes...")
-            
-            for container in containers:
-                try:
-                    # Detener si está corriendo
-                    if container.status == 'running':
-                        container.stop()
-                        logger.info(f"⏹️ Detenido: {container.name}")
-                    
-                    # Eliminar el contenedor
-                    container.remove()
-                    logger.info(f"🗑️ Eliminado: {container.name}")
-                    
-                except Exception as e:
-                    logger.warning(f"Error eliminando contenedor {container.name}: {e}")
-            
-            # Limpiar imágenes de microservicios también
-            try:
-                images = docker_client.images.list(filters={"reference": "microservice_*"})
-                for image in images:
-                    try:
-                        docker_client.images.remove(image.id, force=True)
-                        logger.info(f"🗑️ Imagen eliminada: {image.tags}")
-                    except Exception as e:
-                        logger.warning(f"Error eliminando imagen {image.id}: {e}")
-            except Exception as e:
-                logger.warning(f"Error limpiando imágenes: {e}")
-                
-            logger.info("✅ Limpieza de contenedores dinámicos completada")
-        else:
-            logger.info("✨ No hay contenedores dinámicos para limpiar")
+        for name, service_info in available_microservices.dynamic_items():
+            container = by_registry_id.pop(service_info.get('registry_id'), None)
+            if not container:
+                del available_microservices[name]
+                release_microservice_port(service_info)
+                dropped.append(name)
+                continue
             
+            container_name = sparse_container_name(container)
+            available_microservices.update_fields(
+                name,
+                container_id=container.id,
+                container_name=container_name,
+                endpoint=f"http://{container_name}:5000",
+                internal_endpoint=f"http://{container_name}:5000"
+            )
+            if container.attrs.get('State') != 'running':
+                to_start[container_name] = name
+            adopted.append(name)
+        
+        # Arranque en paralelo de los registrados que estaban parados
+        pool_ports = {}
+        def start_adopted(container):
+            container.start()
+            service_name = to_start[container.name]
+            if available_microservices[service_name].get('runtime') == 'pool' and PUBLISH_SERVICE_PORTS:
+                # Puerto del host asignado por Docker: cambia al reiniciar
+                container.reload()
+                pool_ports[service_name] = int(container.ports['5000/tcp'][0]['HostPort'])
+            return True
+        
+        if to_start:
+            container_executor.run_batch('adopt', list(to_start), operation=start_adopted)
+        for service_name, port in pool_ports.items():
+            available_microservices.update_fields(service_name, port=port,
+                                                  external_endpoint=service_external_endpoint(service_name, port))
+        
+        # Réplicas del autoescalado: se conservan las que siguen en ejecución, el resto se recrea
+        kept_replicas = {}
+        for service_name, replicas in (shared_state.get('service_replicas') or {}).items():
+            if service_name not in available_microservices:
+                continue
+            for replica in replicas:
+                container = by_registry_id.get(replica['registry_id'])
+                if container and container.attrs.get('State') == 'running':
+                    del by_registry_id[replica['registry_id']]
+                    kept_replicas.setdefault(service_name, []).append(replica)
+        shared_state.set('service_replicas', kept_replicas)
+        
+        # Contenedores con label sin entrada en el registro y dinámicos anteriores al registro (sin label)
+        orphans = [sparse_container_name(c) for c in by_registry_id.values()]
+        for container in docker_client.containers.list(all=True, sparse=True, filters={'name': 'dynamic_'}):
+            if 'roble.registry_id' not in (container.attrs.get('Labels') or {}):
+                orphans.append(sparse_container_name(container))
+        if orphans:
+            logger.info(f"🗑️ Eliminando {len(orphans)} contenedores dinámicos sin registro")
+            container_executor.run_batch('remove', orphans)
+        
+        shared_state.sync_ports('microservices', [
+            info['port'] for _, info in available_microservices.dynamic_items()
+            if info.get('runtime') != 'pool' and info.get('port')
+        ])
+        
+        summary = {
+            'adopted': len(adopted),
+            'started': len(to_start),
+            'dropped': len(dropped),
+            'removed': len(orphans),
+            'replicas': sum(len(r) for r in kept_replicas.values()),
+            'duration': round(time.time() - started, 3)
+        }
+        logger.info(
+            f"✅ Reconciliación en {summary['duration']:.2f}s: {len(adopted)} re-adoptados "
+            f"({len(to_start)} iniciados), {len(dropped)} descartados, {len(orphans)} huérfanos eliminados"
+        )
+        return summary
     except Exception as e:
-        logger.error(f"❌ Error durante la limpieza: {e}")
+        logger.error(f"❌ Error durante la reconciliación: {e}")
+        return None
 
-# Ejecutar limpieza al iniciar
+# Ejecutar reconciliación al iniciar
 # (Esta función se ejecutará en el bloque main)
 
-# Registro de microservicios disponibles (dinámico + estáticos)
-available_microservices = {
+# Registro de microservicios disponibles (dinámicos persistidos en SQLite + estáticos)
+STATIC_MICROSERVICES = {
     'filter-service': {
         'id': 'filter-001',
         'name': 'filter-service',
@@ -138,11 +292,38 @@ available_microservices = {
         'is_static': True
     }
 }
+available_microservices = ServiceRegistry(
+    os.path.join(ROBLE_DATA_DIR, 'services.db'),
+    static_services=STATIC_MICROSERVICES
+)
 
-# Contador para puertos dinámicos
-next_available_port = 5003
+# Estado de salud cacheado: el líder sondea en segundo plano y publica el resultado
+# en el estado compartido; los demás workers lo leen de ahí
+health_prober = HealthProber(
+    available_microservices,
+    interval=int(os.getenv('HEALTH_PROBE_INTERVAL', '15'))
+)
+health_prober.attach_shared_state(shared_state)
 
-current_user_token = None
+# Gateway /svc/<nombre>/...: conexiones keep-alive por la red interna y reparto entre réplicas
+service_gateway = ServiceGateway(
+    available_microservices,
+    timeout=int(os.getenv('GATEWAY_TIMEOUT', '30')),
+    pool_size=int(os.getenv('GATEWAY_POOL_SIZE', '32')),
+    shared_state=shared_state
+)
+GATEWAY_PUBLIC_URL = os.getenv('GATEWAY_PUBLIC_URL', 'http://localhost:5000').rstrip('/')
+# Publicar además un puerto del host por microservicio (acceso directo heredado)
+PUBLISH_SERVICE_PORTS = os.getenv('ROBLE_PUBLISH_SERVICE_PORTS', 'true').lower() == 'true'
+mark_startup_phase('registry')
+
+# Rango de puertos del host para microservicios con imagen propia
+MICROSERVICE_PORT_START = 5003
+MICROSERVICE_PORT_END = 5999
+
+def get_current_user_token():
+    """Token de la última sesión iniciada con /api/login (compartido entre workers)"""
+    return shared_state.get('current_user_token')
 
 # --- FUNCIONES ROBLE ---
 def roble_login(email, password):
@@ -229,43 +410,87 @@ def check_user_permissions(token, action):
     return None
 
 # --- GESTIÓN DE MICROSERVICIOS (DOCKER REAL) ---
-def check_service_health(service_info):
-    """Verifica si un microservicio está funcionando"""
-    try:
-        response = requests.get(f"{service_info['internal_endpoint']}/health", timeout=5)
-        return response.status_code == 200
-    except:
-        return False
-
-def create_microservice_files(service_name, service_type, custom_code=None):
-    """Crea archivos temporales para el microservicio"""
-    temp_dir = tempfile.mkdtemp()
-    
-    try:
-        # Template Dockerfile inline
-        dockerfile_content = """FROM python:3.9-slim
+# Imagen base con las dependencias ya instaladas: crear un microservicio solo copia app.py
+# Su CMD es runtime_loader.py, que permite cargar código en caliente (pool de runtime)
+MICROSERVICE_TEMPLATE_VERSION = '2'
+RUNTIME_IMAGE = 'roble_microservice_runtime:3'
+RUNTIME_DOCKERFILE = """FROM python:3.9-slim
 
 WORKDIR /app
 
-RUN pip install flask requests flask-cors
+RUN pip install --no-cache-dir flask requests flask-cors
 
-COPY app.py .
+COPY runtime_loader.py /runtime/loader.py
 
-EXPOSE 5000
+EXPOSE 5000 5001
 
-CMD ["python", "app.py"]
+CMD ["python", "/runtime/loader.py"]
 """
+RUNTIME_LOADER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runtime_loader.py')
+MICROSERVICES_NETWORK = os.getenv('MICROSERVICES_NETWORK', 'microservices_roble_microservices_network')
+_runtime_image_lock = threading.Lock()
+
+def build_runtime_context():
+    """Contexto de build en memoria (tar) con el Dockerfile y el loader"""
+    context = io.BytesIO()
+    with tarfile.open(fileobj=context, mode='w') as tar:
+        dockerfile = RUNTIME_DOCKERFILE.encode('utf-8')
+        info = tarfile.TarInfo('Dockerfile')
+        info.size = len(dockerfile)
+        tar.addfile(info, io.BytesIO(dockerfile))
+        tar.add(RUNTIME_LOADER_PATH, arcname='runtime_loader.py')
+    context.seek(0)
+    return context
+
+def ensure_runtime_image():
+    """Construye la imagen base de runtime si todavía no existe"""
+    if not docker_client:
+        return False
+    
+    with _runtime_image_lock:
+        try:
+            docker_client.images.get(RUNTIME_IMAGE)
+            return True
+        except docker.errors.ImageNotFound:
+            pass
         
-        with open(os.path.join(temp_dir, 'Dockerfile'), 'w') as f:
-            f.write(dockerfile_content)
-        
-        # Usar código personalizado si se proporciona, sino usar plantilla
-        if custom_code:
-            app_content = custom_code
-            logger.info(f"📝 Usando código personalizado para {service_name} ({len(custom_code)} caracteres)")
-        else:
-            # Template app.py inline por defecto
-            app_content = f"""\"\"\"
+        try:
+            logger.info(f"🏗️ Construyendo imagen base {RUNTIME_IMAGE} (solo la primera vez)...")
+            docker_client.images.build(
+                fileobj=build_runtime_context(),
+                custom_context=True,
+                tag=RUNTIME_IMAGE,
+                rm=True
+            )
+            logger.info(f"✅ Imagen base {RUNTIME_IMAGE} lista")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error construyendo imagen base: {e}")
+            return False
+
+# Pool de contenedores de runtime ociosos (lo rellena el líder tras la reconciliación)
+runtime_pool = None
+if int(os.getenv('RUNTIME_POOL_SIZE', '2')) > 0:
+    runtime_pool = RuntimePool(
+        docker_client,
+        RUNTIME_IMAGE,
+        MICROSERVICES_NETWORK,
+        size=int(os.getenv('RUNTIME_POOL_SIZE', '2')),
+        environment={'ROBLE_BASE_HOST': ROBLE_BASE_HOST, 'ROBLE_CONTRACT': ROBLE_CONTRACT},
+        ensure_image=ensure_runtime_image,
+        publish_ports=PUBLISH_SERVICE_PORTS
+    )
+    # Los ociosos se reclaman desde cualquier worker; solo el líder rellena el pool
+    runtime_pool.attach_shared_state(shared_state)
+
+def render_microservice_app(service_name, service_type, custom_code=None):
+    """Devuelve el app.py del microservicio (código personalizado o plantilla)"""
+    if custom_code:
+        logger.info(f"📝 Usando código personalizado para {service_name} ({len(custom_code)} caracteres)")
+        return custom_code
+    
+    # Template app.py inline por defecto
+    return f"""\"\"\"
 Microservicio {service_name} - Tipo: {service_type}
 Generado automáticamente por el Manager ROBLE
 \"\"\"
@@ -329,6 +554,28 @@ if __name__ == '__main__':
     logger.info(f"🚀 Iniciando {service_name} ({service_type})")
     app.run(host='0.0.0.0', port=5000, debug=True)
 """
+
+def microservice_image_name(app_content):
+    """Tag de imagen derivado del contenido: el mismo código reutiliza la misma imagen"""
+    digest = hashlib.sha256(
+        f"{MICROSERVICE_TEMPLATE_VERSION}\n{RUNTIME_IMAGE}\n{app_content}".encode('utf-8')
+    ).hexdigest()[:16]
+    return f"microservice_code:{digest}"
+
+def create_microservice_files(app_content):
+    """Crea el contexto de build temporal (Dockerfile sobre la imagen base + app.py)"""
+    temp_dir = tempfile.mkdtemp()
+    
+    try:
+        dockerfile_content = f"""FROM {RUNTIME_IMAGE}
+
+COPY app.py .
+
+CMD ["python", "app.py"]
+"""
+        
+        with open(os.path.join(temp_dir, 'Dockerfile'), 'w') as f:
+            f.write(dockerfile_content)
         
         with open(os.path.join(temp_dir, 'app.py'), 'w') as f:
             f.write(app_content)
@@ -339,108 +586,229 @@ if __name__ == '__main__':
         shutil.rmtree(temp_dir, ignore_errors=True)
         return None
 
-def find_available_port(start_port=5003):
-    """Encuentra un puerto disponible comenzando desde start_port"""
+def get_or_build_microservice_image(app_content):
+    """
+    Obtiene la imagen del código o la construye sobre la imagen base
+    
+    Returns:
+        (image_name, reused) o (None, False) si falla
+    """
+    image_name = microservice_image_name(app_content)
+    try:
+        docker_client.images.get(image_name)
+        logger.info(f"♻️ Reutilizando imagen {image_name}")
+        return image_name, True
+    except docker.errors.ImageNotFound:
+        pass
+    
+    if not ensure_runtime_image():
+        return None, False
+    
+    temp_dir = create_microservice_files(app_content)
+    if not temp_dir:
+        return None, False
+    
+    try:
+        logger.info(f"Construyendo imagen {image_name}...")
+        docker_client.images.build(path=temp_dir, tag=image_name, rm=True)
+        return image_name, False
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def port_is_free(port):
+    """Comprueba que el puerto no esté ocupado en el host"""
     import socket
-    import time
-    import random
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('0.0.0.0', port))
+            return True
+    except OSError:
+        return False
+
+def find_available_port(owner=None):
+    """Reserva un puerto libre para un microservicio (la reserva es común a todos los workers)"""
+    port = shared_state.claim_port('microservices', MICROSERVICE_PORT_START, MICROSERVICE_PORT_END,
+                                   owner=owner, is_free=port_is_free)
+    if port is None:
+        raise RuntimeError(f"No hay puertos libres en {MICROSERVICE_PORT_START}-{MICROSERVICE_PORT_END}")
+    return port
+
+def release_microservice_port(service_info):
+    """Libera el puerto reservado por un microservicio con imagen propia"""
+    if service_info.get('runtime') != 'pool' and service_info.get('port'):
+        shared_state.release_port('microservices', service_info['port'])
+
+def dynamic_container_name(service_name):
+    """Nombre único del contenedor de un microservicio dinámico"""
+    # Usar tiempo en microsegundos para mayor unicidad
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S') + f"_{int(time.time() * 1000000) % 1000000}"
+    unique_id = str(uuid.uuid4())[:8]  # 8 caracteres únicos
+    return f"dynamic_{service_name}_{timestamp}_{unique_id}"
+
+def service_external_endpoint(service_name, port):
+    """URL externa: el puerto publicado si existe, si no la ruta del gateway"""
+    return f"http://localhost:{port}" if port else f"{GATEWAY_PUBLIC_URL}/svc/{service_name}"
+
+def build_service_info(service_type, service_name, container, container_name, port, config, registry_id):
+    """Registro común de un microservicio dinámico"""
+    return {
+        'id': f"{service_type}-{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+        'registry_id': registry_id,
+        'name': service_name,
+        'type': service_type,
+        'container_name': container_name,
+        'container_id': container.id,
+        'port': port,
+        'endpoint': f"http://{container_name}:5000",
+        'internal_endpoint': f"http://{container_name}:5000",
+        'external_endpoint': service_external_endpoint(service_name, port),
+        'gateway_endpoint': f"{GATEWAY_PUBLIC_URL}/svc/{service_name}",
+        'status': 'running',
+        'created_at': datetime.now().isoformat(),
+        'config': config or {},
+        'is_static': False
+    }
+
+def create_pooled_microservice(service_type, service_name, app_content, config=None):
+    """
+    Crea el microservicio sobre un contenedor ocioso del pool de runtime
     
-    # Agregar un poco de randomness para evitar colisiones
-    start_port += random.randint(0, 10)
+    Returns:
+        service_info o None si el pool está vacío o la carga falla
+    """
+    if not runtime_pool:
+        return None
     
-    for port in range(start_port, start_port + 100):  # Buscar en un rango de 100 puertos
-        try:
-            # Verificar si el puerto está libre en el host
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.bind(('0.0.0.0', port))
-                return port
-        except OSError:
-            continue
+    slot = runtime_pool.claim()
+    if not slot:
+        logger.info(f"🔥 Pool de runtime vacío, {service_name} usará imagen propia")
+        return None
     
-    # Si no encuentra ningún puerto libre, usar uno aleatorio alto
-    return random.randint(6000, 7999)
+    container = slot['container']
+    try:
+        result = runtime_pool.load_code(container.name, slot['token'], app_content, {'SERVICE_NAME': service_name})
+        if not result.get('ready'):
+            raise RuntimeError(f"la aplicación no quedó escuchando (exit_code={result.get('exit_code')})")
+        
+        container_name = dynamic_container_name(service_name)
+        container.rename(container_name)
+        port = None
+        if PUBLISH_SERVICE_PORTS:
+            container.reload()
+            port = int(container.ports['5000/tcp'][0]['HostPort'])
+        
+        service_info = build_service_info(service_type, service_name, container, container_name, port, config,
+                                          slot['registry_id'])
+        service_info.update({
+            'runtime': 'pool',
+            'control_token': slot['token'],
+            'code_version': result.get('version'),
+            'code_hash': hashlib.sha256(app_content.encode('utf-8')).hexdigest()[:16]
+        })
+        logger.info(f"🔥 {service_name} cargado en contenedor del pool ({container_name}, {service_info['external_endpoint']})")
+        return service_info
+    except Exception as e:
+        logger.warning(f"⚠️ Error cargando {service_name} en el pool: {e}")
+        try:
+            container.remove(force=True)
+        except Exception:
+            pass
+        return None
 
 def create_real_microservice(service_type, service_name, config=None, custom_code=None):
     """Crea un microservicio Docker real"""
-    global next_available_port
-    
     if not docker_client:
         logger.error("Docker no disponible")
         return None
 
     try:
-        # Crear archivos del microservicio (con código personalizado si se proporciona)
-        temp_dir = create_microservice_files(service_name, service_type, custom_code)
-        if not temp_dir:
-            return None        # Encontrar puerto disponible
-        available_port = find_available_port(next_available_port)
-        
-        # Actualizar el siguiente puerto disponible
-        next_available_port = available_port + 1
-        
-        # Generar nombre único del contenedor con timestamp más preciso y UUID corto
-        import uuid
-        import time
-        # Usar tiempo en microsegundos para mayor unicidad
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S') + f"_{int(time.time() * 1000000) % 1000000}"
-        unique_id = str(uuid.uuid4())[:8]  # 8 caracteres únicos
-        container_name = f"dynamic_{service_name}_{timestamp}_{unique_id}"
-        image_name = f"microservice_{service_name.lower()}:latest"
-        
-        # Construir imagen Docker
-        logger.info(f"Construyendo imagen {image_name}...")
-        image, build_logs = docker_client.images.build(
-            path=temp_dir,
-            tag=image_name,
-            rm=True
-        )
+        app_content = render_microservice_app(service_name, service_type, custom_code)
+        
+        # Camino rápido: contenedor ya iniciado del pool, sin build ni arranque
+        service_info = create_pooled_microservice(service_type, service_name, app_content, config)
+        if service_info:
+            available_microservices[service_name] = service_info
+            return service_info
+        
+        # Imagen por hash del código (con código personalizado si se proporciona)
+        image_name, image_reused = get_or_build_microservice_image(app_content)
+        if not image_name:
+            return None
+        
+        # Reservar puerto disponible (sin puerto del host el acceso es por el gateway)
+        available_port = find_available_port(service_name) if PUBLISH_SERVICE_PORTS else None
+        
+        container_name = dynamic_container_name(service_name)
+        registry_id = uuid.uuid4().hex
         
         # Crear y ejecutar contenedor
-        logger.info(f"Creando contenedor {container_name} en puerto {available_port}...")
-        container = docker_client.containers.run(
-            image_name,
-            name=container_name,
-            ports={'5000/tcp': available_port},
-            environment={
-                'ROBLE_BASE_HOST': ROBLE_BASE_HOST,
-                'ROBLE_CONTRACT': ROBLE_CONTRACT,
-                'SERVICE_NAME': service_name
-            },
-            network='microservices_roble_microservices_network',
-            detach=True
-        )
+        logger.info(f"Creando contenedor {container_name} en puerto {available_port or 'interno'}...")
+        try:
+            container = docker_client.containers.run(
+                image_name,
+                name=container_name,
+                ports={'5000/tcp': available_port} if available_port else {},
+                environment={
+                    'ROBLE_BASE_HOST': ROBLE_BASE_HOST,
+                    'ROBLE_CONTRACT': ROBLE_CONTRACT,
+                    'SERVICE_NAME': service_name
+                },
+                network=MICROSERVICES_NETWORK,
+                labels={'roble.registry_id': registry_id, 'roble.service_name': service_name},
+                detach=True
+            )
+        except Exception:
+            if available_port:
+                shared_state.release_port('microservices', available_port)
+            raise
         
         # Crear registro del microservicio
-        service_info = {
-            'id': f"{service_type}-{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-            'name': service_name,
-            'type': service_type,
-            'container_name': container_name,
-            'container_id': container.id,
+        service_info = build_service_info(service_type, service_name, container, container_name, available_port, config,
+                                          registry_id)
+        service_info.update({
+            'runtime': 'image',
             'image_name': image_name,
-            'port': available_port,
-            'endpoint': f"http://{container_name}:5000",
-            'internal_endpoint': f"http://{container_name}:5000",
-            'external_endpoint': f"http://localhost:{available_port}",
-            'status': 'running',
-            'created_at': datetime.now().isoformat(),
-            'config': config or {},
-            'is_static': False,
-            'temp_dir': temp_dir
-        }
+            'image_reused': image_reused
+        })
         
         # Añadir al registro
         available_microservices[service_name] = service_info
         
-        logger.info(f"✅ Microservicio {service_name} creado exitosamente en puerto {available_port}")
+        logger.info(f"✅ Microservicio {service_name} creado exitosamente ({service_info['external_endpoint']})")
         return service_info
         
     except Exception as e:
         logger.error(f"Error creando microservicio {service_name}: {e}")
-        if 'temp_dir' in locals() and temp_dir:
-            shutil.rmtree(temp_dir, ignore_errors=True)
         return None
 
+def reload_microservice_code(service_info, custom_code):
+    """
+    Recarga en caliente el código de un microservicio del pool
+    
+    Returns:
+        (success, error)
+    """
+    if service_info.get('runtime') != 'pool' or not runtime_pool:
+        return False, "Solo los microservicios del pool de runtime admiten recarga de código; recréalo para cambiarlo"
+    
+    app_content = render_microservice_app(service_info['name'], service_info['type'], custom_code)
+    try:
+        result = runtime_pool.load_code(
+            service_info['container_name'], service_info['control_token'],
+            app_content, {'SERVICE_NAME': service_info['name']}
+        )
+    except RuntimeError as e:
+        return False, str(e)
+    
+    available_microservices.update_fields(
+        service_info['name'],
+        code_version=result.get('version'),
+        code_hash=hashlib.sha256(app_content.encode('utf-8')).hexdigest()[:16]
+    )
+    if not result.get('ready'):
+        return False, f"El nuevo código no quedó escuchando (exit_code={result.get('exit_code')})"
+    return True, None
+
 def delete_real_microservice(service_id):
     """Elimina un microservicio Docker real"""
     if not docker_client:
@@ -466,6 +834,9 @@ def delete_real_microservice(service_id):
             logger.warning(f"No se puede eliminar el microservicio estático {service_id}")
             return False
         
+        # Réplicas del autoescalado (comparten la imagen del servicio)
+        autoscaler.remove_all(service_key)
+        
         # Detener y eliminar contenedor
         if 'container_id' in service_info:
             try:
@@ -476,23 +847,21 @@ def delete_real_microservice(service_id):
             except Exception as e:
                 logger.warning(f"Error eliminando contenedor: {e}")
         
-        # Eliminar imagen
-        if 'image_name' in service_info:
+        # Eliminar imagen si ningún otro servicio usa el mismo código
+        shared = any(
+            info.get('image_name') == service_info.get('image_name')
+            for key, info in available_microservices.items() if key != service_key
+        )
+        if 'image_name' in service_info and not shared:
             try:
                 docker_client.images.remove(service_info['image_name'], force=True)
                 logger.info(f"Imagen {service_info['image_name']} eliminada")
             except Exception as e:
                 logger.warning(f"Error eliminando imagen: {e}")
         
-        # Limpiar archivos temporales
-        if 'temp_dir' in service_info:
-            try:
-                shutil.rmtree(service_info['temp_dir'], ignore_errors=True)
-            except:
-                pass
-        
         # Eliminar del registro
         del available_microservices[service_key]
+        release_microservice_port(service_info)
         logger.info(f"✅ Microservicio {service_id} eliminado exitosamente")
         
         return True
@@ -501,8 +870,124 @@ def delete_real_microservice(service_id):
         logger.error(f"Error eliminando microservicio {service_id}: {e}")
         return False
 
+# --- RÉPLICAS (AUTOESCALADO) ---
+def read_container_app(container_name):
+    """app.py cargado en un contenedor de runtime del pool"""
+    stream, _ = docker_client.containers.get(container_name).get_archive('/app/app.py')
+    with tarfile.open(fileobj=io.BytesIO(b''.join(stream))) as tar:
+        return tar.extractfile(tar.getmembers()[0]).read().decode('utf-8')
+
+def spawn_service_replica(service_name, service_info):
+    """
+    Crea una réplica más de un servicio en la red interna (sin puerto del host)
+    
+    - Estáticos: misma imagen, entorno y red que el contenedor de docker-compose
+    - Imagen propia: la misma imagen microservice_code:<hash>
+    - Pool: un contenedor del pool con el mismo código (o su imagen por hash si el pool está vacío)
+    
+    Returns:
+        {'container_name', 'container_id', 'registry_id', 'internal_endpoint', 'created_at'} o None
+    """
+    if not docker_client:
+        return None
+    
+    registry_id = uuid.uuid4().hex
+    replica_name = f"dynamic_{service_name}_replica_{registry_id[:8]}"
+    labels = {'roble.registry_id': registry_id, 'roble.replica_of': service_name}
+    try:
+        if service_info.get('is_static', False):
+            base = docker_client.containers.get(service_info['container_name'])
+            container = docker_client.containers.run(
+                base.attrs['Config']['Image'],
+                name=replica_name,
+                environment=base.attrs['Config'].get('Env') or [],
+                network=next(iter(base.attrs['NetworkSettings']['Networks'])),
+                labels=labels,
+                detach=True
+            )
+        else:
+            image_name = service_info.get('image_name')
+            if service_info.get('runtime') == 'pool':
+                app_content = read_container_app(service_info['container_name'])
+                slot = runtime_pool.claim() if runtime_pool else None
+                if slot:
+                    result = runtime_pool.load_code(slot['container'].name, slot['token'], app_content,
+                                                    {'SERVICE_NAME': service_name})
+                    if not result.get('ready'):
+                        slot['container'].remove(force=True)
+                        raise RuntimeError("la réplica no quedó escuchando")
+                    slot['container'].rename(replica_name)
+                    # Los labels del pool son inmutables: su registry_id pasa a ser el de la réplica
+                    return {
+                        'container_name': replica_name,
+                        'container_id': slot['container'].id,
+                        'registry_id': slot['registry_id'],
+                        'internal_endpoint': f"http://{replica_name}:5000",
+                        'created_at': time.time()
+                    }
+                image_name, _ = get_or_build_microservice_image(app_content)
+                if not image_name:
+                    return None
+            container = docker_client.containers.run(
+                image_name,
+                name=replica_name,
+                environment={
+                    'ROBLE_BASE_HOST': ROBLE_BASE_HOST,
+                    'ROBLE_CONTRACT': ROBLE_CONTRACT,
+                    'SERVICE_NAME': service_name
+                },
+                network=MICROSERVICES_NETWORK,
+                labels=labels,
+                detach=True
+            )
+        return {
+            'container_name': replica_name,
+            'container_id': container.id,
+            'registry_id': registry_id,
+            'internal_endpoint': f"http://{replica_name}:5000",
+            'created_at': time.time()
+        }
+    except Exception as e:
+        logger.error(f"❌ Error creando réplica de {service_name}: {e}")
+        return None
+
+def remove_service_replica(replica):
+    """Elimina el contenedor de una réplica"""
+    try:
+        docker_client.containers.get(replica['container_name']).remove(force=True)
+        return True
+    except docker.errors.NotFound:
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Error eliminando réplica {replica['container_name']}: {e}")
+        return False
+
+def running_replica_names():
+    """Contenedores gestionados en ejecución (una consulta sparse por label)"""
+    return {
+        sparse_container_name(c) for c in docker_client.containers.list(sparse=True, filters={'label': 'roble.registry_id'})
+    }
+
+autoscaler = ReplicaAutoscaler(
+    available_microservices,
+    shared_state,
+    spawn_replica=spawn_service_replica,
+    remove_replica=remove_service_replica,
+    list_alive=running_replica_names,
+    interval=int(os.getenv('AUTOSCALER_INTERVAL', '15')),
+    max_replicas=int(os.getenv('AUTOSCALER_MAX_REPLICAS', '8'))
+)
+service_gateway.replica_lookup = autoscaler.get_replicas
+
+def public_service_info(service_info):
+    """Copia del registro apta para la API (sin el token del canal de control)"""
+    service_copy = service_info.copy()
+    service_copy.pop('control_token', None)
+    return service_copy
+
 def create_virtual_microservice(service_type, service_name, config=None):
     """LEGACY: Simula la creación de un microservicio (para demo, usa los existentes)"""
+    health_prober.sync()
     if service_type == 'filter':
         base_service = available_microservices['filter-service'].copy()
     elif service_type == 'aggregate':
@@ -516,7 +1001,8 @@ def create_virtual_microservice(service_type, service_name, config=None):
     new_service['name'] = service_name
     new_service['config'] = config or {}
     new_service['created_at'] = datetime.now().isoformat()
-    new_service['status'] = 'running' if check_service_health(new_service) else 'stopped'
+    # El estado sale de la caché del servicio base (la mantiene health_prober)
+    new_service['status'] = base_service.get('status', 'stopped')
     
     return new_service
 
@@ -555,8 +1041,6 @@ def api_status():
 @app.route('/api/login', methods=['POST'])
 def api_login():
     """Login con ROBLE"""
-    global current_user_token
-    
     data = request.get_json()
     email = data.get('email')
     password = data.get('password')
@@ -566,7 +1050,7 @@ def api_login():
     
     result = roble_login(email, password)
     if result and 'token' in result:
-        current_user_token = result['token']
+        shared_state.set('current_user_token', result['token'])
         return jsonify({
             "success": True,
             "message": "Login exitoso",
@@ -606,10 +1090,14 @@ def api_test_roble():
 def api_list_microservices():
     """Lista microservicios activos"""
     services = []
-    for service_id, service_info in available_microservices.items():
-        service_copy = service_info.copy()
-        service_copy['status'] = 'running' if check_service_health(service_info) else 'stopped'
-        service_copy['external_endpoint'] = f"http://localhost:{service_info['port']}"
+    health_prober.sync()
+    for service_id, service_info in list(available_microservices.items()):
+        # Estado leído de la caché de health_prober, sin llamadas de red
+        service_copy = public_service_info(service_info)
+        service_copy['status'] = service_info.get('status', 'stopped')
+        if not service_info.get('is_static', False):
+            service_copy['external_endpoint'] = service_external_endpoint(service_id, service_info.get('port'))
+        service_copy['replicas'] = 1 + len(autoscaler.get_replicas(service_id))
         services.append(service_copy)
     
     return jsonify({
@@ -621,7 +1109,7 @@ def api_list_microservices():
 def api_create_microservice():
     """Crea un microservicio Docker real"""
     # Verificar permisos
-    perm_check = check_user_permissions(current_user_token, 'create')
+    perm_check = check_user_permissions(get_current_user_token(), 'create')
     if perm_check:
         return perm_check
     
@@ -653,10 +1141,11 @@ def api_create_microservice():
         service_info = create_real_microservice(service_type, service_name, config, custom_code)
         
         if service_info:
+            health_prober.probe_now([service_name])
             return jsonify({
                 "success": True,
                 "message": f"Microservicio '{service_name}' creado exitosamente",
-                "service": service_info,
+                "service": public_service_info(service_info),
                 "container_id": service_info.get('container_id'),
                 "external_url": service_info.get('external_endpoint'),
                 "has_custom_code": bool(custom_code)
@@ -672,7 +1161,7 @@ def api_create_microservice():
 def api_delete_microservice(service_id):
     """Elimina un microservicio Docker real"""
     # Verificar permisos
-    perm_check = check_user_permissions(current_user_token, 'delete')
+    perm_check = check_user_permissions(get_current_user_token(), 'delete')
     if perm_check:
         return perm_check
     
@@ -680,6 +1169,7 @@ def api_delete_microservice(service_id):
     success = delete_real_microservice(service_id)
     
     if success:
+        health_prober.probe_now()
         return jsonify({
             "success": True,
             "message": f"Microservicio {service_id} eliminado exitosamente"
@@ -690,6 +1180,7 @@ def api_delete_microservice(service_id):
 @app.route('/api/microservices/<service_id>', methods=['PUT'])
 def api_edit_microservice(service_id):
     """Edita la configuración de un microservicio"""
+    current_user_token = get_current_user_token()
     if not current_user_token or not roble_verify_token(current_user_token):
         return jsonify({"error": "Token inválido o expirado"}), 401
     
@@ -710,25 +1201,242 @@ def api_edit_microservice(service_id):
         return jsonify({"error": "No se pueden editar microservicios estáticos"}), 403
     
     # Actualizar configuración
-    data = request.get_json()
+    data = request.get_json() or {}
     if 'config' in data:
         service_info['config'].update(data['config'])
+        available_microservices.persist(service_key)
+    
+    # Recarga de código en caliente (sin recrear el contenedor)
+    if data.get('custom_code'):
+        success, error = reload_microservice_code(service_info, data['custom_code'])
+        if success:
+            # Las réplicas tienen el código anterior: el autoescalado las recrea con el nuevo
+            autoscaler.remove_all(service_key)
+        health_prober.probe_now([service_key])
+        if not success:
+            return jsonify({"success": False, "error": error, "service": public_service_info(service_info)}), 400
     
     return jsonify({
         "success": True,
         "message": f"Microservicio {service_id} editado exitosamente",
-        "service": service_info
+        "service": public_service_info(service_info)
+    })
+
+def find_microservice(service_id):
+    """(nombre, service_info) por id o nombre, o (None, None)"""
+    for key, info in available_microservices.items():
+        if info['id'] == service_id or info['name'] == service_id:
+            return key, info
+    return None, None
+
+@app.route('/api/microservices/<service_id>/scaling', methods=['GET'])
+def api_get_scaling(service_id):
+    """Política de escalado, réplicas y última decisión del autoescalado"""
+    service_key, service_info = find_microservice(service_id)
+    if not service_info:
+        return jsonify({"error": "Microservicio no encontrado"}), 404
+    
+    return jsonify(dict(autoscaler.get_service_stats(service_key), service=service_key))
+
+@app.route('/api/microservices/<service_id>/scaling', methods=['PUT'])
+def api_set_scaling(service_id):
+    """Configura min/max réplicas y umbrales de escalado de un microservicio"""
+    perm_check = check_user_permissions(get_current_user_token(), 'create')
+    if perm_check:
+        return perm_check
+    
+    service_key, service_info = find_microservice(service_id)
+    if not service_info:
+        return jsonify({"error": "Microservicio no encontrado"}), 404
+    
+    data = request.get_json() or {}
+    policy, error = autoscaler.validate_policy(data, autoscaler.get_policy(service_key))
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    
+    autoscaler.set_policy(service_key, policy)
+    logger.info(f"📈 Política de escalado de {service_key}: {policy['min_replicas']}-{policy['max_replicas']} réplicas")
+    return jsonify({
+        "success": True,
+        "service": service_key,
+        "policy": policy,
+        "gateway_endpoint": f"{GATEWAY_PUBLIC_URL}/svc/{service_key}"
     })
 
 @app.route('/health')
 def health():
-    """Health check"""
+    """Health check (liveness): el proceso atiende peticiones"""
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "available_microservices": len(available_microservices)
     })
 
+def get_reconciliation_status():
+    """Estado del arranque diferido de este despliegue (lo escribe el worker líder)"""
+    reconciliation = shared_state.get('reconciliation') or {}
+    return reconciliation if reconciliation.get('boot') == os.getppid() else None
+
+@app.route('/ready')
+def ready():
+    """Readiness: 200 solo cuando la reconciliación del arranque terminó"""
+    reconciliation = get_reconciliation_status()
+    return jsonify({
+        "serving": True,
+        "reconciled": reconciliation is not None,
+        "startup": startup_report,
+        "reconciliation": reconciliation
+    }), 200 if reconciliation else 503
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Métricas internas del manager"""
+    metrics = {"timestamp": datetime.now().isoformat()}
+    
+    if resource_budget:
+        try:
+            metrics['resource_budget'] = resource_budget.get_stats()
+        except Exception as e:
+            metrics['resource_budget'] = {"error": str(e)}
+    
+    if activity_monitor:
+        metrics['activity'] = {
+            "tracked_containers": len(activity_monitor.last_activity),
+            "stopped_containers": len(activity_monitor.stopped_containers),
+            "requests_seen": sum(activity_monitor.request_counts.values())
+        }
+    
+    if access_log_tailer:
+        metrics['access_log'] = access_log_tailer.get_stats()
+    
+    if container_executor:
+        metrics['container_executor'] = container_executor.get_stats()
+    
+    if prewarm_scheduler:
+        metrics['prewarm'] = prewarm_scheduler.get_stats()
+    
+    metrics['health'] = health_prober.get_stats()
+    
+    if runtime_pool:
+        metrics['runtime_pool'] = runtime_pool.get_stats()
+    
+    metrics['gateway'] = service_gateway.get_stats()
+    metrics['autoscaler'] = autoscaler.get_stats()
+    metrics['http'] = encoding_stats()
+    
+    metrics['startup'] = dict(startup_report, reconciliation=get_reconciliation_status())
+    
+    metrics['worker'] = {
+        "pid": os.getpid(),
+        "is_leader": leader_election.is_leader,
+        "leader": shared_state.lease_holder('background')
+    }
+    
+    return jsonify(metrics)
+
+GATEWAY_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS']
+
+@app.route('/svc/<service_name>/', defaults={'path': ''}, methods=GATEWAY_METHODS)
+@app.route('/svc/<service_name>/<path:path>', methods=GATEWAY_METHODS)
+def api_service_gateway(service_name, path):
+    """Reenvía la petición al microservicio por la red interna"""
+    upstream, error, status = service_gateway.forward(
+        service_name, path, request.method, dict(request.headers),
+        request.query_string, request.get_data()
+    )
+    if error:
+        return jsonify({"success": False, "error": error}), status
+    
+    return app.response_class(
+        service_gateway.stream(service_name, upstream),
+        status=upstream.status_code,
+        headers=service_gateway.response_headers(upstream),
+        direct_passthrough=True
+    )
+
+@app.route('/api/admin/projects/bulk', methods=['POST'])
+def api_bulk_projects():
+    """
+    Detiene, inicia o elimina en paralelo los proyectos que cumplan un filtro
+    
+    Body:
+        action: stop | start | remove
+        filter: {user_id, project_name, name_prefix, status, inactive_minutes_gte, container_names}
+        timeout: Segundos máximos por contenedor (opcional)
+        dry_run: Solo listar los contenedores seleccionados
+    """
+    perm_check = check_user_permissions(get_current_user_token(), 'delete')
+    if perm_check:
+        return perm_check
+    
+    if not docker_client or not container_executor:
+        return jsonify({"success": False, "error": "Docker no disponible"}), 503
+    
+    data = request.get_json() or {}
+    action = data.get('action')
+    criteria = data.get('filter') or {}
+    
+    if action not in ContainerExecutor.ACTIONS:
+        return jsonify({"success": False, "error": "Acción no válida. Use: stop, start, remove"}), 400
+    if not criteria:
+        return jsonify({"success": False, "error": "Se requiere un filtro"}), 400
+    
+    try:
+        # Selección por labels en Docker y el resto en memoria
+        docker_filters = {'name': 'project_'}
+        labels = [f"{key}={criteria[key]}" for key in ('user_id', 'project_name') if criteria.get(key)]
+        if labels:
+            docker_filters['label'] = labels
+        if criteria.get('status'):
+            docker_filters['status'] = criteria['status']
+        containers = docker_client.containers.list(all=True, filters=docker_filters)
+        
+        if criteria.get('name_prefix'):
+            containers = [c for c in containers if c.name.startswith(criteria['name_prefix'])]
+        if criteria.get('container_names'):
+            wanted = set(criteria['container_names'])
+            containers = [c for c in containers if c.name in wanted]
+        if criteria.get('inactive_minutes_gte') is not None and activity_monitor:
+            min_seconds = int(criteria['inactive_minutes_gte']) * 60
+            containers = [c for c in containers
+                          if c.name in activity_monitor.last_activity
+                          and activity_monitor.get_inactive_time(c.name) >= min_seconds]
+        
+        if data.get('dry_run'):
+            return jsonify({
+                "success": True,
+                "dry_run": True,
+                "action": action,
+                "containers": [c.name for c in containers]
+            })
+        
+        operation = None
+        deploy_service = get_deploy_service()
+        if action == 'start' and activity_monitor:
+            def operation(container):
+                # Pasa por el presupuesto de recursos igual que un reinicio por tráfico
+                if container.status == 'running':
+                    return True
+                return activity_monitor.restart_container_if_stopped(container.name)
+        elif action == 'remove' and deploy_service:
+            def operation(container):
+                success, message = deploy_service.remove_container(container.id)
+                if not success:
+                    raise RuntimeError(message)
+                project_name = (container.labels or {}).get('project_name')
+                if project_name:
+                    deploy_service.remove_nginx_config(project_name)
+                return True
+        
+        summary = container_executor.run_batch(action, containers, timeout=data.get('timeout'), operation=operation)
+        logger.info(f"🧰 Operación en lote {action} sobre {summary['total']} proyectos")
+        
+        return jsonify(dict(summary, success=True))
+        
+    except Exception as e:
+        logger.error(f"Error en operación en lote: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/cleanup', methods=['POST'])
 def cleanup_containers():
     """Endpoint para limpiar contenedores dinámicos manualmente"""
@@ -742,29 +1450,28 @@ def cleanup_containers():
                 "timestamp": datetime.now().isoformat()
             }), 500
         
-        # Buscar contenedores dinámicos
-        all_containers = docker_client.containers.list(all=True)
-        containers = [c for c in all_containers if 'dynamic_' in c.name]
+        # Buscar contenedores dinámicos (un solo listado) y eliminarlos en paralelo
+        containers = [
+            sparse_container_name(c)
+            for c in docker_client.containers.list(all=True, sparse=True, filters={'name': 'dynamic_'})
+        ]
         
         cleaned_containers = []
         cleaned_images = []
         
         if containers:
-            for container in containers:
-                try:
-                    container_name = container.name
-                    # Detener si está corriendo
-                    if container.status == 'running':
-                        container.stop()
-                        print(f"⏹️ API: Detenido: {container_name}")
-                    
-                    # Eliminar el contenedor
-                    container.remove()
-                    print(f"🗑️ API: Eliminado: {container_name}")
-                    cleaned_containers.append(container_name)
-                    
-                except Exception as e:
-                    print(f"❌ API: Error eliminando contenedor {container.name}: {e}")
+            summary = container_executor.run_batch('remove', containers)
+            for result in summary['results']:
+                if result['status'] == 'ok':
+                    print(f"🗑️ API: Eliminado: {result['container_name']}")
+                    cleaned_containers.append(result['container_name'])
+                else:
+                    print(f"❌ API: Error eliminando contenedor {result['container_name']}: {result['error']}")
+            
+            # Sin contenedores, las entradas dinámicas del registro ya no son válidas
+            for name, service_info in available_microservices.dynamic_items():
+                del available_microservices[name]
+                release_microservice_port(service_info)
             
             # Limpiar imágenes de microservicios también
             try:
@@ -797,19 +1504,81 @@ def cleanup_containers():
         }), 500
 
 
+# --- TAREAS EN SEGUNDO PLANO (SOLO EN EL WORKER LÍDER) ---
+def start_background_roles():
+    """Arranque diferido en un thread propio: no bloquea peticiones ni la renovación del lease"""
+    threading.Thread(target=run_background_startup, daemon=True).start()
+
+def run_background_startup():
+    """Imagen base, sondeo de salud, reconciliación, monitor de actividad, lector de log, pre-calentamiento y pool de runtime"""
+    started = time.time()
+    phases = {}
+    
+    # Preparar la imagen base sin bloquear el resto del arranque
+    threading.Thread(target=ensure_runtime_image, daemon=True).start()
+    health_prober.start()
+    
+    deploy_service = get_deploy_service()
+    if deploy_service:
+        deploy_service.load_used_ports()
+        phases['project_ports'] = round(time.time() - started, 3)
+    
+    reconcile_started = time.time()
+    reconciliation = reconcile_dynamic_containers()
+    phases['reconcile'] = round(time.time() - reconcile_started, 3)
+    
+    if activity_monitor:
+        activity_monitor.start_monitoring()
+    if access_log_tailer:
+        access_log_tailer.start()
+    if prewarm_scheduler:
+        prewarm_scheduler.start()
+    if runtime_pool:
+        runtime_pool.start()
+    autoscaler.start()
+    phases['background_total'] = round(time.time() - started, 3)
+    
+    # Visible para todos los workers del mismo arranque (mismo proceso padre)
+    shared_state.set('reconciliation', {
+        'boot': os.getppid(),
+        'completed_at': time.time(),
+        'phases': phases,
+        'summary': reconciliation
+    })
+    logger.info(f"✅ Arranque en segundo plano completado en {phases['background_total']:.2f}s")
+
+def stop_background_roles():
+    """Detiene las tareas del líder si pierde el lease"""
+    autoscaler.stop()
+    health_prober.stop()
+    if runtime_pool:
+        runtime_pool.stop()
+    if prewarm_scheduler:
+        prewarm_scheduler.stop()
+    if access_log_tailer:
+        access_log_tailer.stop()
+    if activity_monitor:
+        activity_monitor.stop_monitoring()
+
+leader_election = LeaderElection(
+    shared_state,
+    'background',
+    on_elected=start_background_roles,
+    on_lost=stop_background_roles,
+    ttl=int(os.getenv('LEADER_LEASE_TTL', '30'))
+)
+leader_election.start()
+
+startup_report['serving_after'] = round(time.time() - STARTUP_STARTED_AT, 3)
+logger.info(f"🚀 Manager listo para recibir tráfico en {startup_report['serving_after']:.2f}s")
+
 
 if __name__ == '__main__':
     print("🐛 DEBUG: Entrando al bloque __main__")
     print("🐛 DEBUG: __name__ =", __name__)
     
-    try:
-        print("🧹 EJECUTANDO LIMPIEZA AUTOMÁTICA DE CONTENEDORES DINÁMICOS...")
-        cleanup_dynamic_containers()
-        print("✅ LIMPIEZA AUTOMÁTICA COMPLETADA")
-    except Exception as e:
-        print(f"❌ ERROR EN LIMPIEZA AUTOMÁTICA: {e}")
-        import traceback
-        traceback.print_exc()
+    # Reconciliación y tareas en segundo plano: las inicia leader_election en el worker líder
+    # (en producción: gunicorn -c gunicorn.conf.py manager:app)
     
     print("=" * 60)
     print("🚀 ROBLE MICROSERVICES PLATFORM")
@@ -0,0 +1,172 @@
+"""
+Pre-calentamiento predictivo de proyectos
+Usa el histograma de accesos por hora de la semana del monitor de actividad para
+iniciar (o no detener) los proyectos que probablemente recibirán tráfico pronto
+"""
+import time
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+from activity_monitor import HOURS_PER_WEEK, hour_of_week
+
+logger = logging.getLogger(__name__)
+
+class PrewarmScheduler:
+    """Planificador de pre-calentamiento con presupuesto global de contenedores"""
+
+    def __init__(self, activity_monitor, executor=None, max_prewarmed=5, window_minutes=60,
+                 lead_minutes=10, min_share=0.05, min_requests=5, interval=300):
+        self.activity_monitor = activity_monitor
+        self.executor = executor  # ContainerExecutor opcional para iniciar en paralelo
+        self.max_prewarmed = max_prewarmed  # contenedores pre-calentados a la vez (global)
+        self.window = window_minutes * 60  # duración de la ventana prevista
+        self.lead = lead_minutes * 60  # antelación con la que se inicia
+        self.min_share = min_share  # fracción mínima del tráfico semanal en esa hora
+        self.min_requests = min_requests  # peticiones (ponderadas) mínimas en esa hora
+        self.interval = interval  # segundos entre ciclos
+        self.predictions = {}  # {container_name: {'window_start', 'window_end', 'prestarted', 'requests_at'}}
+        self.running = False
+        self.scheduler_thread = None
+        self.metrics = {
+            'predictions': 0,
+            'hits': 0,
+            'misses': 0,
+            'prestarted': 0,
+            'stops_skipped': 0,
+            'cold_starts_avoided': 0
+        }
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Inicia el planificador en un thread separado"""
+        if not self.running and self.max_prewarmed > 0:
+            self.running = True
+            self.scheduler_thread = threading.Thread(target=self._scheduler_loop, daemon=True)
+            self.scheduler_thread.start()
+            logger.info(f"🔮 Pre-calentamiento iniciado (máximo {self.max_prewarmed} contenedores)")
+
+    def stop(self):
+        """Detiene el planificador"""
+        self.running = False
+        if self.scheduler_thread:
+            self.scheduler_thread.join(timeout=5)
+
+    def _scheduler_loop(self):
+        while self.running:
+            try:
+                self.run_cycle()
+            except Exception as e:
+                logger.error(f"❌ Error en ciclo de pre-calentamiento: {e}")
+            time.sleep(self.interval)
+
+    def predict(self, now: float) -> List[Tuple[str, float]]:
+        """
+        Proyectos con tráfico probable en la próxima ventana
+
+        Returns:
+            [(container_name, peticiones ponderadas en la hora prevista)] de mayor a menor
+        """
+        bucket = hour_of_week(now + self.lead)
+        candidates = []
+        for container_name, histogram in list(self.activity_monitor.access_histogram.items()):
+            if len(histogram) != HOURS_PER_WEEK:
+                continue
+            total = sum(histogram)
+            expected = histogram[bucket]
+            if total <= 0 or expected < self.min_requests:
+                continue
+            if expected / total >= self.min_share:
+                candidates.append((container_name, expected))
+
+        candidates.sort(key=lambda item: item[1], reverse=True)
+        return candidates
+
+    def is_protected(self, container_name: str) -> bool:
+        """True si el contenedor tiene una predicción vigente (el monitor no debe detenerlo)"""
+        with self._lock:
+            prediction = self.predictions.get(container_name)
+            if prediction and time.time() < prediction['window_end']:
+                if not prediction['prestarted']:
+                    prediction['stop_skipped'] = True
+                return True
+        return False
+
+    def _evaluate_expired(self, now: float):
+        """Cierra predicciones vencidas y mide su precisión"""
+        counts = self.activity_monitor.request_counts
+        for container_name, prediction in list(self.predictions.items()):
+            if now < prediction['window_end']:
+                continue
+            del self.predictions[container_name]
+
+            hit = counts.get(container_name, 0) > prediction['requests_at']
+            if hit:
+                self.metrics['hits'] += 1
+                if prediction['prestarted']:
+                    self.metrics['cold_starts_avoided'] += 1
+            else:
+                self.metrics['misses'] += 1
+            if prediction.get('stop_skipped'):
+                self.metrics['stops_skipped'] += 1
+            logger.debug(f"🔮 Predicción para {container_name}: {'acierto' if hit else 'fallo'}")
+
+    def run_cycle(self):
+        """Evalúa predicciones vencidas y programa la siguiente ventana"""
+        now = time.time()
+        to_start = []
+
+        with self._lock:
+            self._evaluate_expired(now)
+
+            available = self.max_prewarmed - len(self.predictions)
+            if available <= 0:
+                return
+
+            for container_name, expected in self.predict(now):
+                if available <= 0:
+                    break
+                if container_name in self.predictions:
+                    continue
+
+                prestart = container_name in self.activity_monitor.stopped_containers
+                self.predictions[container_name] = {
+                    'window_start': now + self.lead,
+                    'window_end': now + self.lead + self.window,
+                    'prestarted': prestart,
+                    'requests_at': self.activity_monitor.request_counts.get(container_name, 0),
+                    'expected': expected
+                }
+                self.metrics['predictions'] += 1
+                available -= 1
+                if prestart:
+                    to_start.append(container_name)
+
+        if not to_start:
+            return
+
+        logger.info(f"🔮 Pre-calentando {len(to_start)} proyectos: {', '.join(to_start)}")
+        start = self.activity_monitor.restart_container_if_stopped
+        if self.executor:
+            summary = self.executor.run_batch('prewarm', to_start, operation=lambda c: start(c.name))
+            started = [r['container_name'] for r in summary['results'] if r['status'] == 'ok']
+        else:
+            started = [name for name in to_start if start(name)]
+
+        with self._lock:
+            self.metrics['prestarted'] += len(started)
+            # Si no se pudo iniciar (p. ej. sin presupuesto) no cuenta como pre-calentado
+            for name in set(to_start) - set(started):
+                if name in self.predictions:
+                    self.predictions[name]['prestarted'] = False
+
+    def get_stats(self) -> Dict:
+        """Precisión de las predicciones y arranques en frío evitados"""
+        with self._lock:
+            evaluated = self.metrics['hits'] + self.metrics['misses']
+            return dict(
+                self.metrics,
+                precision=round(self.metrics['hits'] / evaluated, 3) if evaluated else None,
+                active_predictions=sorted(self.predictions),
+                max_prewarmed=self.max_prewarmed
+            )
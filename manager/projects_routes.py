@@ -4,14 +4,17 @@ Gestión de proyectos web de usuarios
 """
 from flask import Blueprint, request, jsonify
 import logging
+import threading
 import sys
 import os
+from typing import Callable, Optional
 
 # Agregar el directorio actual al path
 sys.path.insert(0, os.path.dirname(__file__))
 
 from roble_client import RobleClient
 from deploy_service import DeployService
+from docker_provider import get_docker_client
 import docker
 
 projects_bp = Blueprint('projects', __name__, url_prefix='/api/projects')
@@ -20,15 +23,39 @@ logger = logging.getLogger(__name__)
 # Instancia del cliente ROBLE
 roble = RobleClient()
 
-# Servicios de Docker y deploy
-try:
-    docker_client = docker.from_env()
-    deploy_service = DeployService(docker_client)
-    logger.info("Deploy service inicializado")
-except Exception as e:
-    logger.error(f"Error inicializando deploy service: {e}")
-    docker_client = None
-    deploy_service = None
+# Servicio de deploy: se crea al primer uso con Docker disponible (cliente compartido con el manager)
+_deploy_service = None
+_deploy_service_lock = threading.Lock()
+_deploy_service_setup = []  # configuraciones que registra el manager (presupuesto, estado compartido)
+
+def on_deploy_service_created(setup: Callable[[DeployService], None]):
+    """Aplica `setup` al servicio de deploy al crearlo (o ya, si existe)"""
+    with _deploy_service_lock:
+        _deploy_service_setup.append(setup)
+        if _deploy_service:
+            setup(_deploy_service)
+
+def get_deploy_service() -> Optional[DeployService]:
+    """
+    Servicio de deploy, creado la primera vez que Docker responde
+
+    Returns:
+        DeployService o None si Docker no está disponible (se reintenta en la siguiente llamada)
+    """
+    global _deploy_service
+    if _deploy_service is not None:
+        return _deploy_service
+    docker_client = get_docker_client()
+    if docker_client is None:
+        return None
+    with _deploy_service_lock:
+        if _deploy_service is None:
+            deploy_service = DeployService(docker_client)
+            for setup in _deploy_service_setup:
+                setup(deploy_service)
+            _deploy_service = deploy_service
+            logger.info("Deploy service inicializado")
+    return _deploy_service
 
 def get_token_from_header():
     """Extrae el token del header Authorization"""
@@ -99,7 +126,7 @@ def get_projects():
         print(f"================================\n", flush=True)
         
         # Agregar info de containers a cada proyecto con estado REAL de Docker
-        docker_client = docker.from_env()
+        docker_client = get_docker_client()
         
         # Obtener monitor de actividad
         from manager import get_activity_monitor
@@ -242,6 +269,7 @@ def create_project():
         
         logger.info(f"✅ Proyecto creado: {nombre} para usuario {user_id}")
         
+        deploy_service = get_deploy_service()
         # Iniciar deploy en background
         if deploy_service:
             def deploy_callback(proj_id, status, message):
@@ -364,6 +392,7 @@ def delete_project(project_id):
         if project.get('user_id') != user_id:
             return jsonify({'error': 'No tienes permiso para eliminar este proyecto'}), 403
         
+        deploy_service = get_deploy_service()
         # Detener y eliminar contenedor Docker
         if project.get('container_id') and deploy_service:
             success, message = deploy_service.remove_container(project['container_id'])
@@ -438,12 +467,12 @@ def rebuild_project(project_id):
         # Actualizar estado a building
         roble.update_project_status(project_id, 'building', access_token=access_token)
         
+        deploy_service = get_deploy_service()
         # Detener contenedor anterior si existe
         if deploy_service:
             # Buscar contenedor por nombre si no tenemos container_id
             try:
-                import docker
-                docker_client = docker.from_env()
+                docker_client = get_docker_client()
                 container_name = f"project_{user_id.replace('@', '_').replace('.', '_')}_{project['nombre']}"
                 
                 # Intentar obtener el contenedor
@@ -561,3 +590,67 @@ def track_activity(container_name):
         # No fallar, solo logear
         return jsonify({'success': True, 'message': 'Activity tracking failed'}), 200
 
+
+@projects_bp.route('/activity/<container_name>/policy', methods=['PUT'])
+def set_idle_policy(container_name):
+    """
+    Define el timeout de inactividad propio de un proyecto
+    
+    Headers:
+        Authorization: Bearer {accessToken}
+        
+    Body:
+        idle_timeout: Segundos de inactividad antes del auto-apagado (null = global)
+        
+    Returns:
+        Política aplicada
+    """
+    try:
+        access_token = get_token_from_header()
+        if not access_token:
+            return jsonify({'error': 'Token no proporcionado'}), 401
+        
+        user_id = get_user_id_from_token(access_token)
+        if not user_id:
+            return jsonify({'error': 'Usuario no válido'}), 401
+        
+        deploy_service = get_deploy_service()
+        if not deploy_service:
+            return jsonify({'error': 'Docker no disponible'}), 503
+        
+        # Verificar que el contenedor pertenece al usuario
+        try:
+            container = deploy_service.docker_client.containers.get(container_name)
+        except docker.errors.NotFound:
+            return jsonify({'error': 'Contenedor no encontrado'}), 404
+        
+        if container.labels.get('user_id') != user_id:
+            return jsonify({'error': 'No tienes permiso para modificar este proyecto'}), 403
+        
+        data = request.get_json() or {}
+        idle_timeout = data.get('idle_timeout')
+        if idle_timeout is not None:
+            try:
+                idle_timeout = int(idle_timeout)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'idle_timeout debe ser un número de segundos'}), 400
+            if idle_timeout < 60:
+                return jsonify({'error': 'idle_timeout mínimo: 60 segundos'}), 400
+        
+        from manager import get_activity_monitor
+        monitor = get_activity_monitor()
+        if not monitor:
+            return jsonify({'error': 'Monitor no disponible'}), 503
+        
+        monitor.set_idle_policy(container.name, idle_timeout)
+        monitor.save_snapshot()
+        
+        return jsonify({
+            'success': True,
+            'container_name': container.name,
+            'idle_timeout': monitor.get_idle_timeout(container.name)
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error actualizando política de inactividad: {e}")
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,256 @@
+"""
+Presupuesto de recursos del host para contenedores de proyectos
+Desaloja los proyectos menos activos (LRU) cuando un deploy o un reinicio no cabe
+"""
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ResourceBudget:
+    """Límite global de memoria y CPU para los contenedores project_*"""
+
+    def __init__(self, docker_client, activity_monitor=None, memory_budget_mb=2048,
+                 cpu_budget=4.0, eviction_mode='stop', pinned_projects=None):
+        self.docker_client = docker_client
+        self.activity_monitor = activity_monitor
+        self.memory_budget = memory_budget_mb * 1024 * 1024  # bytes
+        self.cpu_budget = cpu_budget  # cores
+        self.eviction_mode = eviction_mode  # 'stop' o 'pause' (pausar solo libera CPU)
+        self.pinned_projects = set(pinned_projects or [])  # nombres de proyecto o contenedor
+        self.reservations = {}  # {container_name: (memoria, cpus, timestamp)} deploys en curso
+        self.evicting = {}  # {container_name: (memoria, cpus)} que se liberan con desalojos en curso
+        self.reservation_ttl = 120  # segundos
+        self.recent_evictions = deque(maxlen=100)
+        self.metrics = {
+            'evictions_total': 0,
+            'evictions_stop': 0,
+            'evictions_pause': 0,
+            'eviction_failures': 0,
+            'capacity_denied': 0,
+            'capacity_checks': 0
+        }
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_container_limits(container) -> Tuple[int, float]:
+        """
+        Lee los límites configurados de un contenedor
+
+        Returns:
+            (memoria en bytes, cpus)
+        """
+        host_config = container.attrs.get('HostConfig', {}) or {}
+        memory = host_config.get('Memory') or 0
+        if host_config.get('NanoCpus'):
+            cpus = host_config['NanoCpus'] / 1e9
+        elif host_config.get('CpuQuota'):
+            cpus = host_config['CpuQuota'] / (host_config.get('CpuPeriod') or 100000)
+        else:
+            cpus = 0.0
+        return memory, cpus
+
+    def is_pinned(self, container) -> bool:
+        """Los proyectos fijados nunca se desalojan"""
+        labels = container.labels or {}
+        return (
+            labels.get('roble.pinned', '').lower() == 'true'
+            or container.name in self.pinned_projects
+            or labels.get('project_name') in self.pinned_projects
+        )
+
+    def _running_projects(self) -> List:
+        return self.docker_client.containers.list(filters={'name': 'project_'})
+
+    def _usage(self, containers, exclude: Optional[str] = None) -> Tuple[int, float]:
+        """
+        Memoria y CPU comprometidas por contenedores activos y reservas pendientes,
+        sin contar `exclude` (el contenedor que se va a reemplazar o reanudar) y
+        descontando lo que liberan los desalojos en curso
+        """
+        memory = 0
+        cpus = 0.0
+        running_names = set()
+        for container in containers:
+            running_names.add(container.name)
+            if container.name == exclude:
+                continue
+            container_memory, container_cpus = self.get_container_limits(container)
+            memory += container_memory
+            # Un contenedor pausado conserva su memoria pero no consume CPU
+            if container.status != 'paused':
+                cpus += container_cpus
+            if container.name in self.evicting:
+                freed_memory, freed_cpus = self.evicting[container.name]
+                memory -= freed_memory
+                cpus -= freed_cpus
+
+        now = time.time()
+        for name, (reserved_memory, reserved_cpus, reserved_at) in list(self.reservations.items()):
+            if name == exclude or name in running_names or now - reserved_at > self.reservation_ttl:
+                del self.reservations[name]
+                continue
+            memory += reserved_memory
+            cpus += reserved_cpus
+        return memory, cpus
+
+    def get_usage(self) -> Dict:
+        """Uso actual frente al presupuesto"""
+        with self._lock:
+            containers = self._running_projects()
+            memory, cpus = self._usage(containers)
+        return {
+            'memory_bytes': memory,
+            'memory_budget_bytes': self.memory_budget,
+            'cpus': round(cpus, 2),
+            'cpu_budget': self.cpu_budget,
+            'running_containers': len(containers)
+        }
+
+    def _lru_candidates(self, containers, exclude: Optional[str]) -> List:
+        """Contenedores desalojables ordenados del menos al más recientemente activo"""
+        last_activity = self.activity_monitor.last_activity if self.activity_monitor else {}
+        candidates = [
+            c for c in containers
+            if c.name != exclude and c.name not in self.evicting and not self.is_pinned(c)
+        ]
+        candidates.sort(key=lambda c: last_activity.get(c.name, 0))
+        return candidates
+
+    def ensure_capacity(self, memory: int, cpus: float, reason: str,
+                        container_name: Optional[str] = None) -> bool:
+        """
+        Garantiza espacio para un contenedor nuevo o que se reinicia,
+        desalojando proyectos por orden LRU si hace falta. Los desalojados se
+        eligen y la reserva se registra bajo el lock; las paradas se hacen
+        fuera de él para no bloquear otros deploys o reinicios
+
+        Args:
+            memory: Memoria requerida en bytes
+            cpus: CPUs requeridas
+            reason: 'deploy' o 'wake' (para el log de desalojos)
+            container_name: Contenedor que se va a iniciar (nunca se desaloja y
+                            su versión actual no cuenta en el uso: se reemplaza)
+
+        Returns:
+            True si hay capacidad (la reserva queda registrada), False si no cabe
+            aun desalojando todos los proyectos no fijados
+        """
+        with self._lock:
+            self.metrics['capacity_checks'] += 1
+            containers = self._running_projects()
+            used_memory, used_cpus = self._usage(containers, exclude=container_name)
+
+            def fits(planned_memory, planned_cpus):
+                return (planned_memory + memory <= self.memory_budget
+                        and planned_cpus + cpus <= self.cpu_budget)
+
+            # Planificar primero: si ni desalojando todo cabe, no desalojar a nadie
+            plan = []
+            planned_memory, planned_cpus = used_memory, used_cpus
+            for victim in self._lru_candidates(containers, container_name):
+                if fits(planned_memory, planned_cpus):
+                    break
+
+                memory_short = planned_memory + memory > self.memory_budget
+                victim_memory, victim_cpus = self.get_container_limits(victim)
+                # Pausar solo sirve si falta CPU; con memoria insuficiente hay que detener
+                action = 'pause' if self.eviction_mode == 'pause' and not memory_short else 'stop'
+                if action == 'pause' and victim.status == 'paused':
+                    continue
+
+                freed_cpus = victim_cpus if victim.status != 'paused' else 0.0
+                freed_memory = victim_memory if action == 'stop' else 0
+                planned_memory -= freed_memory
+                planned_cpus -= freed_cpus
+                plan.append((victim, action, freed_memory, freed_cpus))
+
+            if not fits(planned_memory, planned_cpus):
+                self.metrics['capacity_denied'] += 1
+                logger.warning(
+                    f"🚫 Sin capacidad para {container_name or 'contenedor'} ({reason}): "
+                    f"memoria {used_memory // (1024 * 1024)}+{memory // (1024 * 1024)}MB / "
+                    f"{self.memory_budget // (1024 * 1024)}MB, CPU {used_cpus:.2f}+{cpus:.2f} / {self.cpu_budget}"
+                )
+                return False
+
+            # Lo que liberan los desalojos ya cuenta para otras peticiones concurrentes
+            for victim, action, freed_memory, freed_cpus in plan:
+                self.evicting[victim.name] = (freed_memory, freed_cpus)
+            if container_name:
+                self.reservations[container_name] = (memory, cpus, time.time())
+
+        if not plan:
+            return True
+
+        failed = []
+        try:
+            for victim, action, _, _ in plan:
+                if not self._evict(victim, action, reason, container_name):
+                    failed.append(victim.name)
+        finally:
+            with self._lock:
+                for victim, _, _, _ in plan:
+                    self.evicting.pop(victim.name, None)
+                if failed:
+                    self.metrics['capacity_denied'] += 1
+                    if container_name:
+                        self.reservations.pop(container_name, None)
+
+        if failed:
+            logger.warning(f"🚫 Sin capacidad para {container_name or 'contenedor'} ({reason}): "
+                           f"no se pudo desalojar {', '.join(failed)}")
+            return False
+        return True
+
+    def _evict(self, container, action: str, reason: str, requested_by: Optional[str]) -> bool:
+        """Detiene o pausa un contenedor y registra la decisión (se llama sin el lock)"""
+        last_activity = None
+        if self.activity_monitor:
+            last_activity = self.activity_monitor.last_activity.get(container.name)
+
+        try:
+            if action == 'pause':
+                container.pause()
+            else:
+                container.stop(timeout=10)
+        except Exception as e:
+            with self._lock:
+                self.metrics['eviction_failures'] += 1
+            logger.error(f"❌ Error desalojando {container.name}: {e}")
+            return False
+
+        if self.activity_monitor:
+            self.activity_monitor.mark_stopped(container.name)
+
+        with self._lock:
+            self.metrics['evictions_total'] += 1
+            self.metrics[f'evictions_{action}'] += 1
+            self.recent_evictions.append({
+                'container_name': container.name,
+                'action': action,
+                'reason': reason,
+                'requested_by': requested_by,
+                'last_activity': last_activity,
+                'evicted_at': time.time()
+            })
+        idle = f"{int((time.time() - last_activity) / 60)} min" if last_activity else "desconocida"
+        logger.info(
+            f"♻️ Desalojo LRU ({action}) de {container.name} para {requested_by or reason} "
+            f"[{reason}], inactividad: {idle}"
+        )
+        return True
+
+    def get_stats(self) -> Dict:
+        """Métricas de desalojo y uso para /api/metrics"""
+        return {
+            'usage': self.get_usage(),
+            'eviction_mode': self.eviction_mode,
+            'pinned_projects': sorted(self.pinned_projects),
+            'evicting': sorted(self.evicting),
+            'metrics': dict(self.metrics),
+            'recent_evictions': list(self.recent_evictions)
+        }
@@ -0,0 +1,158 @@
+"""
+Cargador de código para los contenedores del pool de runtime
+Se ejecuta DENTRO de la imagen roble_microservice_runtime (no en el manager):
+expone un canal de control en RUNTIME_CONTROL_PORT para recibir app.py y
+(re)lanzar la aplicación en el puerto 5000 sin reconstruir ni recrear el contenedor
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+APP_DIR = os.getenv('RUNTIME_APP_DIR', '/app')
+APP_PATH = os.path.join(APP_DIR, 'app.py')
+ENV_PATH = os.path.join(APP_DIR, '.runtime_env.json')
+APP_PORT = 5000
+CONTROL_PORT = int(os.getenv('RUNTIME_CONTROL_PORT', '5001'))
+CONTROL_TOKEN = os.getenv('RUNTIME_CONTROL_TOKEN', '')
+MAX_CODE_BYTES = 1024 * 1024
+
+state = {'process': None, 'version': 0, 'loaded_at': None, 'env': {}}
+lock = threading.Lock()
+
+def stop_app():
+    """Detiene la app actual (y sus hijos, p. ej. el reloader de Flask)"""
+    process = state['process']
+    if not process or process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+def wait_ready(timeout):
+    """Espera a que la app acepte conexiones en APP_PORT"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        process = state['process']
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(('127.0.0.1', APP_PORT), timeout=0.2):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def start_app(env):
+    """Lanza app.py en su propio grupo de procesos"""
+    state['env'] = {str(k): str(v) for k, v in (env or {}).items()}
+    process_env = dict(os.environ, **state['env'])
+    process_env.pop('RUNTIME_CONTROL_TOKEN', None)
+    state['process'] = subprocess.Popen(
+        [sys.executable, APP_PATH],
+        cwd=APP_DIR,
+        env=process_env,
+        start_new_session=True
+    )
+    state['version'] += 1
+    state['loaded_at'] = time.time()
+
+def load_code(code, env, timeout):
+    """Escribe app.py de forma atómica y relanza la aplicación"""
+    with lock:
+        fd, tmp_path = tempfile.mkstemp(dir=APP_DIR, suffix='.py')
+        with os.fdopen(fd, 'w') as f:
+            f.write(code)
+        os.replace(tmp_path, APP_PATH)
+        # El entorno se guarda junto al código para relanzarlo si el contenedor se reinicia
+        with open(ENV_PATH, 'w') as f:
+            json.dump(env or {}, f)
+
+        stop_app()
+        start_app(env)
+        ready = wait_ready(timeout)
+        return {
+            'loaded': True,
+            'ready': ready,
+            'version': state['version'],
+            'exit_code': state['process'].poll()
+        }
+
+def resume_app():
+    """Relanza el último código cargado (contenedor reiniciado tras parar)"""
+    if not os.path.exists(APP_PATH):
+        return
+    env = {}
+    if os.path.exists(ENV_PATH):
+        with open(ENV_PATH) as f:
+            env = json.load(f)
+    with lock:
+        start_app(env)
+
+class ControlHandler(BaseHTTPRequestHandler):
+    """Canal de control: POST /_runtime/load, GET /_runtime/status"""
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        return CONTROL_TOKEN and self.headers.get('X-Runtime-Token') == CONTROL_TOKEN
+
+    def do_GET(self):
+        if self.path != '/_runtime/status':
+            return self._reply(404, {'error': 'not found'})
+        process = state['process']
+        self._reply(200, {
+            'version': state['version'],
+            'loaded_at': state['loaded_at'],
+            'running': bool(process and process.poll() is None)
+        })
+
+    def do_POST(self):
+        if self.path != '/_runtime/load':
+            return self._reply(404, {'error': 'not found'})
+        if not self._authorized():
+            return self._reply(403, {'error': 'token inválido'})
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_CODE_BYTES:
+            return self._reply(400, {'error': 'tamaño de código inválido'})
+        try:
+            payload = json.loads(self.rfile.read(length))
+            result = load_code(payload['code'], payload.get('env'), float(payload.get('timeout', 10)))
+            self._reply(200, result)
+        except (ValueError, KeyError) as e:
+            self._reply(400, {'error': f'payload inválido: {e}'})
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    os.makedirs(APP_DIR, exist_ok=True)
+    # Hasta recibir código solo escucha el canal de control (contenedor ocioso del pool)
+    signal.signal(signal.SIGTERM, lambda *_: (stop_app(), sys.exit(0)))
+    resume_app()
+    server = ThreadingHTTPServer(('0.0.0.0', CONTROL_PORT), ControlHandler)
+    print(f"runtime loader escuchando en :{CONTROL_PORT}", flush=True)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
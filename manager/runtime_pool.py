@@ -0,0 +1,197 @@
+"""
+Pool de contenedores de runtime genéricos pre-iniciados
+Un microservicio nuevo reclama un contenedor ocioso y recibe su código por el
+canal de control de runtime_loader.py, sin build ni arranque de contenedor.
+Solo el líder rellena el pool; la lista de ociosos está en el estado compartido
+para que cualquier worker pueda reclamar uno
+"""
+import uuid
+import time
+import logging
+import secrets
+import threading
+import requests
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class RuntimePool:
+    """Mantiene `size` contenedores de runtime listos para recibir código"""
+
+    CONTROL_PORT = 5001
+    SHARED_KEY = 'runtime_pool_idle'
+
+    def __init__(self, docker_client, image, network, size=2, environment=None,
+                 ensure_image=None, load_timeout=10, ready_timeout=20, publish_ports=True):
+        self.docker_client = docker_client
+        self.image = image
+        self.network = network
+        self.size = size
+        self.environment = environment or {}
+        self.ensure_image = ensure_image  # callable que garantiza la imagen base
+        self.load_timeout = load_timeout  # segundos para que la app quede escuchando
+        self.ready_timeout = ready_timeout  # segundos para que el loader de un contenedor nuevo responda
+        self.publish_ports = publish_ports  # False: solo accesible por la red interna (gateway /svc)
+        self.idle = []  # [{'name', 'token', 'registry_id', 'created_at'}] si no hay estado compartido
+        self.shared_state = None  # SharedState opcional: ociosos visibles para todos los workers
+        self.refill_interval = 5  # segundos entre comprobaciones del líder (los claims de otros workers no lo despiertan)
+        self.session = requests.Session()
+        self.metrics = {'spawned': 0, 'claimed': 0, 'misses': 0, 'loads': 0, 'load_failures': 0}
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+        self.running = False
+        self.refill_thread = None
+
+    def attach_shared_state(self, shared_state):
+        """Guarda la lista de ociosos en el estado compartido"""
+        self.shared_state = shared_state
+
+    def _mutate_idle(self, func):
+        """Aplica func(lista) a la lista de ociosos de forma atómica y devuelve su resultado"""
+        result = []
+        def apply(idle):
+            idle = list(idle or [])
+            result.append(func(idle))
+            return idle
+        if self.shared_state:
+            self.shared_state.mutate(self.SHARED_KEY, apply, default=[])
+        else:
+            with self._lock:
+                self.idle = apply(self.idle)
+        return result[0]
+
+    def _idle_entries(self) -> List[Dict]:
+        if self.shared_state:
+            return self.shared_state.get(self.SHARED_KEY, [])
+        with self._lock:
+            return list(self.idle)
+
+    def start(self):
+        """Llena el pool en segundo plano (solo en el líder)"""
+        if not self.running and self.size > 0:
+            # La reconciliación del arranque elimina los contenedores del pool que no están registrados
+            self._mutate_idle(lambda idle: idle.clear())
+            self.running = True
+            self.refill_thread = threading.Thread(target=self._refill_loop, daemon=True)
+            self.refill_thread.start()
+            self._refill.set()
+            logger.info(f"🔥 Pool de runtime iniciado ({self.size} contenedores)")
+
+    def stop(self):
+        self.running = False
+        self._refill.set()
+
+    def _refill_loop(self):
+        while self.running:
+            self._refill.wait(self.refill_interval)
+            self._refill.clear()
+            try:
+                if len(self._prune()) >= self.size:
+                    continue
+                if self.ensure_image and not self.ensure_image():
+                    continue
+                while self.running and len(self._idle_entries()) < self.size:
+                    self._spawn()
+            except Exception as e:
+                logger.error(f"❌ Error rellenando pool de runtime: {e}")
+
+    def _prune(self) -> List[Dict]:
+        """Quita de la lista los contenedores eliminados por fuera (p. ej. /api/cleanup) y la devuelve"""
+        existing = {c.name for c in self.docker_client.containers.list(filters={'label': 'roble.pool=true'})}
+        def keep_existing(idle):
+            idle[:] = [entry for entry in idle if entry['name'] in existing]
+            return list(idle)
+        return self._mutate_idle(keep_existing)
+
+    def _spawn(self):
+        """Crea un contenedor de runtime ocioso"""
+        token = secrets.token_hex(16)
+        registry_id = uuid.uuid4().hex
+        name = f"dynamic_pool_{registry_id[:8]}"
+        container = self.docker_client.containers.run(
+            self.image,
+            name=name,
+            detach=True,
+            network=self.network,
+            ports={'5000/tcp': None} if self.publish_ports else {},  # Puerto del host asignado por Docker
+            environment=dict(self.environment, RUNTIME_CONTROL_TOKEN=token),
+            # Los labels son inmutables: el id de registro se asigna ya al crear el contenedor
+            labels={'roble.pool': 'true', 'roble.registry_id': registry_id}
+        )
+        if not self._wait_control_channel(name):
+            logger.warning(f"⚠️ El loader de {name} no respondió, se descarta")
+            container.remove(force=True)
+            return
+        entry = {'name': name, 'token': token, 'registry_id': registry_id, 'created_at': time.time()}
+        self._mutate_idle(lambda idle: idle.append(entry))
+        with self._lock:
+            self.metrics['spawned'] += 1
+        logger.info(f"🔥 Contenedor de runtime listo: {name}")
+
+    def _wait_control_channel(self, container_name: str) -> bool:
+        """Espera a que el canal de control del contenedor acepte peticiones"""
+        deadline = time.time() + self.ready_timeout
+        while time.time() < deadline:
+            try:
+                self.session.get(f"http://{container_name}:{self.CONTROL_PORT}/_runtime/status", timeout=1)
+                return True
+            except requests.RequestException:
+                time.sleep(0.2)
+        return False
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Toma un contenedor ocioso del pool (desde cualquier worker)
+
+        Returns:
+            {'container', 'token', 'registry_id'} o None si el pool está vacío
+        """
+        slot = None
+        while True:
+            candidate = self._mutate_idle(lambda idle: idle.pop(0) if idle else None)
+            if not candidate:
+                break
+            # Descarta contenedores eliminados por fuera (p. ej. /api/cleanup)
+            try:
+                container = self.docker_client.containers.get(candidate['name'])
+                if container.status == 'running':
+                    slot = {'container': container, 'token': candidate['token'],
+                            'registry_id': candidate['registry_id']}
+                    break
+            except Exception:
+                pass
+
+        with self._lock:
+            self.metrics['claimed' if slot else 'misses'] += 1
+        self._refill.set()
+        return slot
+
+    def load_code(self, container_name: str, token: str, code: str, env: Optional[Dict] = None) -> Dict:
+        """
+        Envía app.py al contenedor y espera a que la app escuche
+
+        Returns:
+            Respuesta del loader: {'loaded', 'ready', 'version', 'exit_code'}
+        """
+        self.metrics['loads'] += 1
+        try:
+            response = self.session.post(
+                f"http://{container_name}:{self.CONTROL_PORT}/_runtime/load",
+                headers={'X-Runtime-Token': token},
+                json={'code': code, 'env': env or {}, 'timeout': self.load_timeout},
+                timeout=self.load_timeout + 5
+            )
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            self.metrics['load_failures'] += 1
+            raise RuntimeError(f"Error cargando código en {container_name}: {e}")
+
+        if not result.get('ready'):
+            self.metrics['load_failures'] += 1
+        return result
+
+    def get_stats(self) -> Dict:
+        idle = len(self._idle_entries())
+        with self._lock:
+            return dict(self.metrics, idle=idle, size=self.size)
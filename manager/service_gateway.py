@@ -0,0 +1,187 @@
+"""
+Gateway del manager hacia los microservicios
+Reenvía /svc/<nombre>/... al servicio por la red interna con conexiones
+keep-alive reutilizadas, reparte entre réplicas y mide la latencia por servicio
+"""
+import os
+import time
+import socket
+import logging
+import threading
+import requests
+from collections import deque
+from requests.adapters import HTTPAdapter
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cabeceras hop-by-hop que no se reenvían (RFC 7230 §6.1)
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade'
+}
+# Además no se reenvían al upstream: las recalcula requests para la nueva conexión
+REQUEST_SKIP_HEADERS = HOP_BY_HOP_HEADERS | {'host', 'content-length'}
+
+class ServiceGateway:
+    """Proxy inverso con pool de conexiones y balanceo round-robin"""
+
+    def __init__(self, registry, timeout=30, pool_size=32, latency_window=500, chunk_size=64 * 1024,
+                 replica_lookup: Optional[Callable[[str], List[Dict]]] = None, shared_state=None,
+                 publish_interval=5):
+        self.registry = registry  # ServiceRegistry / dict {name: service_info}
+        self.timeout = timeout  # segundos de espera de respuesta del upstream
+        self.chunk_size = chunk_size
+        self.latency_window = latency_window  # muestras recientes para percentiles
+        self.replica_lookup = replica_lookup  # réplicas adicionales de un servicio (autoscaler)
+        self.shared_state = shared_state  # carga publicada para el autoscaler del líder
+        self.publish_interval = publish_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self._cursors = {}  # {service_name: siguiente índice round-robin}
+        self._stats = {}  # {service_name: {...}}
+        self._in_flight = {}  # {service_name: peticiones en curso}
+        self._published_at = 0
+        self._lock = threading.Lock()
+
+    def resolve_targets(self, service_name: str, service_info: Dict) -> List[str]:
+        """Endpoints internos del servicio: el contenedor principal y sus réplicas"""
+        targets = [service_info['internal_endpoint']]
+        if self.replica_lookup:
+            targets.extend(r['internal_endpoint'] for r in self.replica_lookup(service_name))
+        return targets
+
+    def _ordered_targets(self, service_name: str, targets: List[str]) -> List[str]:
+        """Rota la lista para repartir peticiones; el resto queda como reintento"""
+        with self._lock:
+            cursor = self._cursors.get(service_name, 0)
+            self._cursors[service_name] = cursor + 1
+        start = cursor % len(targets)
+        return targets[start:] + targets[:start]
+
+    def forward(self, service_name: str, path: str, method: str, headers: Dict, query: bytes,
+                body: bytes) -> Tuple[Optional[requests.Response], Optional[str], int]:
+        """
+        Reenvía una petición al servicio
+
+        Returns:
+            (respuesta upstream en streaming, error, status) — si hay error la respuesta es None.
+            La respuesta se debe consumir con stream() para liberar la conexión
+        """
+        service_info = self.registry.get(service_name)
+        if not service_info:
+            return None, f"Microservicio '{service_name}' no encontrado", 404
+
+        forward_headers = {k: v for k, v in headers.items() if k.lower() not in REQUEST_SKIP_HEADERS}
+        suffix = f"/{path}" if path else '/'
+        if query:
+            suffix += '?' + query.decode('latin-1')
+
+        self._track_in_flight(service_name, 1)
+        last_error = None
+        for target in self._ordered_targets(service_name, self.resolve_targets(service_name, service_info)):
+            started = time.time()
+            try:
+                # Reintento solo ante fallos de conexión (la petición no llegó al servicio)
+                response = self.session.request(
+                    method, target + suffix, headers=forward_headers, data=body,
+                    stream=True, timeout=(3, self.timeout), allow_redirects=False
+                )
+            except requests.ConnectionError as e:
+                last_error = f"Sin conexión con {target}"
+                self._record(service_name, target, time.time() - started, error=True)
+                logger.warning(f"🔀 {service_name}: {target} no responde ({type(e).__name__})")
+                continue
+            except requests.Timeout:
+                self._record(service_name, target, time.time() - started, error=True)
+                self._track_in_flight(service_name, -1)
+                return None, f"Timeout esperando a {service_name}", 504
+
+            self._record(service_name, target, time.time() - started, error=response.status_code >= 500)
+            return response, None, response.status_code
+
+        self._track_in_flight(service_name, -1)
+        return None, last_error or f"Microservicio '{service_name}' sin réplicas disponibles", 502
+
+    @staticmethod
+    def response_headers(response: requests.Response) -> List[Tuple[str, str]]:
+        return [(k, v) for k, v in response.raw.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+
+    def stream(self, service_name: str, response: requests.Response):
+        """Cuerpo de la respuesta por bloques; devuelve la conexión al pool al terminar"""
+        try:
+            for chunk in response.raw.stream(self.chunk_size, decode_content=False):
+                yield chunk
+        finally:
+            response.close()
+            self._track_in_flight(service_name, -1)
+
+    def _track_in_flight(self, service_name: str, delta: int):
+        with self._lock:
+            self._in_flight[service_name] = max(0, self._in_flight.get(service_name, 0) + delta)
+
+    def _record(self, service_name: str, target: str, elapsed: float, error: bool = False):
+        """Latencia hasta recibir las cabeceras del upstream"""
+        with self._lock:
+            stats = self._stats.get(service_name)
+            if stats is None:
+                stats = self._stats[service_name] = {
+                    'requests': 0, 'errors': 0, 'total_ms': 0.0,
+                    'latencies': deque(maxlen=self.latency_window), 'recent': [], 'targets': {}
+                }
+            elapsed_ms = elapsed * 1000
+            stats['requests'] += 1
+            stats['errors'] += 1 if error else 0
+            stats['total_ms'] += elapsed_ms
+            stats['latencies'].append(elapsed_ms)
+            stats['recent'].append(elapsed_ms)
+            stats['targets'][target] = stats['targets'].get(target, 0) + 1
+        self._maybe_publish()
+
+    def _maybe_publish(self):
+        """Publica la carga de este worker como mucho cada publish_interval segundos"""
+        now = time.time()
+        if not self.shared_state or now - self._published_at < self.publish_interval:
+            return
+        with self._lock:
+            if now - self._published_at < self.publish_interval:
+                return
+            self._published_at = now
+            services = {}
+            for name, stats in self._stats.items():
+                recent = sorted(stats['recent'])
+                stats['recent'] = []
+                services[name] = {
+                    'requests': stats['requests'],
+                    'in_flight': self._in_flight.get(name, 0),
+                    'p95_ms': round(recent[min(len(recent) - 1, int(0.95 * len(recent)))], 1) if recent else None
+                }
+        try:
+            self.shared_state.update_mapping('gateway_load', self.worker_id, {'at': now, 'services': services})
+        except Exception as e:
+            logger.warning(f"⚠️ Error publicando carga del gateway: {e}")
+
+    def get_service_stats(self, service_name: str) -> Optional[Dict]:
+        """Latencias recientes de un servicio (p50/p95/p99 sobre la ventana)"""
+        with self._lock:
+            stats = self._stats.get(service_name)
+            if not stats:
+                return None
+            latencies = sorted(stats['latencies'])
+            summary = {
+                'requests': stats['requests'],
+                'errors': stats['errors'],
+                'in_flight': self._in_flight.get(service_name, 0),
+                'avg_ms': round(stats['total_ms'] / stats['requests'], 1),
+                'targets': dict(stats['targets'])
+            }
+        for name, q in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            summary[name] = round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 1)
+        return summary
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            names = list(self._stats)
+        return {name: self.get_service_stats(name) for name in names}
@@ -0,0 +1,160 @@
+"""
+Registro persistente de microservicios
+Mapeo {nombre: service_info} con escritura directa en SQLite: los servicios
+dinámicos sobreviven a un reinicio del manager y se re-adoptan por label
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Campos volátiles que mantiene health_prober y no se guardan en disco
+VOLATILE_FIELDS = ('health_latency_ms', 'consecutive_failures', 'last_health_check', 'last_health_error')
+
+class ServiceRegistry(MutableMapping):
+    """Registro de microservicios; los estáticos viven solo en memoria"""
+
+    def __init__(self, db_path='/data/services.db', static_services: Optional[Dict[str, Dict]] = None,
+                 refresh_interval=1.0):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._services = dict(static_services or {})
+        self.refresh_interval = refresh_interval  # segundos entre comprobaciones de cambios de otros workers
+        self._version = None
+        self._checked_at = 0
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._init_db()
+        self._load()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _init_db(self):
+        """Crea la tabla si no existe"""
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS services (
+                    name TEXT PRIMARY KEY,
+                    registry_id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            # Versión global: cada escritura la incrementa y los demás workers recargan al verla cambiar
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+
+    def _load(self):
+        """Carga los servicios dinámicos guardados"""
+        try:
+            with self._connect() as conn:
+                self._version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+                rows = conn.execute('SELECT name, data FROM services').fetchall()
+        except Exception as e:
+            logger.error(f"❌ Error cargando registro de microservicios: {e}")
+            return
+        for name, data in rows:
+            self._services.setdefault(name, json.loads(data))
+        self._checked_at = time.time()
+        if rows:
+            logger.info(f"📚 Registro restaurado: {len(rows)} microservicios dinámicos")
+
+    def _refresh(self):
+        """Recarga los cambios hechos por otros workers (como mucho cada refresh_interval)"""
+        now = time.time()
+        if now - self._checked_at < self.refresh_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                with self._connect() as conn:
+                    version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+                    if version == self._version:
+                        return
+                    rows = dict(conn.execute('SELECT name, data FROM services').fetchall())
+            except Exception as e:
+                logger.error(f"❌ Error refrescando registro de microservicios: {e}")
+                return
+
+            self._version = version
+            for name in [n for n, info in self._services.items() if not info.get('is_static', False)]:
+                if name not in rows:
+                    del self._services[name]
+            for name, data in rows.items():
+                stored = json.loads(data)
+                current = self._services.get(name)
+                if current is None:
+                    self._services[name] = stored
+                else:
+                    # El estado de salud lo mantiene health_prober (el líder lo publica en el estado compartido)
+                    stored.pop('status', None)
+                    current.update(stored)
+
+    def _bump_version(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        # Si otro worker escribió entre medias la versión salta más de uno y se recargará
+        if self._version is not None and version == self._version + 1:
+            self._version = version
+
+    def _write(self, name: str, service_info: Dict):
+        data = {k: v for k, v in service_info.items() if k not in VOLATILE_FIELDS}
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO services (name, registry_id, data, updated_at) VALUES (?, ?, ?, ?)',
+                (name, service_info.get('registry_id', ''), json.dumps(data), time.time())
+            )
+            self._bump_version(conn)
+
+    def __getitem__(self, name: str) -> Dict:
+        self._refresh()
+        return self._services[name]
+
+    def __setitem__(self, name: str, service_info: Dict):
+        with self._lock:
+            if not service_info.get('is_static', False):
+                self._write(name, service_info)
+            self._services[name] = service_info
+
+    def __delitem__(self, name: str):
+        with self._lock:
+            del self._services[name]
+            with self._connect() as conn:
+                conn.execute('DELETE FROM services WHERE name = ?', (name,))
+                self._bump_version(conn)
+
+    def __iter__(self) -> Iterator[str]:
+        self._refresh()
+        return iter(list(self._services))
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._services)
+
+    def persist(self, name: str):
+        """Guarda un servicio modificado en el sitio (p. ej. config o código)"""
+        with self._lock:
+            service_info = self._services.get(name)
+            if service_info and not service_info.get('is_static', False):
+                self._write(name, service_info)
+
+    def update_fields(self, name: str, **fields) -> Dict:
+        """Actualiza campos de un servicio y los persiste"""
+        with self._lock:
+            service_info = self._services[name]
+            service_info.update(fields)
+            self.persist(name)
+            return service_info
+
+    def dynamic_items(self):
+        """[(nombre, service_info)] de los servicios no estáticos"""
+        self._refresh()
+        return [(name, info) for name, info in list(self._services.items()) if not info.get('is_static', False)]
@@ -0,0 +1,267 @@
+"""
+Estado compartido entre procesos worker del manager
+SQLite (WAL) con transacciones IMMEDIATE para los valores que antes eran
+globales de un solo proceso: clave-valor, reserva de puertos, actividad
+pendiente de los proyectos y el lease del líder de tareas en segundo plano
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class SharedState:
+    """Almacén compartido por todos los workers (un fichero SQLite en /data)"""
+
+    def __init__(self, db_path='/data/shared_state.db'):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._init_db()
+
+    def _conn(self):
+        """Una conexión por thread (sqlite3 no comparte conexiones entre threads)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Transacción con bloqueo de escritura desde el inicio (serializa entre procesos)"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _init_db(self):
+        """Crea las tablas si no existen"""
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, updated_at REAL)')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ports (
+                    pool TEXT NOT NULL,
+                    port INTEGER NOT NULL,
+                    owner TEXT,
+                    claimed_at REAL,
+                    PRIMARY KEY (pool, port)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS activity (
+                    container_name TEXT PRIMARY KEY,
+                    last_activity REAL NOT NULL,
+                    pending INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute('CREATE TABLE IF NOT EXISTS leases (role TEXT PRIMARY KEY, holder TEXT, expires_at REAL)')
+
+    # --- Clave-valor ---
+
+    def get(self, key: str, default=None):
+        row = self._conn().execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value):
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO kv (key, value, updated_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time())
+            )
+
+    def update_mapping(self, key: str, field: str, value):
+        """Modifica un campo de un diccionario guardado en `key` de forma atómica"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+            mapping = json.loads(row[0]) if row else {}
+            mapping[field] = value
+            conn.execute(
+                'INSERT OR REPLACE INTO kv (key, value, updated_at) VALUES (?, ?, ?)',
+                (key, json.dumps(mapping), time.time())
+            )
+
+    def mutate(self, key: str, func: Callable, default=None):
+        """Lee, transforma con func(valor) y guarda `key` en una sola transacción"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+            value = func(json.loads(row[0]) if row else default)
+            conn.execute(
+                'INSERT OR REPLACE INTO kv (key, value, updated_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time())
+            )
+            return value
+
+    # --- Puertos ---
+
+    def claim_port(self, pool: str, start: int, end: int, owner: Optional[str] = None,
+                   is_free: Optional[Callable[[int], bool]] = None) -> Optional[int]:
+        """
+        Reserva el primer puerto libre del rango [start, end] para todo el manager
+
+        Args:
+            is_free: Comprobación adicional (p. ej. bind local); se salta el puerto si devuelve False
+
+        Returns:
+            Puerto reservado o None si el rango está agotado
+        """
+        with self._transaction() as conn:
+            claimed = {row[0] for row in conn.execute('SELECT port FROM ports WHERE pool = ?', (pool,))}
+            for port in range(start, end + 1):
+                if port in claimed or (is_free and not is_free(port)):
+                    continue
+                conn.execute(
+                    'INSERT INTO ports (pool, port, owner, claimed_at) VALUES (?, ?, ?, ?)',
+                    (pool, port, owner, time.time())
+                )
+                return port
+        return None
+
+    def release_port(self, pool: str, port: int):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM ports WHERE pool = ? AND port = ?', (pool, port))
+
+    def sync_ports(self, pool: str, ports: Iterable[int]):
+        """Registra puertos ya ocupados (p. ej. los publicados por contenedores existentes)"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO ports (pool, port, owner, claimed_at) VALUES (?, ?, NULL, ?)',
+                [(pool, int(port), now) for port in ports]
+            )
+
+    def claimed_ports(self, pool: str) -> Set[int]:
+        return {row[0] for row in self._conn().execute('SELECT port FROM ports WHERE pool = ?', (pool,))}
+
+    # --- Actividad de proyectos ---
+
+    def record_activity(self, container_name: str, timestamp: Optional[float] = None, count: int = 1):
+        """Registra actividad desde cualquier worker; el líder la consume con drain_activity"""
+        timestamp = timestamp or time.time()
+        with self._transaction() as conn:
+            conn.execute("""
+                INSERT INTO activity (container_name, last_activity, pending) VALUES (?, ?, ?)
+                ON CONFLICT(container_name) DO UPDATE SET
+                    last_activity = MAX(last_activity, excluded.last_activity),
+                    pending = pending + excluded.pending
+            """, (container_name, timestamp, count))
+
+    def publish_activity(self, last_activity: Dict[str, float]):
+        """Publica timestamps ya contabilizados por el líder (sin peticiones pendientes)"""
+        with self._transaction() as conn:
+            conn.executemany("""
+                INSERT INTO activity (container_name, last_activity, pending) VALUES (?, ?, 0)
+                ON CONFLICT(container_name) DO UPDATE SET
+                    last_activity = MAX(last_activity, excluded.last_activity)
+            """, list(last_activity.items()))
+
+    def drain_activity(self) -> Dict[str, Dict]:
+        """
+        Toma la actividad pendiente registrada por los workers
+
+        Returns:
+            {container_name: {'last_seen', 'count'}} (mismo formato que AccessLogTailer)
+        """
+        with self._transaction() as conn:
+            rows = conn.execute('SELECT container_name, last_activity, pending FROM activity WHERE pending > 0').fetchall()
+            conn.execute('UPDATE activity SET pending = 0 WHERE pending > 0')
+        return {name: {'last_seen': last_seen, 'count': pending} for name, last_seen, pending in rows}
+
+    def get_activity(self, container_name: str) -> Optional[float]:
+        row = self._conn().execute(
+            'SELECT last_activity FROM activity WHERE container_name = ?', (container_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def forget_activity(self, container_name: str):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM activity WHERE container_name = ?', (container_name,))
+
+    # --- Lease de líder ---
+
+    def acquire_lease(self, role: str, holder: str, ttl: float) -> bool:
+        """Toma o renueva el lease de un rol; True si `holder` es el líder"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT holder, expires_at FROM leases WHERE role = ?', (role,)).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO leases (role, holder, expires_at) VALUES (?, ?, ?)',
+                (role, holder, now + ttl)
+            )
+            return True
+
+    def release_lease(self, role: str, holder: str):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM leases WHERE role = ? AND holder = ?', (role, holder))
+
+    def lease_holder(self, role: str) -> Optional[str]:
+        row = self._conn().execute(
+            'SELECT holder FROM leases WHERE role = ? AND expires_at > ?', (role, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+
+class LeaderElection:
+    """Ejecuta un rol en segundo plano en un único worker mediante un lease renovable"""
+
+    def __init__(self, shared_state: SharedState, role: str, on_elected: Callable, on_lost: Optional[Callable] = None,
+                 ttl=30):
+        self.shared_state = shared_state
+        self.role = role
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self.running = False
+        self.election_thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.election_thread = threading.Thread(target=self._election_loop, daemon=True)
+            self.election_thread.start()
+
+    def stop(self):
+        self.running = False
+        self._stop.set()
+        if self.is_leader:
+            self.shared_state.release_lease(self.role, self.holder)
+            self._set_leader(False)
+
+    def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        if leader:
+            logger.info(f"👑 Worker {self.holder} es líder de '{self.role}'")
+            self.on_elected()
+        else:
+            logger.warning(f"👑 Worker {self.holder} deja de ser líder de '{self.role}'")
+            if self.on_lost:
+                self.on_lost()
+
+    def _election_loop(self):
+        while self.running:
+            try:
+                self._set_leader(self.shared_state.acquire_lease(self.role, self.holder, self.ttl))
+            except Exception as e:
+                logger.error(f"❌ Error renovando lease de '{self.role}': {e}")
+            # Renovación a un tercio del TTL: un líder caído se reemplaza en como mucho ttl segundos
+            self._stop.wait(self.ttl / 3)
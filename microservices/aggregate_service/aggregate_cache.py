@@ -0,0 +1,265 @@
+"""
+Agregados materializados del aggregate-service
+Guarda en memoria el resultado de las agregaciones que se consultan, junto con
+una copia compacta de las filas (solo los campos usados, por _id). Al caducar
+el TTL se relee la tabla en segundo plano y se comparan las filas: si cambiaron
+pocas, sus deltas (bajas y altas) se combinan en el estado parcial de cada
+agregación; si cambiaron muchas, se recalcula con el motor vectorizado.
+Las agregaciones aproximadas no guardan filas (memoria acotada): su sketch se
+reconstruye leyendo la tabla al caducar. Cada usuario tiene sus propias filas y
+agregaciones, leídas con su token
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from sys import intern
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from groupby import AggregationSpec, Columns, PartialAggregate, aggregate
+from approximate import ApproximateAggregation
+
+logger = logging.getLogger(__name__)
+
+# Fracción de filas cambiadas a partir de la cual se recalcula en lugar de aplicar deltas
+REBUILD_FRACTION = 0.2
+
+class _View:
+    """Agregación materializada"""
+    __slots__ = ('spec', 'partial', 'body', 'hits')
+
+    def __init__(self, spec: AggregationSpec):
+        self.spec = spec
+        self.partial: Optional[PartialAggregate] = None  # None: sin estado incremental (se recalcula)
+        self.body = None
+        self.hits = 0
+
+class UserAggregates:
+    """Agregaciones materializadas de un usuario refrescadas por TTL con deltas por fila"""
+
+    def __init__(self, loader: Callable[[str], Iterable[Dict]], ttl=60, max_views=32,
+                 finalize: Callable[[Dict], Dict] = lambda result: result,
+                 compute: Callable[[Columns, AggregationSpec], Dict] = aggregate):
+        self.loader = loader  # (token) -> filas de ROBLE
+        self.ttl = ttl
+        self.max_views = max_views
+        self.finalize = finalize  # resultado de la agregación -> cuerpo de respuesta (se calcula una vez por cambio)
+        self.compute = compute  # motor de agregación para los recálculos completos
+        self.views: Dict[str, _View] = {}
+        self.fields: Tuple[str, ...] = ()
+        self.rows: Optional[Dict] = None  # {_id: tupla de valores de self.fields}
+        self.diffable = False  # todas las filas tienen _id único
+        self.built_at = None
+        self.metrics = {'hits': 0, 'misses': 0, 'refreshes': 0, 'incremental_refreshes': 0,
+                        'full_rebuilds': 0, 'refresh_failures': 0, 'rows_changed_last': 0}
+        self._lock = threading.Lock()
+        self.sketch_views: Dict[str, Tuple[Dict, float]] = {}  # {clave: (cuerpo, fecha de los datos)}
+        self._sketch_lock = threading.Lock()
+
+    def get(self, token: str, spec: AggregationSpec) -> Tuple[Dict, float]:
+        """
+        Cuerpo de respuesta de la agregación y fecha de los datos; la materializa
+        si no existe y lanza un refresco en segundo plano si caducó
+        """
+        key = spec.cache_key
+        if spec.approximate:
+            return self._get_sketch(token, key, spec)
+        view = self.views.get(key)
+        if view is not None and view.body is not None:
+            view.hits += 1
+            self.metrics['hits'] += 1
+            if time.time() - self.built_at > self.ttl and self._lock.acquire(blocking=False):
+                def refresh():
+                    try:
+                        self._refresh(token, self.fields)
+                    except Exception as e:
+                        self.metrics['refresh_failures'] += 1
+                        logger.error(f"❌ Error refrescando agregados: {e}")
+                    finally:
+                        self._lock.release()
+                threading.Thread(target=refresh, daemon=True).start()
+            return view.body, self.built_at
+
+        self.metrics['misses'] += 1
+        with self._lock:
+            view = self.views.get(key)
+            if view is None or view.body is None:
+                view = self._add_view(key, spec)
+                missing = [field for field in spec.fields if field not in self.fields]
+                try:
+                    if self.rows is None or missing or time.time() - self.built_at > self.ttl:
+                        # Campos nuevos o datos caducados: releer la tabla para todas las vistas
+                        self._refresh(token, self.fields + tuple(missing))
+                    else:
+                        self._rebuild(view)
+                except Exception:
+                    self.views.pop(key, None)
+                    self.metrics['refresh_failures'] += 1
+                    raise
+            return view.body, self.built_at
+
+    def _get_sketch(self, token: str, key: str, spec: AggregationSpec) -> Tuple[Dict, float]:
+        """Como get() para agregaciones aproximadas"""
+        entry = self.sketch_views.get(key)
+        if entry is not None:
+            self.metrics['hits'] += 1
+            if time.time() - entry[1] > self.ttl and self._sketch_lock.acquire(blocking=False):
+                def refresh():
+                    try:
+                        self._build_sketch(token, key, spec)
+                    except Exception as e:
+                        self.metrics['refresh_failures'] += 1
+                        logger.error(f"❌ Error refrescando agregado aproximado: {e}")
+                    finally:
+                        self._sketch_lock.release()
+                threading.Thread(target=refresh, daemon=True).start()
+            return entry
+
+        self.metrics['misses'] += 1
+        with self._sketch_lock:
+            return self.sketch_views.get(key) or self._build_sketch(token, key, spec)
+
+    def _build_sketch(self, token: str, key: str, spec: AggregationSpec) -> Tuple[Dict, float]:
+        started = time.time()
+        approximation = ApproximateAggregation(spec)
+        approximation.add_rows(self.loader(token))
+        entry = self.sketch_views[key] = (self.finalize(approximation.result()), started)
+        while len(self.sketch_views) > self.max_views:
+            del self.sketch_views[next(iter(self.sketch_views))]
+        logger.info(f"🧮 Agregado aproximado: {approximation.total_rows} filas, "
+                    f"{approximation.memory_bytes() // 1024} KB de sketches en {round((time.time() - started) * 1000, 1)}ms")
+        return entry
+
+    def _add_view(self, key: str, spec: AggregationSpec) -> _View:
+        view = self.views[key] = _View(spec)
+        while len(self.views) > self.max_views:
+            # Se descarta la vista menos consultada (sin contar la nueva)
+            victim = min((k for k in self.views if k != key), key=lambda k: self.views[k].hits)
+            del self.views[victim]
+        return view
+
+    def _refresh(self, token: str, fields: Tuple[str, ...]):
+        """Relee la tabla y actualiza todas las vistas (deltas por fila o recálculo)"""
+        started = time.time()
+        rows, diffable = self._load(token, fields)
+        previous, previous_fields = self.rows, self.fields
+        incremental = previous is not None and self.diffable and diffable and previous_fields == fields
+
+        changes = self._diff(previous, rows) if incremental else None
+        if changes is not None and len(changes) > REBUILD_FRACTION * max(1, len(rows)):
+            changes = None
+
+        self.rows, self.fields, self.diffable = rows, fields, diffable
+        for view in list(self.views.values()):
+            if changes is not None and view.partial is not None and view.body is not None:
+                self._apply(view, changes)
+            else:
+                self._rebuild(view)
+
+        self.built_at = started
+        self.metrics['refreshes'] += 1
+        self.metrics['incremental_refreshes' if changes is not None else 'full_rebuilds'] += 1
+        self.metrics['rows_changed_last'] = len(changes) if changes is not None else len(rows)
+        logger.info(f"🧮 Agregados: {len(rows)} filas, {len(self.views)} vistas, "
+                    f"{'incremental (' + str(len(changes)) + ' cambios)' if changes is not None else 'recálculo'} "
+                    f"en {round((time.time() - started) * 1000, 1)}ms")
+
+    def _load(self, token: str, fields: Tuple[str, ...]) -> Tuple[Dict, bool]:
+        """Filas compactas {_id: tupla}; si falta algún _id se indexan por posición (sin deltas)"""
+        rows = {}
+        diffable = True
+        canonical = {}  # textos repetidos (ciudades...) compartidos entre filas
+        for position, row in enumerate(self.loader(token)):
+            values = []
+            for field in fields:
+                value = row.get(field)
+                if isinstance(value, str):
+                    value = canonical.setdefault(value, intern(value) if len(value) < 64 else value)
+                values.append(value)
+            row_id = row.get('_id')
+            if row_id is None or not isinstance(row_id, (str, int)) or row_id in rows:
+                diffable = False
+                row_id = ('#', position)
+            rows[row_id] = tuple(values)
+        return rows, diffable
+
+    @staticmethod
+    def _diff(previous: Dict, rows: Dict) -> List[Tuple[Optional[tuple], Optional[tuple]]]:
+        """Cambios por fila: (antes, después); None en altas y bajas"""
+        changes = []
+        for row_id, values in rows.items():
+            old = previous.get(row_id)
+            if old != values:
+                changes.append((old, values))
+        for row_id in previous.keys() - rows.keys():
+            changes.append((previous[row_id], None))
+        return changes
+
+    def _apply(self, view: _View, changes: List[Tuple[Optional[tuple], Optional[tuple]]]):
+        """Combina el delta de las filas cambiadas en el estado parcial de la vista"""
+        if not changes:
+            return
+        delta = PartialAggregate(view.spec)
+        fields = self.fields
+        for old, new in changes:
+            if old is not None:
+                delta.add_row(dict(zip(fields, old)), -1)
+            if new is not None:
+                delta.add_row(dict(zip(fields, new)), 1)
+        view.partial.merge(delta)
+        view.body = self.finalize(view.partial.result())
+
+    def _rebuild(self, view: _View):
+        """Recalcula la vista sobre las filas guardadas con el motor vectorizado"""
+        fields = self.fields
+        columns = Columns(self.rows.values(), view.spec, fields)
+        view.partial = PartialAggregate.from_columns(columns, view.spec)
+        view.body = self.finalize(self.compute(columns, view.spec))
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.metrics, ttl=self.ttl, views=len(self.views), sketch_views=len(self.sketch_views),
+                     fields=list(self.fields))
+        if self.built_at:
+            stats.update({
+                'rows': len(self.rows),
+                'age_seconds': round(time.time() - self.built_at, 1),
+                'incremental': self.diffable
+            })
+        return stats
+
+class AggregateCache:
+    """
+    Agregaciones materializadas por usuario (ROBLE puede devolver filas distintas
+    a cada uno); se guardan las de los `max_users` usuarios más recientes
+    """
+
+    def __init__(self, loader: Callable[[str], Iterable[Dict]], ttl=60, max_views=32, max_users=8,
+                 finalize: Callable[[Dict], Dict] = lambda result: result,
+                 compute: Callable[[Columns, AggregationSpec], Dict] = aggregate):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._settings = dict(loader=loader, ttl=ttl, max_views=max_views, finalize=finalize, compute=compute)
+        self.users: "OrderedDict[str, UserAggregates]" = OrderedDict()
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, user: str, token: str, spec: AggregationSpec) -> Tuple[Dict, float]:
+        """Cuerpo de respuesta y fecha de los datos de la agregación `spec` del usuario `user`"""
+        with self._lock:
+            aggregates = self.users.get(user)
+            if aggregates is None:
+                aggregates = self.users[user] = UserAggregates(**self._settings)
+                while len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+                    self.evictions += 1
+            self.users.move_to_end(user)
+        return aggregates.get(token, spec)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            users = list(self.users.values())
+        stats = {'ttl': self.ttl, 'users': len(users), 'max_users': self.max_users, 'user_evictions': self.evictions,
+                 'views': sum(len(u.views) for u in users), 'sketch_views': sum(len(u.sketch_views) for u in users),
+                 'rows': sum(len(u.rows) for u in users if u.rows is not None)}
+        for name in ('hits', 'misses', 'refreshes', 'incremental_refreshes', 'full_rebuilds', 'refresh_failures'):
+            stats[name] = sum(u.metrics[name] for u in users)
+        return stats
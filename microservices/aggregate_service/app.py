@@ -5,96 +5,145 @@ Agrega y procesa estadísticas de usuarios
 import os
 import logging
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 from datetime import datetime
 import json
+from roble_auth import require_auth, cache_stats, identity_key
+from http_encoding import setup_http_encoding, encoding_stats, dumps_bytes
+from roble_data import iter_table
+from groupby import AggregationSpec, AggregationError, Columns
+from aggregate_cache import AggregateCache
+from parallel import ParallelAggregator
+from approximate import ApproximateAggregation
+from pipeline import Pipeline, PipelineError
+from predicates import PredicateError
 
 # Configuración
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:8080', 'http://127.0.0.1:8080'])
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+setup_http_encoding(app)
 
 # Variables de entorno
 ROBLE_BASE_HOST = os.getenv('ROBLE_BASE_HOST', 'https://roble-api.openlab.uninorte.edu.co')
 ROBLE_CONTRACT = os.getenv('ROBLE_CONTRACT', 'microservices_roble_e65ac352d7')
 SERVICE_NAME = os.getenv('SERVICE_NAME', 'aggregate-service')
+# Segundos que se reutilizan los agregados materializados (0 = calcular siempre desde ROBLE)
+AGGREGATE_CACHE_TTL = int(os.getenv('AGGREGATE_CACHE_TTL', '60'))
+AGGREGATE_CACHE_VIEWS = int(os.getenv('AGGREGATE_CACHE_VIEWS', '32'))
+# Usuarios distintos con agregados propios en memoria (se descarta el menos reciente)
+AGGREGATE_CACHE_USERS = int(os.getenv('AGGREGATE_CACHE_USERS', '8'))
+# Procesos para agregaciones grandes (0 = núcleos del contenedor) y filas a partir de las que se reparten
+AGGREGATE_WORKERS = int(os.getenv('AGGREGATE_WORKERS', '0'))
+AGGREGATE_PARALLEL_MIN_ROWS = int(os.getenv('AGGREGATE_PARALLEL_MIN_ROWS', '200000'))
+# Bytes de NDJSON que se acumulan antes de enviar un bloque de la respuesta de /pipeline
+PIPELINE_FLUSH_BYTES = int(os.getenv('PIPELINE_FLUSH_BYTES', '65536'))
 
 # --- FUNCIONES ROBLE ---
-def roble_verify_token(token):
-    """Verificar token en ROBLE"""
+def roble_iter_users(token):
+    """Usuarios de ROBLE a medida que llegan"""
     try:
-        url = f"{ROBLE_BASE_HOST}/auth/{ROBLE_CONTRACT}/verify-token"
-        response = requests.get(url, headers={"Authorization": f"Bearer {token}"})
-        return response.status_code == 200
-    except:
-        return False
-
-def roble_check_permissions(token):
-    """Verificar permisos específicos del usuario"""
-    try:
-        url = f"{ROBLE_BASE_HOST}/auth/{ROBLE_CONTRACT}/verify-token"
-        response = requests.get(url, headers={"Authorization": f"Bearer {token}"})
-        
-        if response.status_code == 200:
-            user_data = response.json()
-            user_role = user_data.get('role', 'user')
-            # Permitir acceso básico a todos los roles autenticados
-            return True
-        return False
-    except:
-        return False
-
-def roble_get_users(token):
-    """Obtener usuarios de ROBLE"""
-    try:
-        url = f"{ROBLE_BASE_HOST}/database/{ROBLE_CONTRACT}/read"
-        params = {"tableName": "usuarios"}
-        
-        response = requests.get(url, 
-            headers={"Authorization": f"Bearer {token}"}, 
-            params=params
-        )
-        response.raise_for_status()
-        return response.json()
+        yield from iter_table(token, "usuarios")
     except Exception as e:
         logger.error(f"Error obteniendo usuarios: {e}")
-        return []
 
 # --- PROCESAMIENTO ---
-def process_aggregate_data(token, aggregate_data):
-    """Procesa agregación de datos"""
-    users = roble_get_users(token)
-    
-    group_by = aggregate_data.get('group_by', 'city')
-    
-    # Agrupar por campo
+def summarize_aggregation(result):
+    """Cuerpo de respuesta a partir del resultado del motor de agregación"""
+    # Conteo por grupo (claves de varios campos unidas con '|')
     groups = {}
-    for user in users:
-        key = user.get(group_by, 'unknown')
-        if key not in groups:
-            groups[key] = 0
-        groups[key] += 1
+    for group in result['groups']:
+        key = group['key']
+        if isinstance(key, dict):
+            key = '|'.join(str(v) for v in key.values())
+        groups[key] = group['count']
     
     # Calcular estadísticas adicionales
+    total_users = result['total_rows']
     stats = {
-        "total_users": len(users),
+        "total_users": total_users,
         "groups_count": len(groups),
-        "average_per_group": len(users) / len(groups) if groups else 0,
+        "average_per_group": total_users / result['groups_before_having'] if result['groups_before_having'] else 0,
         "largest_group": max(groups.values()) if groups else 0,
         "smallest_group": min(groups.values()) if groups else 0
     }
+    body = {"statistics": stats, "groups": groups, "aggregations": result['groups']}
+    if 'approximation' in result:
+        body["approximation"] = result['approximation']
+    return body
+
+parallel_aggregator = ParallelAggregator(workers=AGGREGATE_WORKERS or None, min_rows=AGGREGATE_PARALLEL_MIN_ROWS)
+
+# Agregados materializados por usuario y especificación; se cargan con la lectura de ROBLE
+# sin capturar errores (una lectura fallida no debe interpretarse como tabla vacía)
+aggregate_cache = AggregateCache(lambda token: iter_table(token, "usuarios"), ttl=AGGREGATE_CACHE_TTL,
+                                 max_views=AGGREGATE_CACHE_VIEWS, max_users=AGGREGATE_CACHE_USERS,
+                                 finalize=summarize_aggregation,
+                                 compute=parallel_aggregator.aggregate) \
+    if AGGREGATE_CACHE_TTL > 0 else None
+
+def process_aggregate_data(token, aggregate_data):
+    """
+    Procesa agregación de datos
+    
+    Agrupa por uno o varios campos (group_by), con buckets numéricos,
+    métricas por grupo (metrics) y filtro sobre los grupos (having).
+    Las especificaciones ya consultadas se responden desde memoria.
+    Con approximate: true se usan sketches (top de grupos, distintos y
+    cuantiles aproximados con sus cotas de error) con memoria acotada
+    """
+    spec = AggregationSpec(aggregate_data)
+    if aggregate_cache:
+        body, built_at = aggregate_cache.get(identity_key(g.roble_user, token), token, spec)
+        source = {"source": "cache", "data_as_of": datetime.fromtimestamp(built_at).isoformat()}
+    elif spec.approximate:
+        approximation = ApproximateAggregation(spec)
+        approximation.add_rows(roble_iter_users(token))
+        body = summarize_aggregation(approximation.result())
+        source = {"source": "roble", "data_as_of": datetime.now().isoformat()}
+    else:
+        # Solo se guardan las columnas que usa la agregación
+        columns = Columns(roble_iter_users(token), spec)
+        body = summarize_aggregation(parallel_aggregator.aggregate(columns, spec))
+        source = {"source": "roble", "data_as_of": datetime.now().isoformat()}
     
     return {
         "success": True,
         "service": SERVICE_NAME,
-        "group_by": group_by,
-        "statistics": stats,
-        "groups": groups,
+        "group_by": aggregate_data.get('group_by', 'city'),
+        **body,
+        **source,
         "processed_at": datetime.now().isoformat()
     }
 
+def stream_pipeline(pipeline, first, rows):
+    """
+    Respuesta NDJSON del pipeline: una fila por línea y al final {"_summary": ...}
+    Si falla a mitad de la respuesta (ya enviada la cabecera 200) termina con {"_error": ...}
+    """
+    buffer = []
+    size = 0
+    try:
+        row = first
+        while row is not None:
+            line = dumps_bytes(row) + b'\n'
+            buffer.append(line)
+            size += len(line)
+            if size >= PIPELINE_FLUSH_BYTES:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+            row = next(rows, None)
+        summary = dict(pipeline.summary(), service=SERVICE_NAME, processed_at=datetime.now().isoformat())
+        buffer.append(dumps_bytes({"_summary": summary}) + b'\n')
+    except Exception as e:
+        logger.error(f"Error ejecutando pipeline: {e}")
+        buffer.append(dumps_bytes({"_error": "Error interno del servidor", "service": SERVICE_NAME}) + b'\n')
+    finally:
+        rows.close()
+    yield b''.join(buffer)
+
 # --- API ENDPOINTS ---
 @app.route('/')
 def home():
@@ -103,34 +152,26 @@ def home():
         "service": SERVICE_NAME,
         "type": "aggregate",
         "description": "Microservicio de agregación de datos ROBLE",
-        "version": "1.0",
+        "version": "1.1",
         "endpoints": {
             "aggregate": "/aggregate",
+            "pipeline": "/pipeline",
             "health": "/health"
         }
     })
 
 @app.route('/aggregate', methods=['POST'])
+@require_auth()
 def aggregate_data():
     """Endpoint principal de agregación"""
-    # Verificar token
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({"error": "Token de autorización requerido"}), 401
-    
-    token = auth_header.split(' ')[1]
-    if not roble_verify_token(token):
-        return jsonify({"error": "Token inválido o expirado"}), 401
-    
-    if not roble_check_permissions(token):
-        return jsonify({"error": "Permisos insuficientes"}), 403
-    
     # Obtener datos de agregación
     data = request.get_json() or {}
     
     try:
-        result = process_aggregate_data(token, data)
+        result = process_aggregate_data(g.roble_token, data)
         return jsonify(result), 200
+    except AggregationError as e:
+        return jsonify({"error": str(e), "service": SERVICE_NAME}), 400
     except Exception as e:
         logger.error(f"Error procesando agregación: {e}")
         return jsonify({
@@ -138,15 +179,47 @@ def aggregate_data():
             "service": SERVICE_NAME
         }), 500
 
+@app.route('/pipeline', methods=['POST'])
+@require_auth()
+def run_pipeline():
+    """
+    Pipeline de etapas (filter, project, group, sort, limit) sobre una sola
+    lectura de usuarios, con una sola verificación del token; responde NDJSON
+    """
+    data = request.get_json() or {}
+    
+    try:
+        pipeline = Pipeline(data.get('stages'), compute=parallel_aggregator.aggregate)
+    except (PipelineError, PredicateError, AggregationError) as e:
+        return jsonify({"error": str(e), "service": SERVICE_NAME}), 400
+    
+    rows = pipeline.run(iter_table(g.roble_token, "usuarios", pipeline.pushdown_filters()))
+    try:
+        # La primera fila se calcula antes de responder: los errores de lectura aún pueden ser un 500
+        first = next(rows, None)
+    except Exception as e:
+        rows.close()
+        logger.error(f"Error ejecutando pipeline: {e}")
+        return jsonify({
+            "error": "Error interno del servidor",
+            "service": SERVICE_NAME
+        }), 500
+    return Response(stream_pipeline(pipeline, first, rows), mimetype='application/x-ndjson')
+
 @app.route('/health')
 def health():
     """Health check"""
     return jsonify({
         "status": "healthy",
         "service": SERVICE_NAME,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "auth_cache": cache_stats(),
+        "http": encoding_stats(),
+        "aggregate_cache": aggregate_cache.get_stats() if aggregate_cache else None,
+        "parallel": parallel_aggregator.get_stats()
     })
 
 if __name__ == '__main__':
     print(f"📊 {SERVICE_NAME} ready")
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    parallel_aggregator.start()
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')), debug=False)
\ No newline at end of file
@@ -0,0 +1,179 @@
+"""
+Agregación aproximada con sketches (approximate: true)
+Las filas se procesan por bloques: los grupos más frecuentes se siguen con
+Misra-Gries (cada uno con sus momentos y un KLL por campo numérico), los
+valores distintos con HyperLogLog y las métricas globales con KLL. La memoria
+no depende de la cardinalidad y los estados se combinan con merge()
+"""
+import math
+import numpy as np
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+from groupby import AggregationSpec, percentile_of, is_number, json_number
+from sketches import HeavyHitters, HyperLogLog, KLLSketch, kll_rank_error
+
+CHUNK_ROWS = 65536
+GROUP_KLL_K = 100  # por grupo seguido
+GLOBAL_KLL_K = 200
+
+class _FieldSketch:
+    """Momentos exactos y cuantiles aproximados de un campo numérico"""
+    __slots__ = ('n', 'sum', 'squares', 'quantiles')
+
+    def __init__(self, k: int):
+        self.n = 0
+        self.sum = 0.0
+        self.squares = 0.0
+        self.quantiles = KLLSketch(k)
+
+    def update(self, values: np.ndarray):
+        self.n += int(values.size)
+        self.sum += float(values.sum())
+        self.squares += float(np.dot(values, values))
+        self.quantiles.update(values)
+
+    def merge(self, other: '_FieldSketch'):
+        self.n += other.n
+        self.sum += other.sum
+        self.squares += other.squares
+        self.quantiles.merge(other.quantiles)
+
+    def metrics(self, ops: List[str]) -> Dict:
+        if self.n == 0:
+            return {op: (0 if op == 'count' else None) for op in ops}
+        mean = self.sum / self.n
+        out = {}
+        for op in ops:
+            if op == 'count':
+                out[op] = self.n
+            elif op == 'sum':
+                out[op] = json_number(self.sum)
+            elif op == 'mean':
+                out[op] = json_number(mean)
+            elif op == 'std':
+                out[op] = json_number(math.sqrt(max(0.0, self.squares / self.n - mean * mean)))
+            elif op == 'min':
+                out[op] = json_number(self.quantiles.min)
+            elif op == 'max':
+                out[op] = json_number(self.quantiles.max)
+            else:
+                out[op] = json_number(self.quantiles.quantile(percentile_of(op)))
+        return out
+
+class ApproximateAggregation:
+    """Estado aproximado y combinable de una agregación"""
+
+    def __init__(self, spec: AggregationSpec, capacity: Optional[int] = None):
+        self.spec = spec
+        self.total_rows = 0
+        # Más contadores que grupos pedidos: los del final del top no se confunden con el resto
+        self.heavy = HeavyHitters(capacity or max(1000, 10 * spec.top))
+        self.group_fields: Dict[tuple, Dict[str, _FieldSketch]] = {}  # solo grupos seguidos
+        self.overall = {field: _FieldSketch(GLOBAL_KLL_K) for field in spec.metrics}
+        self.group_distinct = HyperLogLog()
+        self.distinct = {field: HyperLogLog() for field in spec.distinct}
+
+    def add_rows(self, rows: Iterable[Dict]):
+        """Procesa las filas por bloques de CHUNK_ROWS"""
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= CHUNK_ROWS:
+                self._add_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._add_chunk(chunk)
+
+    def _add_chunk(self, rows: List[Dict]):
+        row_key = self.spec.row_key
+        keys = [row_key(row) for row in rows]
+        self.total_rows += len(rows)
+        counts = Counter(keys)
+        self.group_distinct.add(counts.keys())
+        for field, sketch in self.distinct.items():
+            sketch.add({row.get(field) for row in rows})
+
+        evicted = self.heavy.update(counts)
+        for key in evicted:
+            self.group_fields.pop(key, None)
+
+        for field, overall in self.overall.items():
+            values = [row.get(field) for row in rows]
+            numeric = np.fromiter((v if is_number(v) else math.nan for v in values), dtype=np.float64, count=len(values))
+            valid = ~np.isnan(numeric)
+            overall.update(numeric[valid])
+            # Valores por grupo seguido (los grupos fuera del top solo cuentan en lo global)
+            by_group = {}
+            for key, value, ok in zip(keys, numeric.tolist(), valid.tolist()):
+                if ok and key in self.heavy.counts:
+                    by_group.setdefault(key, []).append(value)
+            for key, group_values in by_group.items():
+                sketches = self.group_fields.setdefault(key, {})
+                sketch = sketches.get(field)
+                if sketch is None:
+                    sketch = sketches[field] = _FieldSketch(GROUP_KLL_K)
+                sketch.update(np.array(group_values))
+
+    def merge(self, other: 'ApproximateAggregation'):
+        """Combina el estado de otro bloque, proceso o refresco"""
+        self.total_rows += other.total_rows
+        self.group_distinct.merge(other.group_distinct)
+        for field, sketch in other.distinct.items():
+            self.distinct[field].merge(sketch)
+        for field, sketch in other.overall.items():
+            self.overall[field].merge(sketch)
+        for key, sketches in other.group_fields.items():
+            target = self.group_fields.setdefault(key, {})
+            for field, sketch in sketches.items():
+                if field in target:
+                    target[field].merge(sketch)
+                else:
+                    target[field] = sketch
+        for key in self.heavy.merge(other.heavy):
+            self.group_fields.pop(key, None)
+
+    def result(self) -> Dict:
+        """Grupos más frecuentes con cotas de error y estimaciones globales"""
+        spec = self.spec
+        groups = []
+        for key, count in self.heavy.top(len(self.heavy.counts)):
+            sketches = self.group_fields.get(key, {})
+            metrics = {field: (sketches[field] if field in sketches else _FieldSketch(GROUP_KLL_K)).metrics(ops)
+                       for field, ops in spec.metrics.items()}
+            if not spec.passes_having(count, metrics):
+                continue
+            groups.append({
+                'key': key[0] if len(key) == 1 else dict(zip(spec.group_by, key)),
+                'count': count,
+                'count_max': count + self.heavy.error,
+                'metrics': metrics
+            })
+            if len(groups) >= spec.top:
+                break
+
+        # La estimación de HyperLogLog puede superar el número de filas
+        groups_distinct = min(self.group_distinct.estimate(), self.total_rows)
+        return {
+            'groups': groups,
+            'total_rows': self.total_rows,
+            'groups_before_having': groups_distinct,
+            'approximation': {
+                'groups_distinct': groups_distinct,
+                'distinct_relative_error': round(self.group_distinct.relative_error, 4),
+                # Si nunca se descartó un grupo, conteos y métricas por grupo son de todas sus filas
+                'exact_groups': not self.heavy.pruned,
+                'count_error': self.heavy.error,
+                'quantile_rank_error': round(kll_rank_error(GROUP_KLL_K), 4),
+                'overall_quantile_rank_error': round(kll_rank_error(GLOBAL_KLL_K), 4),
+                'distinct': {field: sketch.estimate() for field, sketch in self.distinct.items()},
+                'overall': {field: sketch.metrics(spec.metrics[field]) for field, sketch in self.overall.items()},
+                'memory_bytes': self.memory_bytes()
+            }
+        }
+
+    def memory_bytes(self) -> int:
+        """Tamaño aproximado de los sketches (acotado por la capacidad, no por las filas)"""
+        total = self.group_distinct.registers.nbytes + sum(s.registers.nbytes for s in self.distinct.values())
+        total += sum(s.quantiles.memory_bytes() for s in self.overall.values())
+        total += sum(s.quantiles.memory_bytes() for sketches in self.group_fields.values() for s in sketches.values())
+        return total + 64 * len(self.heavy.counts)
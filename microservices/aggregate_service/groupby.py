@@ -0,0 +1,514 @@
+"""
+Motor de agregación del aggregate-service (NumPy)
+Agrupa por uno o varios campos (con buckets numéricos opcionales) y calcula
+count/sum/mean/min/max/std/percentiles de campos numéricos en pasadas
+vectorizadas: bincount para sumas y un único lexsort para min/max/percentiles
+
+    {
+      "group_by": ["city", "age"],
+      "buckets": {"age": {"width": 10}},            # o {"age": [0, 18, 30, 60]}
+      "metrics": {"age": ["mean", "std", "p90"]},
+      "having": {"count": {"gte": 5}, "age.mean": {"lt": 40}}
+    }
+"""
+import json
+import math
+import numpy as np
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence
+
+OPERATIONS = ('count', 'sum', 'mean', 'min', 'max', 'std', 'median')
+HAVING_OPS = {'eq': np.equal, 'ne': np.not_equal, 'lt': np.less, 'lte': np.less_equal,
+              'gt': np.greater, 'gte': np.greater_equal}
+MAX_GROUP_FIELDS = 4
+DEFAULT_TOP = 20
+MAX_TOP = 1000
+MISSING_KEY = 'unknown'
+MAX_CODE = np.iinfo(np.int64).max  # códigos de grupo combinados en int64
+MAX_DENSE_CODES = 1 << 22  # hasta aquí los códigos de grupo se compactan con bincount (sin ordenar)
+MAX_HISTOGRAM_VALUES = 200000  # pares (grupo, valor) distintos que admite un estado parcial con min/max/percentiles
+
+class AggregationError(ValueError):
+    """Especificación de agregación no válida (se responde 400)"""
+
+def percentile_of(op: str) -> Optional[float]:
+    """'p90' -> 0.90, 'median' -> 0.5"""
+    if op == 'median':
+        return 0.5
+    if op.startswith('p') and op[1:].replace('.', '', 1).isdigit():
+        q = float(op[1:])
+        if 0 <= q <= 100:
+            return q / 100
+    return None
+
+def needs_order(ops: List[str]) -> bool:
+    """min/max/percentiles necesitan los valores ordenados por grupo"""
+    return any(op in ('min', 'max') or percentile_of(op) is not None for op in ops)
+
+class AggregationSpec:
+    """Petición de agregación validada"""
+
+    def __init__(self, data: Dict):
+        group_by = data.get('group_by', 'city')
+        self.group_by = [group_by] if isinstance(group_by, str) else group_by
+        if not isinstance(self.group_by, list) or not self.group_by or \
+                not all(isinstance(f, str) and f for f in self.group_by):
+            raise AggregationError("group_by debe ser un campo o una lista de campos")
+        if len(self.group_by) > MAX_GROUP_FIELDS:
+            raise AggregationError(f"group_by admite como mucho {MAX_GROUP_FIELDS} campos")
+
+        self.buckets = {}
+        for field, bucket in (data.get('buckets') or {}).items():
+            if isinstance(bucket, dict) and isinstance(bucket.get('width'), (int, float)) and bucket['width'] > 0:
+                self.buckets[field] = {'width': float(bucket['width'])}
+            elif isinstance(bucket, list) and len(bucket) >= 2 and \
+                    all(isinstance(e, (int, float)) for e in bucket) and bucket == sorted(bucket):
+                self.buckets[field] = {'edges': [float(e) for e in bucket]}
+            else:
+                raise AggregationError(f"Bucket de '{field}' no válido: use {{\"width\": n}} o una lista ordenada de límites")
+
+        self.metrics = {}
+        for field, ops in (data.get('metrics') or {}).items():
+            if isinstance(ops, str):
+                ops = [ops]
+            if not isinstance(ops, list) or not ops:
+                raise AggregationError(f"Las métricas de '{field}' deben ser una lista")
+            for op in ops:
+                if op not in OPERATIONS and percentile_of(op) is None:
+                    raise AggregationError(f"Métrica no soportada: {op}. Use: {', '.join(OPERATIONS)} o pNN")
+            self.metrics[field] = list(dict.fromkeys(ops))
+
+        self.having = []
+        for target, conditions in (data.get('having') or {}).items():
+            field, _, op = target.partition('.')
+            if target != 'count' and (field not in self.metrics or op not in self.metrics[field]):
+                raise AggregationError(f"having '{target}': use 'count' o una métrica pedida (campo.métrica)")
+            if not isinstance(conditions, dict):
+                raise AggregationError(f"having '{target}' debe ser un objeto {{op: valor}}")
+            for cmp, value in conditions.items():
+                if cmp not in HAVING_OPS or not isinstance(value, (int, float)):
+                    raise AggregationError(f"having '{target}': comparación no válida {cmp}")
+                self.having.append((target, cmp, float(value)))
+
+        # Modo aproximado (sketches): grupos más frecuentes y valores distintos estimados
+        self.approximate = data.get('approximate', False)
+        if not isinstance(self.approximate, bool):
+            raise AggregationError("approximate debe ser true o false")
+        self.top = data.get('top', DEFAULT_TOP)
+        if isinstance(self.top, bool) or not isinstance(self.top, int) or not 1 <= self.top <= MAX_TOP:
+            raise AggregationError(f"top debe ser un entero entre 1 y {MAX_TOP}")
+        self.distinct = data.get('distinct', [])
+        if not isinstance(self.distinct, list) or not all(isinstance(f, str) and f for f in self.distinct):
+            raise AggregationError("distinct debe ser una lista de campos")
+        if not self.approximate and ('top' in data or self.distinct):
+            raise AggregationError("top y distinct requieren approximate: true")
+
+    @property
+    def cache_key(self) -> str:
+        return json.dumps([self.group_by, self.buckets, self.metrics, self.having,
+                           self.approximate, self.top, self.distinct], sort_keys=True)
+
+    @property
+    def fields(self) -> List[str]:
+        """Campos de la fila que usa la agregación"""
+        return list(dict.fromkeys(self.group_by + list(self.metrics) + self.distinct))
+
+    def passes_having(self, count: int, metrics: Dict) -> bool:
+        """having sobre las métricas ya formateadas de un grupo"""
+        for target, cmp, value in self.having:
+            if target == 'count':
+                actual = count
+            else:
+                field, _, op = target.partition('.')
+                actual = metrics[field][op]
+            if not HAVING_OPS[cmp](math.nan if actual is None else actual, value):
+                return False
+        return True
+
+    def row_key(self, row: Dict) -> tuple:
+        """Clave de grupo de una fila (mismas etiquetas que group_codes)"""
+        parts = []
+        for field in self.group_by:
+            value = row.get(field)
+            if field in self.buckets:
+                parts.append(_bucket_label(value, self.buckets[field]))
+            elif value is None:
+                parts.append(MISSING_KEY)
+            else:
+                parts.append(value if isinstance(value, (str, int, float, bool)) else str(value))
+        return tuple(parts)
+
+class Columns:
+    """
+    Columnas codificadas en una sola pasada por las filas (solo los campos necesarios):
+    códigos enteros para agrupar y float64 (NaN si no es número) para métricas y buckets
+    """
+
+    def __init__(self, rows: Iterable, spec: AggregationSpec, fields: Optional[Sequence[str]] = None):
+        """`rows` son diccionarios, o tuplas con los valores de `fields` en ese orden"""
+        code_fields = [f for f in spec.group_by if f not in spec.buckets]
+        number_fields = list(dict.fromkeys([f for f in spec.group_by if f in spec.buckets] + list(spec.metrics)))
+        if fields is None:
+            get, position = dict.get, {field: field for field in code_fields + number_fields}
+        else:
+            get, position = tuple.__getitem__, {field: fields.index(field) for field in code_fields + number_fields}
+        codes = [(position[field], array('q'), {}) for field in code_fields]
+        numbers = [(position[field], array('d')) for field in number_fields]
+        nan = math.nan
+        count = 0
+        for row in rows:
+            count += 1
+            for key, column, lookup in codes:
+                value = get(row, key)
+                if value is not None and not isinstance(value, (str, int, float, bool)):
+                    value = str(value)
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(lookup)
+                column.append(code)
+            for key, column in numbers:
+                value = get(row, key)
+                column.append(value if value.__class__ in (int, float) else nan)
+        self.size = count
+        self.codes = {field: np.frombuffer(column, dtype=np.int64) for field, (_, column, _) in zip(code_fields, codes)}
+        self.labels = {field: [MISSING_KEY if v is None else v for v in lookup]
+                       for field, (_, _, lookup) in zip(code_fields, codes)}
+        self.numbers = {field: np.frombuffer(column, dtype=np.float64) for field, (_, column) in zip(number_fields, numbers)}
+
+def _bucketize(x: np.ndarray, bucket: Dict) -> (np.ndarray, List):
+    """Códigos por rango numérico y sus etiquetas ('18-30'); sin número -> 'unknown'"""
+    valid = ~np.isnan(x)
+    if 'width' in bucket:
+        width = bucket['width']
+        starts = np.floor(x[valid] / width)
+        if starts.size and starts.max() - starts.min() <= MAX_DENSE_CODES:
+            distinct = np.arange(starts.min(), starts.max() + 1)
+            inverse = (starts - starts.min()).astype(np.int64)
+        else:
+            distinct, inverse = np.unique(starts, return_inverse=True)
+        codes = np.full(len(x), len(distinct), dtype=np.int64)
+        codes[valid] = inverse
+        labels = [_width_label(start, width) for start in distinct.tolist()]
+    else:
+        edges = bucket['edges']
+        codes = np.full(len(x), len(edges) + 1, dtype=np.int64)
+        codes[valid] = np.digitize(x[valid], edges)  # 0: < primer límite, len(edges): >= último
+        labels = _edge_labels(edges)
+    return codes, labels + [MISSING_KEY]
+
+def _width_label(start: float, width: float) -> str:
+    return f"{_fmt(start * width)}-{_fmt((start + 1) * width)}"
+
+def _edge_labels(edges: List[float]) -> List[str]:
+    return [f"<{_fmt(edges[0])}"] + \
+           [f"{_fmt(edges[i])}-{_fmt(edges[i + 1])}" for i in range(len(edges) - 1)] + \
+           [f">={_fmt(edges[-1])}"]
+
+def is_number(value) -> bool:
+    return value.__class__ in (int, float) and not math.isnan(value)
+
+def _bucket_label(value, bucket: Dict) -> str:
+    """Etiqueta del bucket de un valor suelto (igual que _bucketize)"""
+    if not is_number(value):
+        return MISSING_KEY
+    if 'width' in bucket:
+        return _width_label(math.floor(value / bucket['width']), bucket['width'])
+    return _edge_labels(bucket['edges'])[bisect_right(bucket['edges'], value)]
+
+def _fmt(number: float):
+    return int(number) if float(number).is_integer() else round(number, 6)
+
+def _compact(combined: np.ndarray, space: int) -> (np.ndarray, np.ndarray):
+    """Renumera códigos a 0..grupos-1: (códigos distintos, grupo por fila)"""
+    if space <= MAX_DENSE_CODES:
+        # Espacio pequeño: tabla directa en O(n) en lugar de ordenar
+        present = np.bincount(combined, minlength=space) > 0
+        remap = np.cumsum(present) - 1
+        return np.flatnonzero(present), remap[combined]
+    distinct, inverse = np.unique(combined, return_inverse=True)
+    return distinct, inverse.reshape(-1)
+
+def _decode(code: int, prefixes: Optional[List[tuple]], labels: List[list]) -> tuple:
+    """Tupla de valores de un código combinado (dígitos de `labels` sobre el prefijo renumerado)"""
+    parts = []
+    for field_labels in reversed(labels):
+        code, part = divmod(code, max(1, len(field_labels)))
+        parts.append(field_labels[part])
+    return (prefixes[code] if prefixes is not None else ()) + tuple(reversed(parts))
+
+def group_codes(columns: Columns, spec: AggregationSpec):
+    """
+    Código de grupo compacto por fila
+
+    Returns:
+        (inverse, keys) — inverse[i] es el grupo de la fila i y keys[g] la tupla de valores del grupo
+    """
+    combined = np.zeros(columns.size, dtype=np.int64)
+    space = 1
+    prefixes = None  # tras renumerar: claves (tuplas) de los códigos anteriores a `labels`
+    labels = []
+    for field in spec.group_by:
+        if field in spec.buckets:
+            codes, field_labels = _bucketize(columns.numbers[field], spec.buckets[field])
+        else:
+            codes, field_labels = columns.codes[field], columns.labels[field]
+        cardinality = max(1, len(field_labels))
+        if space > MAX_CODE // cardinality:
+            # El código combinado no cabría en int64: se renumeran los grupos ya vistos (como mucho uno por fila)
+            distinct, combined = _compact(combined, space)
+            prefixes = [_decode(code, prefixes, labels) for code in distinct.tolist()]
+            labels = []
+            space = len(prefixes)
+        combined = combined * cardinality + codes
+        space *= cardinality
+        labels.append(field_labels)
+
+    distinct, inverse = _compact(combined, space)
+    keys = [_decode(code, prefixes, labels) for code in distinct.tolist()]
+    return inverse, keys
+
+def group_value_order(g: np.ndarray, v: np.ndarray, group_count: int) -> np.ndarray:
+    """
+    Orden por (grupo, valor): primero por valor y luego por grupo con un ordenamiento
+    estable (radix con códigos pequeños); cada grupo queda en un tramo contiguo
+    """
+    order = np.argsort(v)
+    group_dtype = np.int16 if group_count < 2 ** 15 else np.int64
+    return order[np.argsort(g[order].astype(group_dtype), kind='stable')]
+
+def numeric_metrics(x: np.ndarray, inverse: np.ndarray, group_count: int, ops: List[str]) -> Dict[str, np.ndarray]:
+    """Métricas de un campo numérico por grupo (NaN donde el grupo no tiene valores)"""
+    valid = ~np.isnan(x)
+    g = inverse[valid]
+    v = x[valid]
+    counts = np.bincount(g, minlength=group_count).astype(np.float64)
+    result = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sums = np.bincount(g, weights=v, minlength=group_count)
+        means = sums / counts
+        if 'count' in ops:
+            result['count'] = counts
+        if 'sum' in ops:
+            result['sum'] = np.where(counts > 0, sums, np.nan)
+        if 'mean' in ops:
+            result['mean'] = means
+        if 'std' in ops:
+            deviations = v - means[g]
+            result['std'] = np.sqrt(np.bincount(g, weights=deviations * deviations, minlength=group_count) / counts)
+
+        order_ops = [op for op in ops if op in ('min', 'max') or percentile_of(op) is not None]
+        if order_ops:
+            sorted_v = v[group_value_order(g, v, group_count)]
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+            present = counts > 0
+            for op in order_ops:
+                out = np.full(group_count, np.nan)
+                if op == 'min':
+                    out[present] = sorted_v[starts[present]]
+                elif op == 'max':
+                    out[present] = sorted_v[(starts + counts - 1).astype(np.int64)[present]]
+                else:
+                    # Interpolación lineal como numpy.percentile
+                    position = starts[present] + percentile_of(op) * (counts[present] - 1)
+                    low = np.floor(position).astype(np.int64)
+                    high = np.ceil(position).astype(np.int64)
+                    out[present] = sorted_v[low] + (sorted_v[high] - sorted_v[low]) * (position - low)
+                result[op] = out
+    return result
+
+def aggregate(columns: Columns, spec: AggregationSpec) -> Dict:
+    """Agrupa y calcula las métricas pedidas; aplica having y ordena por tamaño de grupo"""
+    if columns.size == 0:
+        return {'groups': [], 'total_rows': 0, 'groups_before_having': 0}
+
+    inverse, keys = group_codes(columns, spec)
+    group_count = len(keys)
+    counts = np.bincount(inverse, minlength=group_count)
+    metrics = {field: numeric_metrics(columns.numbers[field], inverse, group_count, ops)
+               for field, ops in spec.metrics.items()}
+
+    return finish_aggregation(spec, keys, counts, metrics, columns.size)
+
+def finish_aggregation(spec: AggregationSpec, keys: List[tuple], counts: np.ndarray,
+                       metrics: Dict[str, Dict[str, np.ndarray]], total_rows: int) -> Dict:
+    """Aplica having, ordena por tamaño de grupo y da formato JSON a las métricas por grupo"""
+    group_count = len(keys)
+    mask = np.ones(group_count, dtype=bool)
+    for target, cmp, value in spec.having:
+        if target == 'count':
+            values = counts
+        else:
+            field, _, op = target.partition('.')
+            values = metrics[field][op]
+        with np.errstate(invalid='ignore'):
+            mask &= HAVING_OPS[cmp](values, value)
+
+    groups = []
+    for index in np.flatnonzero(mask)[np.argsort(-counts[mask], kind='stable')].tolist():
+        key = keys[index]
+        groups.append({
+            'key': key[0] if len(key) == 1 else dict(zip(spec.group_by, key)),
+            'count': int(counts[index]),
+            'metrics': {
+                field: {op: json_number(values[index]) for op, values in field_metrics.items()}
+                for field, field_metrics in metrics.items()
+            }
+        })
+    return {'groups': groups, 'total_rows': total_rows, 'groups_before_having': group_count}
+
+def json_number(value):
+    value = float(value)
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() and abs(value) < 2 ** 53 else round(value, 6)
+
+class PartialAggregate:
+    """
+    Estado parcial combinable de una agregación: filas por grupo y, por campo
+    numérico, n, suma, suma de cuadrados e histograma de valores (solo si se
+    piden min/max/percentiles). Acepta filas con signo (altas y bajas) y se
+    combina con otros estados con merge()
+    """
+
+    def __init__(self, spec: AggregationSpec):
+        self.spec = spec
+        self.total_rows = 0
+        self.counts = {}  # {clave: filas}
+        self.states = {field: {} for field in spec.metrics}  # {campo: {clave: [n, suma, suma², histograma]}}
+        self.ordered = {field: needs_order(ops) for field, ops in spec.metrics.items()}
+
+    @classmethod
+    def from_columns(cls, columns: Columns, spec: AggregationSpec) -> Optional['PartialAggregate']:
+        """Estado parcial de una tabla completa (vectorizado); None si los histogramas serían demasiado grandes"""
+        partial = cls(spec)
+        partial.total_rows = columns.size
+        if columns.size == 0:
+            return partial
+        inverse, keys = group_codes(columns, spec)
+        group_count = len(keys)
+        for key, count in zip(keys, np.bincount(inverse, minlength=group_count).tolist()):
+            partial.counts[key] = partial.counts.get(key, 0) + count
+
+        for field in spec.metrics:
+            x = columns.numbers[field]
+            valid = ~np.isnan(x)
+            g, v = inverse[valid], x[valid]
+            n = np.bincount(g, minlength=group_count).tolist()
+            sums = np.bincount(g, weights=v, minlength=group_count).tolist()
+            squares = np.bincount(g, weights=v * v, minlength=group_count).tolist()
+            histograms = [None] * group_count
+            if partial.ordered[field] and v.size:
+                order = group_value_order(g, v, group_count)
+                sorted_g, sorted_v = g[order], v[order]
+                # Tramos de (grupo, valor) iguales
+                starts = np.flatnonzero(np.concatenate(([True], (np.diff(sorted_g) != 0) | (np.diff(sorted_v) != 0))))
+                if starts.size > MAX_HISTOGRAM_VALUES:
+                    return None
+                runs = np.diff(np.append(starts, sorted_v.size)).tolist()
+                histograms = [Counter() for _ in range(group_count)]
+                for group, value, run in zip(sorted_g[starts].tolist(), sorted_v[starts].tolist(), runs):
+                    histograms[group][value] = run
+            states = partial.states[field]
+            for index, key in enumerate(keys):
+                state = [n[index], sums[index], squares[index], histograms[index]]
+                if key in states:
+                    _merge_state(states[key], state)
+                else:
+                    states[key] = state
+        return partial
+
+    def add_row(self, row: Dict, sign=1):
+        """Suma (sign=1) o resta (sign=-1) una fila"""
+        key = self.spec.row_key(row)
+        self.total_rows += sign
+        self.counts[key] = self.counts.get(key, 0) + sign
+        for field, states in self.states.items():
+            value = row.get(field)
+            state = states.get(key)
+            if state is None:
+                state = states[key] = [0, 0.0, 0.0, Counter() if self.ordered[field] else None]
+            if is_number(value):
+                state[0] += sign
+                state[1] += sign * value
+                state[2] += sign * value * value
+                if state[3] is not None:
+                    state[3][float(value)] += sign
+
+    def merge(self, other: 'PartialAggregate'):
+        """Combina otro estado parcial de la misma especificación (también con signo negativo)"""
+        self.total_rows += other.total_rows
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        for field, states in other.states.items():
+            target = self.states[field]
+            for key, state in states.items():
+                if key in target:
+                    _merge_state(target[key], state)
+                else:
+                    target[key] = [state[0], state[1], state[2], Counter(state[3]) if state[3] is not None else None]
+        # Grupos que se quedan sin filas (en un delta un grupo puede quedar a 0 filas con métricas que sí cambian)
+        for key in [key for key in other.counts if self.counts.get(key) == 0]:
+            self._drop(key)
+
+    def _drop(self, key):
+        del self.counts[key]
+        for states in self.states.values():
+            states.pop(key, None)
+
+    def result(self) -> Dict:
+        """Mismo resultado que aggregate() a partir del estado parcial"""
+        metrics = {}
+        for key in [key for key, count in self.counts.items() if count > 0]:
+            metrics[key] = {field: _state_metrics(self.states[field].get(key), ops)
+                            for field, ops in self.spec.metrics.items()}
+        keys = [key for key in metrics if self.spec.passes_having(self.counts[key], metrics[key])]
+        keys.sort(key=lambda k: -self.counts[k])
+        groups = [{
+            'key': key[0] if len(key) == 1 else dict(zip(self.spec.group_by, key)),
+            'count': self.counts[key],
+            'metrics': metrics[key]
+        } for key in keys]
+        return {'groups': groups, 'total_rows': self.total_rows, 'groups_before_having': len(metrics)}
+
+def _merge_state(target: List, state: List):
+    target[0] += state[0]
+    target[1] += state[1]
+    target[2] += state[2]
+    if target[3] is not None and state[3] is not None:
+        target[3].update(state[3])
+        for value in [value for value, count in target[3].items() if count == 0]:
+            del target[3][value]
+
+def _state_metrics(state: Optional[List], ops: List[str]) -> Dict:
+    """Métricas de un grupo a partir de [n, suma, suma², histograma]"""
+    n, total, squares, histogram = state or (0, 0.0, 0.0, None)
+    if n <= 0:
+        return {op: (0 if op == 'count' else None) for op in ops}
+    mean = total / n
+    values = counts = None
+    if histogram:
+        values = sorted(value for value, count in histogram.items() if count > 0)
+        counts = np.cumsum([histogram[value] for value in values]).tolist()
+    out = {}
+    for op in ops:
+        if op == 'count':
+            out[op] = n
+        elif op == 'sum':
+            out[op] = json_number(total)
+        elif op == 'mean':
+            out[op] = json_number(mean)
+        elif op == 'std':
+            out[op] = json_number(math.sqrt(max(0.0, squares / n - mean * mean)))
+        elif op == 'min':
+            out[op] = json_number(values[0])
+        elif op == 'max':
+            out[op] = json_number(values[-1])
+        else:
+            # Interpolación lineal como numpy.percentile sobre el histograma acumulado
+            position = percentile_of(op) * (n - 1)
+            low = values[bisect_right(counts, math.floor(position))]
+            high = values[bisect_right(counts, math.ceil(position))]
+            out[op] = json_number(low + (high - low) * (position - math.floor(position)))
+    return out
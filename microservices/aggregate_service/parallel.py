@@ -0,0 +1,226 @@
+"""
+Agregación map-reduce en varios procesos
+Las columnas ya codificadas (grupo por fila y valores numéricos) se copian a un
+bloque de memoria compartida; cada proceso calcula el agregado parcial de un
+tramo de filas (conteos, sumas, M2 y tramos ordenados de valores) sin recibir
+filas serializadas, y el proceso principal los combina. Con pocas filas o un
+solo núcleo se calcula en el propio proceso
+"""
+import os
+import time
+import logging
+import threading
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+from groupby import (AggregationSpec, Columns, aggregate, finish_aggregation, group_codes,
+                     group_value_order, needs_order, percentile_of)
+
+logger = logging.getLogger(__name__)
+
+def available_cores() -> int:
+    """Núcleos que puede usar el contenedor"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _shm_available() -> int:
+    """Bytes libres en /dev/shm (en Docker 64 MB salvo que se amplíe con shm_size)"""
+    try:
+        stats = os.statvfs('/dev/shm')
+        return stats.f_bavail * stats.f_frsize
+    except OSError:
+        return 0
+
+def _chunk_partial(shm_name: str, size: int, layout: List[Tuple[str, int, bool]], group_count: int,
+                   start: int, end: int) -> Dict:
+    """
+    Agregado parcial de las filas [start, end) (se ejecuta en un proceso del pool)
+
+    Devuelve por grupo: filas y, por campo, n, suma y M2 (suma de cuadrados de
+    desviaciones respecto a la media del tramo); con ordered, los tramos
+    (grupo, valor, repeticiones) ordenados
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        inverse = np.ndarray((size,), dtype=np.int64, buffer=shm.buf)[start:end]
+        result = {'counts': np.bincount(inverse, minlength=group_count), 'fields': {}}
+        for field, offset, ordered in layout:
+            x = np.ndarray((size,), dtype=np.float64, buffer=shm.buf, offset=offset)[start:end]
+            valid = ~np.isnan(x)
+            g, v = inverse[valid], x[valid]
+            n = np.bincount(g, minlength=group_count)
+            sums = np.bincount(g, weights=v, minlength=group_count)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                deviations = v - (sums / n)[g]
+            m2 = np.bincount(g, weights=deviations * deviations, minlength=group_count)
+            runs = None
+            if ordered and v.size:
+                order = group_value_order(g, v, group_count)
+                sorted_g, sorted_v = g[order], v[order]
+                starts = np.flatnonzero(np.concatenate(([True], (np.diff(sorted_g) != 0) | (np.diff(sorted_v) != 0))))
+                runs = (sorted_g[starts], sorted_v[starts], np.diff(np.append(starts, sorted_v.size)))
+            result['fields'][field] = (n, sums, m2, runs)
+            del x, valid, g, v
+        del inverse
+        return result
+    finally:
+        shm.close()
+
+def _merge_moments(n_a, sum_a, m2_a, n_b, sum_b, m2_b):
+    """Combina n, suma y M2 de dos tramos (Chan et al.): estable numéricamente"""
+    n = n_a + n_b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = np.where(n_b > 0, sum_b / np.maximum(n_b, 1), 0) - np.where(n_a > 0, sum_a / np.maximum(n_a, 1), 0)
+        m2 = m2_a + m2_b + np.where(n > 0, delta * delta * n_a * n_b / np.maximum(n, 1), 0)
+    return n, sum_a + sum_b, m2
+
+def _merge_runs(runs: List[Tuple[np.ndarray, np.ndarray, np.ndarray]], group_count: int):
+    """Une los tramos ordenados de varios procesos: (grupo, valor, repeticiones) ordenados y sin duplicados"""
+    groups = np.concatenate([r[0] for r in runs])
+    values = np.concatenate([r[1] for r in runs])
+    repeats = np.concatenate([r[2] for r in runs])
+    order = group_value_order(groups, values, group_count)
+    groups, values, repeats = groups[order], values[order], repeats[order]
+    starts = np.flatnonzero(np.concatenate(([True], (np.diff(groups) != 0) | (np.diff(values) != 0))))
+    return groups[starts], values[starts], np.add.reduceat(repeats, starts)
+
+def _final_metrics(n, sums, m2, runs, group_count: int, ops: List[str]) -> Dict[str, np.ndarray]:
+    """Mismas métricas que numeric_metrics a partir de los parciales combinados"""
+    counts = n.astype(np.float64)
+    result = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if 'count' in ops:
+            result['count'] = counts
+        if 'sum' in ops:
+            result['sum'] = np.where(counts > 0, sums, np.nan)
+        if 'mean' in ops:
+            result['mean'] = sums / counts
+        if 'std' in ops:
+            result['std'] = np.sqrt(m2 / counts)
+    if runs is None:
+        # Ningún valor numérico: min/max/percentiles vacíos
+        result.update({op: np.full(group_count, np.nan) for op in ops
+                       if op in ('min', 'max') or percentile_of(op) is not None})
+        return result
+
+    run_groups, run_values, run_repeats = runs
+    cumulative = np.cumsum(run_repeats)  # filas acumuladas hasta cada tramo (incluido)
+    group_start = np.concatenate(([0], np.cumsum(n)[:-1]))  # primera fila de cada grupo en el orden global
+    present = n > 0
+
+    def value_at(rank: np.ndarray) -> np.ndarray:
+        return run_values[np.searchsorted(cumulative, rank, side='right')]
+
+    for op in ops:
+        q = 0.0 if op == 'min' else 1.0 if op == 'max' else percentile_of(op)
+        if q is None:
+            continue
+        out = np.full(group_count, np.nan)
+        position = group_start[present] + q * (counts[present] - 1)
+        low = np.floor(position)
+        low_value = value_at(low.astype(np.int64))
+        high_value = value_at(np.ceil(position).astype(np.int64))
+        out[present] = low_value + (high_value - low_value) * (position - low)
+        result[op] = out
+    return result
+
+class ParallelAggregator:
+    """Ejecuta agregaciones grandes repartidas en un pool de procesos"""
+
+    def __init__(self, workers: Optional[int] = None, min_rows=200000, chunks_per_worker=2):
+        self.workers = workers or available_cores()
+        self.min_rows = min_rows  # por debajo se calcula en el propio proceso
+        self.chunks_per_worker = chunks_per_worker
+        self.metrics = {'parallel_runs': 0, 'in_process_runs': 0, 'fallbacks': 0, 'last_parallel_ms': None}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # forkserver: no se hace fork de un proceso con hilos (Flask, refrescos en segundo plano)
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+                logger.info(f"⚙️ Pool de agregación iniciado ({self.workers} procesos, {method})")
+            return self._pool
+
+    def start(self):
+        """Arranca los procesos en segundo plano (importar numpy en cada uno tarda)"""
+        if self.workers >= 2:
+            def warm_up():
+                try:
+                    pool = self._get_pool()
+                    for future in [pool.submit(os.getpid) for _ in range(self.workers)]:
+                        future.result()
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo iniciar el pool de agregación: {e}")
+            threading.Thread(target=warm_up, daemon=True).start()
+
+    def aggregate(self, columns: Columns, spec: AggregationSpec) -> Dict:
+        """Mismo resultado que groupby.aggregate, en paralelo si compensa"""
+        if self.workers < 2 or columns.size < self.min_rows:
+            self.metrics['in_process_runs'] += 1
+            return aggregate(columns, spec)
+        try:
+            return self._aggregate_parallel(columns, spec)
+        except Exception as e:
+            self.metrics['fallbacks'] += 1
+            logger.warning(f"⚠️ Agregación en paralelo fallida, se calcula en el proceso: {e}")
+            with self._lock:
+                # Un pool roto (proceso terminado) no se recupera: se crea otro en la siguiente
+                if isinstance(e, BrokenProcessPool) and self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+            return aggregate(columns, spec)
+
+    def _aggregate_parallel(self, columns: Columns, spec: AggregationSpec) -> Dict:
+        started = time.time()
+        size = columns.size
+        # Bloque compartido: grupo por fila y una columna float64 por campo con métricas
+        block_size = 8 * size * (1 + len(spec.metrics))
+        if block_size > _shm_available():
+            # /dev/shm sin espacio: escribir en el bloque terminaría el proceso (SIGBUS)
+            raise MemoryError(f"/dev/shm no tiene {block_size // 2 ** 20} MB libres")
+        inverse, keys = group_codes(columns, spec)
+        group_count = len(keys)
+
+        shm = shared_memory.SharedMemory(create=True, size=block_size)
+        try:
+            np.ndarray((size,), dtype=np.int64, buffer=shm.buf)[:] = inverse
+            layout = []
+            for position, (field, ops) in enumerate(spec.metrics.items(), start=1):
+                offset = 8 * size * position
+                np.ndarray((size,), dtype=np.float64, buffer=shm.buf, offset=offset)[:] = columns.numbers[field]
+                layout.append((field, offset, needs_order(ops)))
+
+            chunk_count = self.workers * self.chunks_per_worker
+            bounds = np.linspace(0, size, chunk_count + 1).astype(np.int64).tolist()
+            pool = self._get_pool()
+            futures = [pool.submit(_chunk_partial, shm.name, size, layout, group_count, start, end)
+                       for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+            partials = [future.result() for future in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+
+        counts = np.sum([p['counts'] for p in partials], axis=0)
+        metrics = {}
+        for field, ops in spec.metrics.items():
+            n, sums, m2, _ = partials[0]['fields'][field]
+            for partial in partials[1:]:
+                n, sums, m2 = _merge_moments(n, sums, m2, *partial['fields'][field][:3])
+            runs = [p['fields'][field][3] for p in partials if p['fields'][field][3] is not None]
+            merged = _merge_runs(runs, group_count) if runs else None
+            metrics[field] = _final_metrics(n, sums, m2, merged, group_count, ops)
+
+        self.metrics['parallel_runs'] += 1
+        self.metrics['last_parallel_ms'] = round((time.time() - started) * 1000, 1)
+        return finish_aggregation(spec, keys, counts, metrics, size)
+
+    def get_stats(self) -> Dict:
+        return dict(self.metrics, workers=self.workers, min_rows=self.min_rows)
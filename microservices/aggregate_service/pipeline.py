@@ -0,0 +1,166 @@
+"""
+Pipelines de consulta del aggregate-service
+Una lista ordenada de etapas se valida una vez y se ejecuta como una cadena de
+generadores sobre una sola lectura de ROBLE: filter, project y limit pasan las
+filas de una en una, group y sort consumen su entrada, y un sort seguido de
+limit se resuelve con un heap de tamaño limit. Las igualdades de los filtros
+iniciales se envían a /read y al llegar al límite se corta la descarga
+
+    {"stages": [
+        {"filter": {"field": "age", "op": "gte", "value": 18}},
+        {"group": {"group_by": "city", "metrics": {"age": ["mean"]}}},
+        {"sort": {"field": "age.mean", "order": "desc"}},
+        {"limit": 10}
+    ]}
+
+Las filas de un group tienen los campos de la clave, count y una columna
+"campo.métrica" por métrica, de modo que las etapas siguientes las tratan
+como cualquier otra fila
+"""
+import heapq
+import time
+from typing import Callable, Dict, Iterable, Iterator
+from predicates import compile_predicate
+from ordering import OrderError, parse_order, sort_key
+from groupby import AggregationSpec, Columns, aggregate
+from approximate import ApproximateAggregation
+
+MAX_STAGES = 16
+STAGES = ('filter', 'project', 'group', 'sort', 'limit')
+
+class PipelineError(ValueError):
+    """Pipeline no válido (se responde 400)"""
+
+class Pipeline:
+    """Pipeline validado; run() lo ejecuta sobre un iterable de filas"""
+
+    def __init__(self, stages, compute: Callable[[Columns, AggregationSpec], Dict] = aggregate):
+        if not isinstance(stages, list) or not stages:
+            raise PipelineError("stages debe ser una lista no vacía de etapas")
+        if len(stages) > MAX_STAGES:
+            raise PipelineError(f"El pipeline admite como mucho {MAX_STAGES} etapas")
+        self.compute = compute  # motor de agregación de las etapas group exactas
+        self.stages = []
+        for position, stage in enumerate(stages):
+            if not isinstance(stage, dict) or len(stage) != 1 or next(iter(stage)) not in STAGES:
+                raise PipelineError(f"Etapa {position}: use un objeto con una clave de {', '.join(STAGES)}")
+            kind, argument = next(iter(stage.items()))
+            self.stages.append((kind, self._compile(kind, argument, position)))
+
+        # sort seguido de limit: solo se guardan las `limit` primeras filas (heap)
+        for position, (kind, argument) in enumerate(self.stages[:-1]):
+            if kind == 'sort' and self.stages[position + 1][0] == 'limit':
+                argument['top'] = self.stages[position + 1][1]
+        self.stats = [{'stage': kind, 'rows_out': 0} for kind, _ in self.stages]
+        self.scanned_rows = 0
+        self.elapsed_ms = None
+
+    @staticmethod
+    def _compile(kind: str, argument, position: int):
+        if kind == 'filter':
+            return compile_predicate(argument)
+        if kind == 'project':
+            if not isinstance(argument, list) or not argument or \
+                    not all(isinstance(field, str) and field for field in argument):
+                raise PipelineError(f"Etapa {position}: project requiere una lista de campos")
+            return list(dict.fromkeys(argument))
+        if kind == 'group':
+            if not isinstance(argument, dict):
+                raise PipelineError(f"Etapa {position}: group requiere una especificación de agregación")
+            return AggregationSpec(argument)
+        if kind == 'sort':
+            try:
+                return {'keys': parse_order(argument), 'top': None}
+            except OrderError as e:
+                raise PipelineError(f"Etapa {position}: sort: {e}")
+        if isinstance(argument, bool) or not isinstance(argument, int) or argument < 1:
+            raise PipelineError(f"Etapa {position}: limit debe ser un entero positivo")
+        return argument
+
+    def pushdown_filters(self) -> Dict:
+        """Igualdades de los filtros anteriores a cualquier otra etapa (se envían a ROBLE)"""
+        filters = {}
+        for kind, predicate in self.stages:
+            if kind != 'filter':
+                break
+            filters.update(predicate.pushdown_filters())
+        return filters
+
+    def run(self, rows: Iterator[Dict]) -> Iterator[Dict]:
+        """Filas resultado a medida que se producen; al terminar o cerrarse se cierra `rows`"""
+        started = time.time()
+        try:
+            stream = self._scan(rows)
+            for position, (kind, argument) in enumerate(self.stages):
+                stream = self._counted(getattr(self, f'_{kind}')(stream, argument, position), position)
+            yield from stream
+        finally:
+            close = getattr(rows, 'close', None)
+            if close:
+                close()
+            self.elapsed_ms = round((time.time() - started) * 1000, 1)
+
+    def summary(self) -> Dict:
+        return {
+            'scanned_rows': self.scanned_rows,
+            'returned_rows': self.stats[-1]['rows_out'],
+            'pushdown': self.pushdown_filters(),
+            'stages': self.stats,
+            'elapsed_ms': self.elapsed_ms
+        }
+
+    def _scan(self, rows: Iterable[Dict]) -> Iterator[Dict]:
+        for row in rows:
+            self.scanned_rows += 1
+            yield row
+
+    def _counted(self, rows: Iterator[Dict], position: int) -> Iterator[Dict]:
+        stats = self.stats[position]
+        for row in rows:
+            stats['rows_out'] += 1
+            yield row
+
+    @staticmethod
+    def _filter(rows, predicate, position):
+        return filter(predicate, rows)
+
+    @staticmethod
+    def _project(rows, fields, position):
+        for row in rows:
+            yield {field: row.get(field) for field in fields}
+
+    def _group(self, rows, spec: AggregationSpec, position):
+        if spec.approximate:
+            approximation = ApproximateAggregation(spec)
+            approximation.add_rows(rows)
+            result = approximation.result()
+            self.stats[position]['approximation'] = result['approximation']
+        else:
+            # Solo se guardan las columnas que usa la agregación
+            result = self.compute(Columns(rows, spec), spec)
+        self.stats[position]['groups_before_having'] = result['groups_before_having']
+        for group in result['groups']:
+            key = group['key']
+            row = dict(key) if isinstance(key, dict) else {spec.group_by[0]: key}
+            row['count'] = group['count']
+            if 'count_max' in group:
+                row['count_max'] = group['count_max']
+            for field, values in group['metrics'].items():
+                for op, value in values.items():
+                    row[f'{field}.{op}'] = value
+            yield row
+
+    def _sort(self, rows, argument: Dict, position):
+        key = sort_key(argument['keys'])
+        if argument['top'] is not None:
+            self.stats[position]['top_k'] = argument['top']
+            yield from heapq.nsmallest(argument['top'], rows, key=key)
+        else:
+            yield from sorted(rows, key=key)
+
+    @staticmethod
+    def _limit(rows, limit: int, position):
+        for count, row in enumerate(rows, start=1):
+            yield row
+            if count >= limit:
+                return
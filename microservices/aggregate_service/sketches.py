@@ -0,0 +1,174 @@
+"""
+Sketches combinables de memoria acotada
+HyperLogLog (valores distintos), KLL (cuantiles) y Misra-Gries (grupos más
+frecuentes, la variante con contadores de Space-Saving). Todos admiten merge():
+se construyen por bloques o en procesos distintos y se combinan sin perder las
+garantías de error
+"""
+import math
+import hashlib
+import numpy as np
+from typing import Dict, Hashable, Iterable, Optional, Set
+
+def stable_hash(value) -> int:
+    """Hash de 64 bits igual en todos los procesos (hash() de Python cambia con PYTHONHASHSEED)"""
+    return int.from_bytes(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), 'little')
+
+class HyperLogLog:
+    """Número aproximado de valores distintos con 2^p registros de un byte"""
+
+    def __init__(self, p=12):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def add(self, values: Iterable):
+        hashes = np.fromiter((stable_hash(v) for v in values), dtype=np.uint64)
+        if hashes.size == 0:
+            return
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        # Posición del primer bit a 1 en los 64 - p bits restantes (1 = primer bit)
+        rest = (hashes << np.uint64(self.p)) | np.uint64(1 << (self.p - 1))
+        rank = (64 - np.floor(np.log2(rest.astype(np.float64)))).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: 'HyperLogLog'):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Pocos valores: conteo lineal sobre registros vacíos
+            raw = m * math.log(m / zeros)
+        return int(round(raw))
+
+    @property
+    def relative_error(self) -> float:
+        """Error estándar relativo"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+def kll_rank_error(k: int) -> float:
+    """Error de rango normalizado de KLL (aprox. con 99 % de confianza, como en Apache DataSketches)"""
+    return min(1.0, 2.296 / k ** 0.9723)
+
+class KLLSketch:
+    """
+    Cuantiles aproximados (Karnin-Lang-Liberty): niveles de compactadores con
+    capacidad decreciente; al compactar se conservan los elementos pares o
+    impares de un nivel ordenado y suben al siguiente con peso doble
+    """
+
+    def __init__(self, k=200):
+        self.k = k
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng()
+
+    def _capacity(self, level: int) -> int:
+        return max(2, int(math.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - level))))
+
+    def update(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        self.n += int(values.size)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self._compress()
+
+    def merge(self, other: 'KLLSketch'):
+        if other.n == 0:
+            return
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                keep = np.empty(0)
+                if len(items) % 2:
+                    # Con número impar uno se queda en el nivel
+                    position = int(self._rng.integers(len(items)))
+                    keep = items[position:position + 1]
+                    items = np.delete(items, position)
+                promoted = items[int(self._rng.integers(2))::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+            level += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.n == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2 ** level) for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items)
+        cumulative = np.cumsum(weights[order])
+        position = min(len(items) - 1, int(np.searchsorted(cumulative, q * cumulative[-1], side='left')))
+        return float(items[order][position])
+
+    @property
+    def rank_error(self) -> float:
+        return kll_rank_error(self.k)
+
+    def memory_bytes(self) -> int:
+        return sum(items.nbytes for items in self.levels)
+
+class HeavyHitters:
+    """
+    Grupos más frecuentes con `capacity` contadores (Misra-Gries combinable)
+    El conteo real de cada grupo está entre `counts[key]` y `counts[key] + error`
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts: Dict[Hashable, int] = {}
+        self.error = 0  # total restado a todos los contadores
+        self.pruned = False  # algún grupo se descartó alguna vez
+
+    def update(self, counts: Dict[Hashable, int]) -> Set[Hashable]:
+        """Suma conteos (de un bloque o de otro sketch); devuelve los grupos descartados"""
+        for key, count in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        return self._prune()
+
+    def merge(self, other: 'HeavyHitters') -> Set[Hashable]:
+        self.error += other.error
+        self.pruned = self.pruned or other.pruned
+        return self.update(other.counts)
+
+    def _prune(self) -> Set[Hashable]:
+        if len(self.counts) <= self.capacity:
+            return set()
+        # Se resta el conteo (capacity+1)-ésimo a todos y se guardan los `capacity` mayores,
+        # también los empatados con él (quedan a 0): con conteos iguales no se vacía el sketch
+        keys = list(self.counts)
+        values = np.fromiter(self.counts.values(), dtype=np.int64, count=len(keys))
+        order = np.argpartition(-values, self.capacity)
+        threshold = int(values[order[self.capacity]])
+        evicted = {keys[i] for i in order[self.capacity:].tolist()}
+        self.counts = {keys[i]: int(values[i]) - threshold for i in order[:self.capacity].tolist()}
+        self.error += threshold
+        self.pruned = True
+        return evicted
+
+    def top(self, limit: int):
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:limit]
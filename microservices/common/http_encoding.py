@@ -0,0 +1,184 @@
+"""
+Serialización JSON rápida y compresión de respuestas de las apps Flask
+jsonify y request.get_json usan orjson si está instalado (mismo formato que
+el proveedor por defecto de Flask: claves ordenadas y fechas HTTP) y las
+respuestas de texto a partir de COMPRESS_MIN_BYTES se comprimen con brotli o
+gzip según Accept-Encoding; las respuestas en streaming se comprimen bloque a
+bloque sin esperar al final. El tiempo de serialización y de compresión y los
+bytes ahorrados se publican con encoding_stats()
+
+El manager también lo usa: su imagen lo copia desde microservices/common/
+"""
+import os
+import json
+import time
+import zlib
+import logging
+from typing import Dict, Iterable, Iterator
+from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript',
+                      'application/xml', 'image/svg+xml', 'text/')
+
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+_metrics = {'json_responses': 0, 'serialize_ms': 0.0, 'compressed_responses': 0, 'compressed_streams': 0,
+            'by_encoding': {}, 'bytes_in': 0, 'bytes_out': 0, 'compress_ms': 0.0}
+
+def dumps_bytes(obj) -> bytes:
+    """JSON compacto en UTF-8 (líneas NDJSON); lo que no es JSON se convierte a texto"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=str, separators=(',', ':')).encode()
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask con orjson (si no está, el de la librería estándar)"""
+
+    def _orjson_dumps(self, obj, indent=False) -> bytes:
+        option = _ORJSON_OPTIONS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        # Fechas, Decimal, UUID... con las mismas conversiones que Flask
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is None or set(kwargs) - {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        try:
+            return self._orjson_dumps(obj, indent=bool(kwargs.get('indent'))).decode()
+        except TypeError:  # enteros de más de 64 bits, claves no admitidas...
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        started = time.perf_counter()
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        obj = self._prepare_response_obj(args, kwargs)
+        body = None
+        if orjson is not None:
+            try:
+                body = self._orjson_dumps(obj, indent=indent) + b'\n'
+            except TypeError:
+                pass
+        if body is None:
+            dump_args = {'indent': 2} if indent else {'separators': (',', ':')}
+            body = f"{super().dumps(obj, **dump_args)}\n"
+        _metrics['json_responses'] += 1
+        _metrics['serialize_ms'] += (time.perf_counter() - started) * 1000
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+def _negotiate() -> str:
+    """Codificación aceptada por el cliente que preferimos (o '' si ninguna)"""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered) or ''
+
+def _compressor(encoding: str):
+    """(comprimir bloque, vaciar, terminar) de la codificación"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: cabecera gzip
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def _count(encoding: str, size_in: int, size_out: int, elapsed: float):
+    _metrics['by_encoding'][encoding] = _metrics['by_encoding'].get(encoding, 0) + 1
+    _metrics['bytes_in'] += size_in
+    _metrics['bytes_out'] += size_out
+    _metrics['compress_ms'] += elapsed * 1000
+
+def _compress_stream(chunks: Iterable, encoding: str) -> Iterator[bytes]:
+    """Comprime cada bloque y lo vacía en seguida (el cliente no espera al final)"""
+    compress, flush, finish = _compressor(encoding)
+    size_in = size_out = 0
+    elapsed = 0.0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            started = time.perf_counter()
+            data = compress(chunk) + flush()
+            elapsed += time.perf_counter() - started
+            size_in += len(chunk)
+            size_out += len(data)
+            if data:
+                yield data
+        data = finish()
+        size_out += len(data)
+        yield data
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+        _count(encoding, size_in, size_out, elapsed)
+
+def compress_response(response):
+    """after_request: comprime las respuestas de texto si el cliente lo acepta"""
+    if request.method == 'HEAD' or response.direct_passthrough or response.status_code < 200 or \
+            response.status_code in (204, 304) or 'Content-Encoding' in response.headers or \
+            not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate()
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        _metrics['compressed_streams'] += 1
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    started = time.perf_counter()
+    compress, _, finish = _compressor(encoding)
+    compressed = compress(data) + finish()
+    _count(encoding, len(data), len(compressed), time.perf_counter() - started)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    _metrics['compressed_responses'] += 1
+    return response
+
+def setup_http_encoding(app: Flask):
+    """Instala el proveedor JSON rápido y la compresión de respuestas en la app"""
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+    logger.info(f"⚡ JSON con {'orjson' if orjson else 'json'}, compresión "
+                f"{'brotli/gzip' if brotli else 'gzip'} desde {COMPRESS_MIN_BYTES} bytes")
+
+def encoding_stats() -> Dict:
+    stats = dict(_metrics, by_encoding=dict(_metrics['by_encoding']),
+                 json_library='orjson' if orjson else 'json', brotli=brotli is not None,
+                 min_bytes=COMPRESS_MIN_BYTES)
+    stats['serialize_ms'] = round(stats['serialize_ms'], 1)
+    stats['compress_ms'] = round(stats['compress_ms'], 1)
+    if stats['bytes_in']:
+        stats['compression_ratio'] = round(stats['bytes_out'] / stats['bytes_in'], 3)
+    return stats
@@ -0,0 +1,60 @@
+"""
+Orden de filas compartido (order_by de /filter y etapas sort de los pipelines)
+Admite varios campos con sentido propio y valores de tipos mezclados: números
+antes que texto y las filas sin el campo al final en ambos sentidos
+
+    "age", "-age", {"field": "age", "order": "desc"} o una lista de ellos
+"""
+import json
+from typing import Callable, Dict, List, Tuple
+
+class OrderError(ValueError):
+    """Orden no válido (se responde 400)"""
+
+class _Descending:
+    """Invierte el orden de un valor (el texto no se puede negar)"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+def order_value(value) -> tuple:
+    """Valor comparable entre tipos: (sin valor, tipo, valor)"""
+    if value is None or value != value:  # None o NaN
+        return (1, 0, 0)
+    if isinstance(value, (int, float)):
+        return (0, 0, value)
+    if isinstance(value, str):
+        return (0, 1, value)
+    return (0, 2, json.dumps(value, sort_keys=True, default=str))
+
+def parse_order(argument) -> List[Tuple[str, bool]]:
+    """[(campo, descendente)] de la especificación; lanza OrderError si no es válida"""
+    items = argument if isinstance(argument, list) else [argument]
+    keys = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'field': item[1:], 'order': 'desc'} if item.startswith('-') else {'field': item}
+        if not isinstance(item, dict) or not isinstance(item.get('field'), str) or not item['field'] or \
+                item.get('order', 'asc') not in ('asc', 'desc') or set(item) - {'field', 'order'}:
+            raise OrderError("use un campo, \"-campo\" o {\"field\": ..., \"order\": \"asc\"|\"desc\"}")
+        keys.append((item['field'], item.get('order', 'asc') == 'desc'))
+    if not keys:
+        raise OrderError("requiere al menos un campo")
+    return keys
+
+def sort_key(keys: List[Tuple[str, bool]]) -> Callable[[Dict], tuple]:
+    """Clave de ordenación de una fila (dict) para sorted() o heapq"""
+    def key(row):
+        parts = []
+        for field, descending in keys:
+            missing, kind, value = order_value(row.get(field))
+            parts += (missing, kind, _Descending(value) if descending else value)
+        return tuple(parts)
+    return key
@@ -0,0 +1,345 @@
+"""
+Lenguaje de filtros compartido (filter-service y etapas filter de los pipelines)
+Expresiones JSON sobre los campos de usuario que se validan una vez y se
+compilan a closures; los AND/OR ordenan sus condiciones por coste y
+selectividad (estimada y luego observada) para descartar cuanto antes
+
+    {"field": "age", "op": "gte", "value": 18}
+    {"field": "age", "op": "between", "value": [18, 30]}
+    {"field": "city", "op": "in", "value": ["Barranquilla", "Bogotá"]}
+    {"field": "email", "op": "regex", "value": "@uninorte\\.edu\\.co$"}
+    {"and": [...]}, {"or": [...]}, {"not": {...}}
+
+Las expresiones regulares usan RE2 (tiempo lineal) si está instalado. Con el
+módulo re se rechazan los patrones que pueden retroceder de forma exponencial
+(cuantificadores anidados, alternativas repetidas, referencias), se admiten
+como mucho MAX_REGEX_REPEATS cuantificadores variables y se evalúan sobre los
+primeros MAX_REGEX_SUBJECT caracteres de cada valor
+"""
+import re
+from typing import Callable, Dict, List, Set, Tuple
+from roble_data import values_equal
+
+try:
+    import re2
+    _RE2_OPTIONS = re2.Options()
+    _RE2_OPTIONS.log_errors = False  # los patrones no válidos se responden con 400, no se registran
+except ImportError:
+    re2 = None
+
+try:
+    from re import _parser as sre_parse  # Python >= 3.11
+except ImportError:
+    import sre_parse
+
+MAX_NODES = 64
+MAX_DEPTH = 8
+MAX_REGEX_LENGTH = 200
+MAX_REGEX_REPEATS = 2  # cuantificadores variables por patrón (sin RE2)
+MAX_REGEX_SUBJECT = 256  # caracteres de cada valor que se evalúan (sin RE2)
+REORDER_EVERY = 512  # evaluaciones entre reordenaciones por selectividad observada
+
+# Coste relativo por operador y fracción de filas que se estima que pasan
+OPERATORS = {
+    'eq': (1.0, 0.1),
+    'ne': (1.0, 0.9),
+    'lt': (1.5, 0.5),
+    'lte': (1.5, 0.5),
+    'gt': (1.5, 0.5),
+    'gte': (1.5, 0.5),
+    'between': (2.0, 0.25),
+    'in': (1.5, None),  # depende del número de valores
+    'prefix': (2.0, 0.2),
+    'regex': (6.0, 0.3),
+    'exists': (0.5, 0.9)
+}
+
+class PredicateError(ValueError):
+    """Expresión de filtro no válida (se responde 400)"""
+
+class _Node:
+    """Condición compilada con sus estadísticas de evaluación"""
+    __slots__ = ('evaluate', 'cost', 'selectivity', 'seen', 'passed', 'pushdown')
+
+    def __init__(self, evaluate: Callable[[Dict], bool], cost: float, selectivity: float, pushdown=None):
+        self.evaluate = evaluate
+        self.cost = cost
+        self.selectivity = selectivity
+        self.seen = 0
+        self.passed = 0
+        self.pushdown = pushdown  # {campo: valor} si es una igualdad simple
+
+    def observed_selectivity(self) -> float:
+        # Media con la estimación como prior para no reaccionar a las primeras filas
+        return (self.passed + self.selectivity * 20) / (self.seen + 20)
+
+def _and_rank(node: _Node) -> float:
+    """Primero lo barato que descarta mucho"""
+    return node.cost / max(1e-6, 1 - node.observed_selectivity())
+
+def _or_rank(node: _Node) -> float:
+    """Primero lo barato que acepta mucho"""
+    return node.cost / max(1e-6, node.observed_selectivity())
+
+class CompiledPredicate:
+    """Predicado listo para evaluar fila a fila"""
+
+    def __init__(self, root: _Node, expression: Dict, node_count: int):
+        self.root = root
+        self.expression = expression
+        self.node_count = node_count
+
+    def __call__(self, row: Dict) -> bool:
+        return self.root.evaluate(row)
+
+    def pushdown_filters(self) -> Dict:
+        """Igualdades del AND de primer nivel que se pueden enviar a ROBLE"""
+        return dict(self.root.pushdown or {})
+
+    def fields(self) -> Set[str]:
+        """Campos que consulta la expresión"""
+        found = set()
+        pending = [self.expression]
+        while pending:
+            node = pending.pop()
+            if 'field' in node:
+                found.add(node['field'])
+            pending.extend(node.get('and') or node.get('or') or ([node['not']] if 'not' in node else []))
+        return found
+
+    def index_conditions(self) -> List[Tuple[str, str, object]]:
+        """Condiciones simples del AND de primer nivel: (campo, op, valor), utilizables con índices"""
+        conditions = []
+        pending = [self.expression]
+        while pending:
+            node = pending.pop()
+            if 'and' in node:
+                pending.extend(node['and'])
+            elif 'field' in node:
+                conditions.append((node['field'], node.get('op', 'eq'), node.get('value')))
+        return conditions
+
+def compile_predicate(expression: Dict) -> CompiledPredicate:
+    """Valida y compila una expresión; lanza PredicateError si no es válida"""
+    counter = [0]
+    root = _compile(expression, 0, counter)
+    return CompiledPredicate(root, expression, counter[0])
+
+def _compile(expression, depth: int, counter: List[int]) -> _Node:
+    if not isinstance(expression, dict):
+        raise PredicateError("Cada condición debe ser un objeto JSON")
+    counter[0] += 1
+    if counter[0] > MAX_NODES:
+        raise PredicateError(f"La expresión supera {MAX_NODES} condiciones")
+    if depth > MAX_DEPTH:
+        raise PredicateError(f"La expresión supera {MAX_DEPTH} niveles de anidamiento")
+
+    if 'and' in expression or 'or' in expression:
+        kind = 'and' if 'and' in expression else 'or'
+        if len(expression) != 1:
+            raise PredicateError(f"'{kind}' no admite otras claves en el mismo objeto")
+        items = expression[kind]
+        if not isinstance(items, list) or not items:
+            raise PredicateError(f"'{kind}' requiere una lista no vacía de condiciones")
+        children = [_compile(item, depth + 1, counter) for item in items]
+        return _compile_and(children) if kind == 'and' else _compile_or(children)
+
+    if 'not' in expression:
+        if len(expression) != 1:
+            raise PredicateError("'not' no admite otras claves en el mismo objeto")
+        child = _compile(expression['not'], depth + 1, counter)
+        inner = child.evaluate
+        return _Node(lambda row: not inner(row), child.cost, 1 - child.selectivity)
+
+    return _compile_condition(expression)
+
+def _compile_and(children: List[_Node]) -> _Node:
+    if len(children) == 1:
+        return children[0]
+    nodes = sorted(children, key=_and_rank)
+    calls = [0]
+
+    def evaluate(row):
+        calls[0] += 1
+        if calls[0] % REORDER_EVERY == 0:
+            nodes.sort(key=_and_rank)
+        for node in nodes:
+            node.seen += 1
+            if not node.evaluate(row):
+                return False
+            node.passed += 1
+        return True
+
+    selectivity = 1.0
+    for child in children:
+        selectivity *= child.selectivity
+    pushdown = {}
+    for child in children:
+        pushdown.update(child.pushdown or {})
+    return _Node(evaluate, sum(child.cost for child in children), selectivity, pushdown or None)
+
+def _compile_or(children: List[_Node]) -> _Node:
+    if len(children) == 1:
+        return children[0]
+    nodes = sorted(children, key=_or_rank)
+    calls = [0]
+
+    def evaluate(row):
+        calls[0] += 1
+        if calls[0] % REORDER_EVERY == 0:
+            nodes.sort(key=_or_rank)
+        for node in nodes:
+            node.seen += 1
+            if node.evaluate(row):
+                node.passed += 1
+                return True
+        return False
+
+    rejected = 1.0
+    for child in children:
+        rejected *= 1 - child.selectivity
+    return _Node(evaluate, sum(child.cost for child in children), 1 - rejected)
+
+def _compile_condition(expression: Dict) -> _Node:
+    field = expression.get('field')
+    op = expression.get('op', 'eq')
+    if not isinstance(field, str) or not field:
+        raise PredicateError("Cada condición requiere 'field' (texto)")
+    if op not in OPERATORS:
+        raise PredicateError(f"Operador no soportado: {op}. Use: {', '.join(OPERATORS)}")
+    unknown = set(expression) - {'field', 'op', 'value'}
+    if unknown:
+        raise PredicateError(f"Claves desconocidas en la condición de '{field}': {', '.join(sorted(unknown))}")
+    if op != 'exists' and 'value' not in expression:
+        raise PredicateError(f"La condición '{op}' sobre '{field}' requiere 'value'")
+
+    value = expression.get('value')
+    cost, selectivity = OPERATORS[op]
+    missing = object()
+    pushdown = None
+
+    if op == 'eq':
+        evaluate = lambda row: values_equal(row.get(field), value)
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            pushdown = {field: value}
+    elif op == 'ne':
+        evaluate = lambda row: not values_equal(row.get(field), value)
+    elif op == 'exists':
+        expected = value is not False
+        evaluate = lambda row: (row.get(field) is not None) == expected
+    elif op in ('lt', 'lte', 'gt', 'gte'):
+        _check_comparable(field, op, value)
+        compare = {
+            'lt': lambda a: a < value, 'lte': lambda a: a <= value,
+            'gt': lambda a: a > value, 'gte': lambda a: a >= value
+        }[op]
+        evaluate = _guarded(field, compare)
+    elif op == 'between':
+        if not isinstance(value, list) or len(value) != 2:
+            raise PredicateError(f"'between' sobre '{field}' requiere [mínimo, máximo]")
+        low, high = value
+        _check_comparable(field, op, low)
+        _check_comparable(field, op, high)
+        evaluate = _guarded(field, lambda a: low <= a <= high)
+    elif op == 'in':
+        if not isinstance(value, list) or not value:
+            raise PredicateError(f"'in' sobre '{field}' requiere una lista no vacía")
+        if any(isinstance(v, (dict, list)) for v in value):
+            raise PredicateError(f"'in' sobre '{field}' solo admite valores simples")
+        # Comparación tolerante como en 'eq': también por texto en minúsculas
+        normalized = {str(v).lower() for v in value if v is not None}
+        accepts_null = None in value
+        evaluate = lambda row, m=missing: _in_set(row.get(field, m), normalized, accepts_null, m)
+        selectivity = min(0.9, 0.1 * len(value))
+    elif op == 'prefix':
+        if not isinstance(value, str):
+            raise PredicateError(f"'prefix' sobre '{field}' requiere texto")
+        prefix = value.lower()
+        evaluate = lambda row: isinstance(row.get(field), str) and row[field].lower().startswith(prefix)
+    else:  # regex
+        if not isinstance(value, str) or len(value) > MAX_REGEX_LENGTH:
+            raise PredicateError(f"'regex' sobre '{field}' requiere un patrón de hasta {MAX_REGEX_LENGTH} caracteres")
+        search = _compile_regex(field, value)
+        evaluate = lambda row: row.get(field) is not None and search(str(row[field]))
+
+    return _Node(evaluate, cost, selectivity, pushdown)
+
+def _compile_regex(field: str, value: str) -> Callable[[str], bool]:
+    """
+    Búsqueda del patrón en un texto: con RE2, o con re si el patrón no puede
+    retroceder de forma exponencial (sobre los primeros MAX_REGEX_SUBJECT caracteres)
+    """
+    if re2 is not None:
+        try:
+            pattern = re2.compile(value, _RE2_OPTIONS)
+        except re2.error as e:
+            detail = e.args[0].decode('utf-8', 'replace') if e.args and isinstance(e.args[0], bytes) else e
+            raise PredicateError(f"Expresión regular no válida en '{field}' (sintaxis RE2): {detail}")
+        return lambda text: pattern.search(text) is not None
+    try:
+        parsed = sre_parse.parse(value)
+    except re.error as e:
+        raise PredicateError(f"Expresión regular no válida en '{field}': {e}")
+    problem = _backtracking_risk(parsed, inside_repeat=False, repeats=[0])
+    if problem:
+        raise PredicateError(f"Expresión regular no admitida en '{field}': {problem}")
+    pattern = re.compile(value)
+    return lambda text: pattern.search(text, 0, MAX_REGEX_SUBJECT) is not None
+
+_REPEAT_OPS = tuple(getattr(sre_parse, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+                    if hasattr(sre_parse, name))
+_SINGLE_CHAR_OPS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY)
+
+def _backtracking_risk(parsed, inside_repeat: bool, repeats: List[int]):
+    """Motivo por el que el patrón puede bloquear el proceso con re, o None"""
+    for op, av in parsed:
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return "no se admiten referencias a grupos"
+        if op in _REPEAT_OPS:
+            low, high, sub = av
+            if low != high:
+                if inside_repeat:
+                    return "no se admiten cuantificadores anidados, p. ej. (a+)+"
+                repeats[0] += 1
+                if repeats[0] > MAX_REGEX_REPEATS:
+                    return f"como mucho {MAX_REGEX_REPEATS} cuantificadores variables (*, +, ?, {{m,n}}) sin RE2"
+            problem = _backtracking_risk(sub, inside_repeat or high > 1, repeats)
+        elif op == sre_parse.SUBPATTERN:
+            problem = _backtracking_risk(av[-1], inside_repeat, repeats)
+        elif op == sre_parse.BRANCH:
+            alternatives = av[1]
+            if inside_repeat and not all(len(alt) == 1 and alt[0][0] in _SINGLE_CHAR_OPS for alt in alternatives):
+                return "no se admiten alternativas de varios caracteres dentro de un cuantificador, p. ej. (a|ab)*"
+            problem = next(filter(None, (_backtracking_risk(alt, inside_repeat, repeats) for alt in alternatives)), None)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            problem = _backtracking_risk(av[1], inside_repeat, repeats)
+        elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+            problem = _backtracking_risk(av, inside_repeat, repeats)
+        else:
+            problem = None
+        if problem:
+            return problem
+    return None
+
+def _check_comparable(field: str, op: str, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise PredicateError(f"'{op}' sobre '{field}' requiere un número o texto")
+
+def _guarded(field: str, compare: Callable) -> Callable[[Dict], bool]:
+    """Comparación de orden: falso si falta el campo o los tipos no son comparables"""
+    def evaluate(row):
+        actual = row.get(field)
+        if actual is None:
+            return False
+        try:
+            return compare(actual)
+        except TypeError:
+            return False
+    return evaluate
+
+def _in_set(actual, normalized, accepts_null: bool, missing) -> bool:
+    if actual is missing or actual is None:
+        return accepts_null
+    if isinstance(actual, (dict, list)):
+        return False
+    return str(actual).lower() in normalized
@@ -0,0 +1,137 @@
+"""
+Autenticación ROBLE compartida por los microservicios
+Una sola verificación del token (identidad y rol) con sesión HTTP reutilizada
+y caché por token con TTL: la mayoría de peticiones no llama a ROBLE
+"""
+import os
+import time
+import json
+import base64
+import hashlib
+import logging
+import threading
+import requests
+from collections import OrderedDict
+from functools import wraps
+from typing import Dict, Optional
+from requests.adapters import HTTPAdapter
+from flask import request, jsonify, g
+
+logger = logging.getLogger(__name__)
+
+ROBLE_BASE_HOST = os.getenv('ROBLE_BASE_HOST', 'https://roble-api.openlab.uninorte.edu.co')
+ROBLE_CONTRACT = os.getenv('ROBLE_CONTRACT', 'microservices_roble_e65ac352d7')
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', '60'))  # segundos que se reutiliza una verificación válida
+AUTH_NEGATIVE_TTL = int(os.getenv('AUTH_NEGATIVE_TTL', '10'))  # segundos que se recuerda un token rechazado
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '1024'))
+ROBLE_TIMEOUT = float(os.getenv('ROBLE_TIMEOUT', '5'))
+
+# Sesión con conexiones keep-alive hacia ROBLE (también para las lecturas de datos)
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+_cache = OrderedDict()  # {sha256(token): (identidad o None, expira_en)}
+_lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0, 'errors': 0}
+
+def _token_key(token: str) -> str:
+    """Los tokens no se guardan en claro en memoria"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def identity_key(identity: Dict, token: str) -> str:
+    """Clave de cachés por usuario: el email verificado, o el hash del token si ROBLE no lo devuelve"""
+    return identity.get('email') or _token_key(token)
+
+def _token_expiry(token: str) -> Optional[float]:
+    """Campo `exp` del JWT (sin validar la firma: solo acota la caché)"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except Exception:
+        return None
+
+def verify_token(token: str) -> Optional[Dict]:
+    """
+    Verifica el token en ROBLE (o en la caché)
+
+    Returns:
+        {'email', 'role', 'user'} o None si el token no es válido
+    """
+    key = _token_key(token)
+    now = time.time()
+    with _lock:
+        cached = _cache.get(key)
+        if cached and cached[1] > now:
+            _cache.move_to_end(key)
+            stats['hits'] += 1
+            return cached[0]
+        stats['misses'] += 1
+
+    try:
+        response = session.get(
+            f"{ROBLE_BASE_HOST}/auth/{ROBLE_CONTRACT}/verify-token",
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=ROBLE_TIMEOUT
+        )
+    except requests.RequestException as e:
+        # Los fallos de red no se cachean: la siguiente petición reintenta
+        stats['errors'] += 1
+        logger.warning(f"⚠️ Error verificando token en ROBLE: {e}")
+        return None
+
+    if response.status_code == 200:
+        user_data = response.json()
+        user_info = user_data.get('user', {})
+        identity = {
+            'email': user_info.get('email', ''),
+            'role': user_info.get('role', user_data.get('role', 'user')),
+            'user': user_info
+        }
+        expires_at = now + AUTH_CACHE_TTL
+        token_exp = _token_expiry(token)
+        if token_exp:
+            expires_at = min(expires_at, token_exp)
+    else:
+        identity = None
+        expires_at = now + AUTH_NEGATIVE_TTL
+
+    with _lock:
+        _cache[key] = (identity, expires_at)
+        _cache.move_to_end(key)
+        while len(_cache) > AUTH_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return identity
+
+def require_auth(roles=None):
+    """
+    Decorador: exige 'Authorization: Bearer <token>' válido
+
+    Deja el token en g.roble_token y la identidad en g.roble_user.
+    Con `roles` solo se admiten esos roles (403 para el resto)
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            auth_header = request.headers.get('Authorization')
+            if not auth_header or not auth_header.startswith('Bearer '):
+                return jsonify({"error": "Token de autorización requerido"}), 401
+
+            token = auth_header.split(' ')[1]
+            identity = verify_token(token)
+            if not identity:
+                return jsonify({"error": "Token inválido o expirado"}), 401
+
+            if roles and identity['role'] not in roles:
+                return jsonify({"error": "Permisos insuficientes"}), 403
+
+            g.roble_token = token
+            g.roble_user = identity
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def cache_stats() -> Dict:
+    with _lock:
+        return dict(stats, cached_tokens=len(_cache), ttl=AUTH_CACHE_TTL)
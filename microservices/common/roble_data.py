@@ -0,0 +1,125 @@
+"""
+Lectura de tablas ROBLE en streaming
+El array JSON de la respuesta se decodifica por bloques y se entrega fila a
+fila: quien consume puede filtrar al vuelo y cortar la descarga en cuanto
+tiene suficientes resultados, con memoria constante
+"""
+import os
+import json
+import codecs
+import logging
+from typing import Dict, Iterable, Iterator, Optional
+from roble_auth import session, ROBLE_BASE_HOST, ROBLE_CONTRACT
+
+logger = logging.getLogger(__name__)
+
+ROBLE_READ_TIMEOUT = float(os.getenv('ROBLE_READ_TIMEOUT', '60'))
+STREAM_CHUNK_SIZE = 64 * 1024
+# Filtros de igualdad enviados como parámetros de /read (se comprueban igualmente en local)
+ROBLE_PUSHDOWN_FILTERS = os.getenv('ROBLE_PUSHDOWN_FILTERS', 'true').lower() == 'true'
+
+_WHITESPACE = ' \t\n\r'
+_ITEM_END = _WHITESPACE + ',]'
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator:
+    """
+    Decodifica un array JSON a partir de bloques de bytes, elemento a elemento
+
+    Si el documento no es un array se decodifica entero: una lista se recorre
+    y un objeto con 'data' (lista) también; cualquier otro valor no produce filas
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    started = False
+    chunks = iter(chunks)
+    exhausted = False
+
+    while True:
+        # Saltar espacios y separadores entre elementos
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos < len(buffer):
+            char = buffer[pos]
+            if not started:
+                if char != '[':
+                    yield from _iter_document(buffer[pos:] + ''.join(utf8.decode(c) for c in chunks) + utf8.decode(b'', final=True))
+                    return
+                started = True
+                pos += 1
+                continue
+            if char == ']':
+                return
+            if char == ',':
+                pos += 1
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # Un número cortado entre bloques decodifica antes de tiempo: exigir el separador siguiente
+                if (end < len(buffer) and buffer[end] in _ITEM_END) or exhausted:
+                    yield item
+                    pos = end
+                    continue
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+        elif exhausted:
+            if started:
+                raise json.JSONDecodeError('Array JSON incompleto', buffer, pos)
+            return
+
+        # Necesita más datos: descartar lo ya consumido y leer otro bloque
+        buffer = buffer[pos:]
+        pos = 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer += utf8.decode(b'', final=True)
+            exhausted = True
+        else:
+            buffer += utf8.decode(chunk)
+
+def _iter_document(text: str) -> Iterator:
+    document = json.loads(text) if text.strip() else []
+    if isinstance(document, dict):
+        document = document.get('data', [])
+    if isinstance(document, list):
+        yield from document
+
+def pushdown_params(filters: Optional[Dict]) -> Dict:
+    """Filtros que se pueden enviar a /read sin ambigüedad (texto y números)"""
+    if not ROBLE_PUSHDOWN_FILTERS or not filters:
+        return {}
+    return {
+        field: value for field, value in filters.items()
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool)
+    }
+
+def iter_table(token: str, table: str, filters: Optional[Dict] = None) -> Iterator[Dict]:
+    """
+    Filas de una tabla ROBLE a medida que llegan
+
+    Cerrar el generador (p. ej. al alcanzar un límite) corta la descarga
+    """
+    params = {"tableName": table}
+    params.update(pushdown_params(filters))
+    response = session.get(
+        f"{ROBLE_BASE_HOST}/database/{ROBLE_CONTRACT}/read",
+        headers={"Authorization": f"Bearer {token}"},
+        params=params,
+        stream=True,
+        timeout=(5, ROBLE_READ_TIMEOUT)
+    )
+    try:
+        response.raise_for_status()
+        yield from iter_json_array(response.iter_content(STREAM_CHUNK_SIZE))
+    finally:
+        response.close()
+
+def values_equal(actual, expected) -> bool:
+    """Igualdad tolerante con los tipos de los parámetros de URL ('true' == True, '5' == 5)"""
+    if actual == expected:
+        return True
+    if actual is None or expected is None:
+        return False
+    return str(actual).lower() == str(expected).lower()
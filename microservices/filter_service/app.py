@@ -5,100 +5,234 @@ Filtra usuarios según criterios específicos
 import os
 import logging
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 from datetime import datetime
 import json
+from roble_auth import require_auth, cache_stats, identity_key
+from http_encoding import setup_http_encoding, encoding_stats, dumps_bytes
+from roble_data import iter_table
+from predicates import compile_predicate, PredicateError
+from user_snapshot import UserSnapshot
+from ordering import parse_order, OrderError
+from pagination import PaginationError, check_limit, decode_cursor, encode_cursor, skip_to_cursor, top_k
 
 # Configuración
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:8080', 'http://127.0.0.1:8080'])
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+setup_http_encoding(app)
 
 # Variables de entorno
 ROBLE_BASE_HOST = os.getenv('ROBLE_BASE_HOST', 'https://roble-api.openlab.uninorte.edu.co')
 ROBLE_CONTRACT = os.getenv('ROBLE_CONTRACT', 'microservices_roble_e65ac352d7')
 SERVICE_NAME = os.getenv('SERVICE_NAME', 'filter-service')
+# Segundos que se reutiliza el snapshot en memoria de usuarios (0 = leer siempre de ROBLE)
+FILTER_SNAPSHOT_TTL = int(os.getenv('FILTER_SNAPSHOT_TTL', '60'))
+# Usuarios distintos con snapshot propio en memoria (se descarta el menos reciente)
+FILTER_SNAPSHOT_USERS = int(os.getenv('FILTER_SNAPSHOT_USERS', '8'))
+# Un solo snapshot para todos los usuarios: solo si ROBLE devuelve a todos las mismas filas
+FILTER_SNAPSHOT_SHARED = os.getenv('FILTER_SNAPSHOT_SHARED', 'false').lower() == 'true'
+# Bytes de NDJSON que se acumulan antes de enviar un bloque (respuestas en streaming)
+FILTER_FLUSH_BYTES = int(os.getenv('FILTER_FLUSH_BYTES', '65536'))
+
+# Snapshot columnar de usuarios con índices (uno por usuario autenticado)
+user_snapshot = UserSnapshot(lambda token: iter_table(token, "usuarios"), ttl=FILTER_SNAPSHOT_TTL,
+                             max_users=FILTER_SNAPSHOT_USERS) if FILTER_SNAPSHOT_TTL > 0 else None
+
+def snapshot_key(token):
+    """Snapshot del usuario de la petición (el común con FILTER_SNAPSHOT_SHARED)"""
+    return 'shared' if FILTER_SNAPSHOT_SHARED else identity_key(g.roble_user, token)
 
 # --- FUNCIONES ROBLE ---
-def roble_verify_token(token):
-    """Verificar token en ROBLE"""
-    try:
-        url = f"{ROBLE_BASE_HOST}/auth/{ROBLE_CONTRACT}/verify-token"
-        response = requests.get(url, headers={"Authorization": f"Bearer {token}"})
-        return response.status_code == 200
-    except:
-        return False
-
-def roble_check_permissions(token):
-    """Verificar permisos específicos del usuario"""
-    try:
-        url = f"{ROBLE_BASE_HOST}/auth/{ROBLE_CONTRACT}/verify-token"
-        response = requests.get(url, headers={"Authorization": f"Bearer {token}"})
-        
-        if response.status_code == 200:
-            user_data = response.json()
-            user_role = user_data.get('role', 'user')
-            # Permitir acceso básico a todos los roles autenticados
-            return True
-        return False
-    except:
-        return False
-
-def roble_get_users(token, filters=None):
-    """Obtener usuarios de ROBLE"""
+def roble_iter_users(token, filters=None):
+    """Usuarios de ROBLE a medida que llegan (filtros de igualdad enviados a /read si es posible)"""
     try:
-        url = f"{ROBLE_BASE_HOST}/database/{ROBLE_CONTRACT}/read"
-        params = {"tableName": "usuarios"}
-        if filters:
-            params.update(filters)
-        
-        response = requests.get(url, 
-            headers={"Authorization": f"Bearer {token}"}, 
-            params=params
-        )
-        response.raise_for_status()
-        return response.json()
+        yield from iter_table(token, "usuarios", filters)
     except Exception as e:
         logger.error(f"Error obteniendo usuarios: {e}")
-        return []
 
 # --- PROCESAMIENTO ---
-def process_filter_users(token, filter_data):
-    """Procesa filtrado de usuarios"""
+def equality_condition(filter_data):
+    """
+    Filtro de igualdad clásico filter_field/filter_value como condición, o None
+    
+    Sin `where` se mantiene el filtro por defecto (active == True); con `where`
+    solo se aplica si la petición indica filter_field
+    """
+    if 'where' in filter_data and 'filter_field' not in filter_data:
+        return None
     filter_field = filter_data.get('filter_field', 'active')
     filter_value = filter_data.get('filter_value', True)
-    limit = filter_data.get('limit', 100)
+    if not filter_field or filter_value is None:
+        return None
+    return {'field': filter_field, 'op': 'eq', 'value': filter_value}
+
+def filter_expression(filter_data):
+    """Expresión efectiva de la petición: `where` y/o el filtro de igualdad clásico (None = sin filtro)"""
+    conditions = []
+    if 'where' in filter_data:
+        conditions.append(filter_data['where'])
+    equality = equality_condition(filter_data)
+    if equality:
+        conditions.append(equality)
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {'and': conditions}
+
+def build_filter_predicate(filter_data):
+    """Predicado compilado de la expresión efectiva de la petición"""
+    expression = filter_expression(filter_data)
+    return compile_predicate(expression) if expression is not None else None
+
+def roble_filter_users(token, predicate, stats):
+    """Filtrado al vuelo sobre el stream de ROBLE: al cerrar el generador se corta la descarga"""
+    users = roble_iter_users(token, predicate.pushdown_filters() if predicate else None)
+    try:
+        for user in users:
+            stats['scanned'] += 1
+            if predicate is None or predicate(user):
+                yield user
+    finally:
+        users.close()
+
+def matching_users(token, predicate, order, cursor, stats):
+    """
+    Usuarios que cumplen el filtro en el orden de la tabla: consulta por índices
+    sobre el snapshot en memoria si cubre los campos del filtro y del orden, o
+    lectura de ROBLE en streaming. Con cursor y sin order_by, desde la fila
+    siguiente a la del cursor
+    """
+    fields = set(predicate.fields()) if predicate else set()
+    fields.update(field for field, _ in order or [])
+    table = None
+    if user_snapshot and user_snapshot.covers(fields):
+        table = user_snapshot.get(snapshot_key(token), token)
     
-    # Obtener usuarios de ROBLE
-    filters = {filter_field: filter_value} if filter_field and filter_value is not None else {}
-    users = roble_get_users(token, filters)
+    resume = cursor is not None and order is None
+    if table:
+        after = table.position_of(cursor['id']) if resume else None
+        if resume and after is None:
+            raise PaginationError("El cursor no es válido o su fila ya no existe")
+        stats.update(source="snapshot", data_as_of=datetime.fromtimestamp(table.built_at).isoformat())
+        return table.iter_matches(predicate, stats, after)
+    stats.update(source="roble")
+    users = roble_filter_users(token, predicate, stats)
+    return skip_to_cursor(users, cursor) if resume else users
+
+def user_result(user):
+    return {
+        'id': user.get('_id'),
+        'name': user.get('name'),
+        'email': user.get('email'),
+        'age': user.get('age'),
+        'city': user.get('city'),
+        'active': user.get('active')
+    }
+
+def query_filter_users(token, filter_data, streaming=False):
+    """
+    Usuarios de la página pedida, como generador, y un dict con los datos de la
+    consulta que se completa al recorrerlo (filas revisadas, índice, cursor)
+
+    Sin order_by las filas salen en cuanto se encuentran y la página acaba en
+    `limit` (en streaming, sin límite si no se indica); con order_by se eligen
+    las `limit` primeras con un heap. next_cursor continúa tras la última fila
+    """
+    predicate = build_filter_predicate(filter_data)
+    order = None
+    if filter_data.get('order_by') is not None:
+        try:
+            order = parse_order(filter_data['order_by'])
+        except OrderError as e:
+            raise PaginationError(f"order_by: {e}")
+    limit = check_limit(filter_data.get('limit'), order is not None,
+                        None if streaming and order is None else 100)
+    cursor = decode_cursor(filter_data['after'], order) if filter_data.get('after') is not None else None
     
-    # Aplicar límite
-    users = users[:limit]
+    info = {"scanned": 0, "index": None, "next_cursor": None, "order": order, "limit": limit}
+    users = matching_users(token, predicate, order, cursor, info)
     
-    # Procesar datos
-    result = []
-    for user in users:
-        result.append({
-            'id': user.get('_id'),
-            'name': user.get('name'),
-            'email': user.get('email'),
-            'age': user.get('age'),
-            'city': user.get('city'),
-            'active': user.get('active')
-        })
+    def page():
+        try:
+            if order is not None:
+                selected, more = top_k(users, order, limit, cursor)
+                if more:
+                    info["next_cursor"] = encode_cursor(selected[-1], order)
+                for user in selected:
+                    yield user_result(user)
+                return
+            count = 0
+            for user in users:
+                count += 1
+                yield user_result(user)
+                if limit is not None and count >= limit:
+                    # Página completa: puede haber más filas
+                    info["next_cursor"] = encode_cursor(user, None)
+                    return
+        finally:
+            users.close()
     
+    return page(), info
+
+def filter_summary(filter_data, info, total):
+    """Datos de la consulta que acompañan a los usuarios (cuerpo JSON o última línea NDJSON)"""
+    equality = equality_condition(filter_data)
+    source = {"source": info["source"]}
+    if info["source"] == "snapshot":
+        source.update(index=info["index"], data_as_of=info["data_as_of"])
     return {
         "success": True,
         "service": SERVICE_NAME,
-        "filter_criteria": {"field": filter_field, "value": filter_value},
-        "total_results": len(result),
-        "users": result,
+        "filter_criteria": {
+            "field": equality["field"] if equality else None,
+            "value": equality["value"] if equality else None,
+            "where": filter_data.get('where'),
+            "expression": filter_expression(filter_data)
+        },
+        "order_by": [{"field": field, "order": "desc" if descending else "asc"}
+                     for field, descending in info["order"]] if info["order"] else None,
+        "total_results": total,
+        "scanned_rows": info["scanned"],
+        **source,
+        "next_cursor": info["next_cursor"],
         "processed_at": datetime.now().isoformat()
     }
 
+def process_filter_users(token, filter_data):
+    """Procesa filtrado de usuarios"""
+    users, info = query_filter_users(token, filter_data)
+    users = list(users)
+    return dict(filter_summary(filter_data, info, len(users)), users=users)
+
+def stream_filter_users(filter_data, first, users, info):
+    """
+    Respuesta NDJSON: un usuario por línea (el primero sin esperar a más) y al
+    final {"_summary": ...}; si falla a mitad termina con {"_error": ...}
+    """
+    buffer = []
+    size = 0
+    total = 0
+    try:
+        user = first
+        while user is not None:
+            total += 1
+            line = dumps_bytes(user) + b'\n'
+            buffer.append(line)
+            size += len(line)
+            if total == 1 or size >= FILTER_FLUSH_BYTES:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+            user = next(users, None)
+        buffer.append(dumps_bytes({"_summary": filter_summary(filter_data, info, total)}) + b'\n')
+    except Exception as e:
+        logger.error(f"Error procesando filtrado: {e}")
+        buffer.append(dumps_bytes({"_error": "Error interno del servidor", "service": SERVICE_NAME}) + b'\n')
+    finally:
+        users.close()
+    yield b''.join(buffer)
+
 # --- API ENDPOINTS ---
 @app.route('/')
 def home():
@@ -107,7 +241,7 @@ def home():
         "service": SERVICE_NAME,
         "type": "filter",
         "description": "Microservicio de filtrado de usuarios ROBLE",
-        "version": "1.0",
+        "version": "1.1",
         "endpoints": {
             "filter": "/filter",
             "health": "/health"
@@ -115,26 +249,29 @@ def home():
     })
 
 @app.route('/filter', methods=['POST'])
+@require_auth()
 def filter_users():
     """Endpoint principal de filtrado"""
-    # Verificar token
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({"error": "Token de autorización requerido"}), 401
-    
-    token = auth_header.split(' ')[1]
-    if not roble_verify_token(token):
-        return jsonify({"error": "Token inválido o expirado"}), 401
-    
-    if not roble_check_permissions(token):
-        return jsonify({"error": "Permisos insuficientes"}), 403
-    
     # Obtener datos de filtrado
     data = request.get_json() or {}
+    # Streaming NDJSON con "stream": true o Accept: application/x-ndjson
+    streaming = data.get('stream') is True or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
     
     try:
-        result = process_filter_users(token, data)
-        return jsonify(result), 200
+        if not streaming:
+            result = process_filter_users(g.roble_token, data)
+            return jsonify(result), 200
+        users, info = query_filter_users(g.roble_token, data, streaming=True)
+        # El primer usuario se busca antes de responder: los errores aún pueden ser 400 o 500
+        try:
+            first = next(users, None)
+        except Exception:
+            users.close()
+            raise
+        return Response(stream_filter_users(data, first, users, info), mimetype='application/x-ndjson')
+    except (PredicateError, PaginationError) as e:
+        return jsonify({"error": str(e), "service": SERVICE_NAME}), 400
     except Exception as e:
         logger.error(f"Error procesando filtrado: {e}")
         return jsonify({
@@ -148,9 +285,12 @@ def health():
     return jsonify({
         "status": "healthy",
         "service": SERVICE_NAME,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "auth_cache": cache_stats(),
+        "http": encoding_stats(),
+        "snapshot": user_snapshot.get_stats() if user_snapshot else None
     })
 
 if __name__ == '__main__':
     print(f"🔍 {SERVICE_NAME} ready")
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')), debug=False)
\ No newline at end of file
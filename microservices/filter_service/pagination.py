@@ -0,0 +1,94 @@
+"""
+Paginación por cursor y top-k de /filter
+Sin order_by las filas salen en el orden de la tabla y el cursor es el _id
+de la última fila devuelta. Con order_by se eligen las `limit` primeras con
+un heap (memoria acotada por limit, sin ordenar todas) y el cursor guarda los
+valores de orden de la última fila más su _id como desempate: la página
+siguiente son las filas estrictamente posteriores a esa clave
+"""
+import json
+import base64
+import heapq
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from ordering import sort_key
+
+MAX_ORDERED_LIMIT = 10000  # filas que guarda el heap de una página con order_by
+
+class PaginationError(ValueError):
+    """Parámetros de paginación no válidos (se responde 400)"""
+
+def encode_cursor(row: Dict, keys: Optional[List[Tuple[str, bool]]]) -> str:
+    """Cursor opaco que apunta a `row` (última fila de una página)"""
+    payload = {'id': row.get('_id')}
+    if keys:
+        payload['order'] = [[field, descending] for field, descending in keys]
+        payload['values'] = [row.get(field) for field, _ in keys]
+    data = json.dumps(payload, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def decode_cursor(cursor, keys: Optional[List[Tuple[str, bool]]]) -> Dict:
+    """Cursor recibido en `after`; debe corresponder al mismo order_by"""
+    try:
+        if not isinstance(cursor, str):
+            raise ValueError
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(payload, dict) or 'id' not in payload:
+            raise ValueError
+    except ValueError:
+        raise PaginationError("after no es un cursor válido")
+    expected = [[field, descending] for field, descending in keys] if keys else None
+    if payload.get('order') != expected or (keys and len(payload.get('values') or []) != len(keys)):
+        raise PaginationError("El cursor corresponde a otro order_by")
+    return payload
+
+def ordered_keys(keys: List[Tuple[str, bool]]) -> List[Tuple[str, bool]]:
+    """Campos de orden con _id como desempate (orden total para el cursor)"""
+    return keys if any(field == '_id' for field, _ in keys) else keys + [('_id', False)]
+
+def skip_to_cursor(rows: Iterable[Dict], cursor: Dict) -> Iterator[Dict]:
+    """Filas posteriores a la del cursor en el orden de la tabla"""
+    rows = iter(rows)
+    row_id = cursor['id']
+    for row in rows:
+        if row.get('_id') == row_id:
+            break
+    else:
+        raise PaginationError("El cursor no es válido o su fila ya no existe")
+    yield from rows
+
+def top_k(rows: Iterable[Dict], keys: List[Tuple[str, bool]], limit: int,
+          cursor: Optional[Dict] = None) -> Tuple[List[Dict], bool]:
+    """
+    Las `limit` primeras filas según `keys` posteriores al cursor (heap de
+    tamaño limit) y si quedan más
+    """
+    keys = ordered_keys(keys)
+    key = sort_key(keys)
+    after = None
+    if cursor is not None:
+        anchor = dict(zip([field for field, _ in keys], cursor['values']))
+        anchor['_id'] = cursor['id']
+        after = key(anchor)
+    matched = [0]
+
+    def candidates():
+        for row in rows:
+            if after is None or after < key(row):
+                matched[0] += 1
+                yield row
+
+    page = heapq.nsmallest(limit, candidates(), key=key)
+    return page, matched[0] > limit
+
+def check_limit(limit, ordered: bool, default: Optional[int]) -> Optional[int]:
+    """limit validado (None = sin límite, solo en streaming sin order_by)"""
+    if limit is None:
+        limit = default
+    if limit is None:
+        return None
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+        raise PaginationError("limit debe ser un entero positivo")
+    if ordered and limit > MAX_ORDERED_LIMIT:
+        raise PaginationError(f"Con order_by, limit admite como mucho {MAX_ORDERED_LIMIT} (use after para paginar)")
+    return limit
+
@@ -0,0 +1,270 @@
+"""
+Snapshot en memoria de la tabla usuarios (formato columnar)
+Columnas sobre arrays, ciudad y estado codificados con diccionario (texto
+internado), índices hash para igualdad y un índice ordenado de edad para
+rangos. Hay uno por usuario y se refresca por TTL: sirve el snapshot anterior
+mientras el nuevo se construye en segundo plano
+"""
+import math
+import time
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+from sys import getsizeof, intern
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Campos que guarda el snapshot: los que devuelve /filter
+SNAPSHOT_FIELDS = ('_id', 'name', 'email', 'age', 'city', 'active')
+DICTIONARY_FIELDS = ('city', 'active')  # pocos valores distintos: código por fila + índice hash
+RANGE_FIELD = 'age'
+RANGE_OPS = ('lt', 'lte', 'gt', 'gte', 'between')
+
+# Tipo del valor original de la edad (para devolverlo igual que ROBLE)
+_MISSING, _INT, _FLOAT, _OTHER = 0, 1, 2, 3
+
+def _index_key(value) -> Optional[str]:
+    """Clave del índice hash con la misma tolerancia que values_equal ('true' == True)"""
+    return None if value is None else str(value).lower()
+
+class _DictionaryColumn:
+    """Columna codificada: un código por fila y la lista de valores distintos"""
+
+    def __init__(self):
+        self.codes = array('I')
+        self.values = []
+        self._lookup = {}
+
+    def append(self, value):
+        key = (type(value).__name__, value if isinstance(value, (str, bool, int, float, type(None))) else str(value))
+        code = self._lookup.get(key)
+        if code is None:
+            code = self._lookup[key] = len(self.values)
+            self.values.append(intern(value) if isinstance(value, str) else value)
+        self.codes.append(code)
+
+    def __getitem__(self, row: int):
+        return self.values[self.codes[row]]
+
+    def build_index(self) -> Dict[str, array]:
+        """{clave normalizada: filas en orden}"""
+        by_code = [array('I') for _ in self.values]
+        for row, code in enumerate(self.codes):
+            by_code[code].append(row)
+        index = {}
+        for code, rows in enumerate(by_code):
+            key = _index_key(self.values[code])
+            if key in index:
+                index[key] = array('I', sorted(index[key] + rows))
+            else:
+                index[key] = rows
+        return index
+
+class UserTable:
+    """Snapshot inmutable de usuarios con sus índices"""
+
+    def __init__(self, rows: Iterable[Dict]):
+        started = time.time()
+        self.ids = []
+        self.names = []
+        self.emails = []
+        self.ages = array('d')
+        self.age_kinds = bytearray()
+        self.age_other = {}  # {fila: valor} edades no numéricas
+        self.dictionary = {field: _DictionaryColumn() for field in DICTIONARY_FIELDS}
+
+        for row in rows:
+            self.ids.append(row.get('_id'))
+            self.names.append(row.get('name'))
+            self.emails.append(row.get('email'))
+            age = row.get('age')
+            if age is None:
+                self.ages.append(math.nan)
+                self.age_kinds.append(_MISSING)
+            elif isinstance(age, (int, float)) and not isinstance(age, bool):
+                self.ages.append(float(age))
+                self.age_kinds.append(_INT if isinstance(age, int) else _FLOAT)
+            else:
+                self.age_other[len(self.ids) - 1] = age
+                self.ages.append(math.nan)
+                self.age_kinds.append(_OTHER)
+            for field, column in self.dictionary.items():
+                column.append(row.get(field))
+
+        self.size = len(self.ids)
+        self.hash_indexes = {field: column.build_index() for field, column in self.dictionary.items()}
+        numeric = sorted((age, row) for row, age in enumerate(self.ages) if self.age_kinds[row] in (_INT, _FLOAT))
+        self.age_sorted = array('d', (age for age, _ in numeric))
+        self.age_rows = array('I', (row for _, row in numeric))
+        self.built_at = time.time()
+        self.build_ms = round((self.built_at - started) * 1000, 1)
+
+    def row(self, i: int) -> Dict:
+        """Fila reconstruida con los valores originales"""
+        kind = self.age_kinds[i]
+        if kind == _INT:
+            age = int(self.ages[i])
+        elif kind == _FLOAT:
+            age = self.ages[i]
+        else:
+            age = self.age_other.get(i)
+        return {
+            '_id': self.ids[i],
+            'name': self.names[i],
+            'email': self.emails[i],
+            'age': age,
+            'city': self.dictionary['city'][i],
+            'active': self.dictionary['active'][i]
+        }
+
+    def _candidates(self, field: str, op: str, value) -> Optional[array]:
+        """Filas que pueden cumplir la condición según un índice, o None si no hay índice aplicable"""
+        if field in self.hash_indexes and op in ('eq', 'in'):
+            values = value if op == 'in' else [value]
+            # Solo texto y booleanos: con números la igualdad tolerante no coincide con la clave (1 == 1.0)
+            if not all(isinstance(v, (str, bool)) for v in values):
+                return None
+            index = self.hash_indexes[field]
+            if len(values) == 1:
+                return index.get(_index_key(values[0]), array('I'))
+            return array('I', sorted(set().union(*(index.get(_index_key(v), ()) for v in values))))
+
+        if field == RANGE_FIELD and op in RANGE_OPS:
+            bounds = value if op == 'between' else [value]
+            if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in bounds):
+                return None
+            low, high = 0, len(self.age_sorted)
+            if op in ('gt', 'gte', 'between'):
+                bound = bounds[0]
+                low = bisect_right(self.age_sorted, bound) if op == 'gt' else bisect_left(self.age_sorted, bound)
+            if op in ('lt', 'lte', 'between'):
+                bound = bounds[-1]
+                high = bisect_left(self.age_sorted, bound) if op == 'lt' else bisect_right(self.age_sorted, bound)
+            return array('I', sorted(self.age_rows[low:high])) if low < high else array('I')
+        return None
+
+    def plan(self, predicate) -> Tuple[Optional[array], str]:
+        """Filas candidatas: el índice más selectivo del AND de primer nivel (None = recorrido completo)"""
+        best, best_name = None, 'scan'
+        for field, op, value in predicate.index_conditions():
+            candidates = self._candidates(field, op, value)
+            if candidates is not None and (best is None or len(candidates) < len(best)):
+                best, best_name = candidates, f"{field}:{op}"
+        return best, best_name
+
+    def position_of(self, row_id) -> Optional[int]:
+        """Fila con ese _id (para continuar tras un cursor), o None"""
+        try:
+            return self.ids.index(row_id)
+        except ValueError:
+            return None
+
+    def iter_matches(self, predicate, stats: Dict, after: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Filas que cumplen el predicado en el orden de la tabla, a partir de la
+        siguiente a `after`; anota en stats el índice usado y las filas revisadas
+        """
+        candidates, stats['index'] = self.plan(predicate) if predicate else (None, 'scan')
+        if candidates is None:
+            rows = range(0 if after is None else after + 1, self.size)
+        else:
+            rows = candidates if after is None else candidates[bisect_right(candidates, after):]
+        for i in rows:
+            stats['scanned'] += 1
+            row = self.row(i)
+            if predicate is None or predicate(row):
+                yield row
+
+    def memory_bytes(self) -> int:
+        """Tamaño aproximado (columnas, textos e índices)"""
+        total = sum(getsizeof(col) for col in (self.ids, self.names, self.emails, self.ages, self.age_kinds))
+        total += sum(getsizeof(v) for col in (self.ids, self.names, self.emails) for v in col if v is not None)
+        for column in self.dictionary.values():
+            total += getsizeof(column.codes) + sum(getsizeof(v) for v in column.values)
+        for index in self.hash_indexes.values():
+            total += getsizeof(index) + sum(getsizeof(rows) for rows in index.values())
+        return total + getsizeof(self.age_sorted) + getsizeof(self.age_rows)
+
+class _SnapshotEntry:
+    """Snapshot de un usuario; una sola construcción a la vez"""
+
+    def __init__(self):
+        self.table: Optional[UserTable] = None
+        self.building = threading.Lock()
+
+class UserSnapshot:
+    """
+    Snapshots refrescados por TTL, uno por usuario (ROBLE puede devolver filas
+    distintas a cada uno); se guardan los de los `max_users` usuarios más recientes
+    """
+
+    def __init__(self, loader: Callable[[str], Iterable[Dict]], ttl=60, max_users=8):
+        self.loader = loader  # (token) -> filas de ROBLE
+        self.ttl = ttl
+        self.max_users = max_users
+        self.entries: "OrderedDict[str, _SnapshotEntry]" = OrderedDict()
+        self.metrics = {'builds': 0, 'build_failures': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+
+    def covers(self, fields) -> bool:
+        return set(fields) <= set(SNAPSHOT_FIELDS)
+
+    def _entry(self, key: str) -> _SnapshotEntry:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = _SnapshotEntry()
+                while len(self.entries) > self.max_users:
+                    self.entries.popitem(last=False)
+                    self.metrics['evictions'] += 1
+            self.entries.move_to_end(key)
+            return entry
+
+    def get(self, key: str, token: str) -> Optional[UserTable]:
+        """
+        Snapshot actual del usuario `key`, leído con su token; lo construye si
+        no existe y lo refresca en segundo plano si caducó (mientras tanto se
+        sigue sirviendo el anterior)
+        """
+        entry = self._entry(key)
+        table = entry.table
+        if table is None:
+            with entry.building:
+                if entry.table is None:
+                    self._build(entry, token)
+            return entry.table
+        if time.time() - table.built_at > self.ttl and entry.building.acquire(blocking=False):
+            def refresh():
+                try:
+                    self._build(entry, token)
+                finally:
+                    entry.building.release()
+            threading.Thread(target=refresh, daemon=True).start()
+        return table
+
+    def _build(self, entry: _SnapshotEntry, token: str):
+        try:
+            table = UserTable(self.loader(token))
+        except Exception as e:
+            self.metrics['build_failures'] += 1
+            logger.error(f"❌ Error construyendo snapshot de usuarios: {e}")
+            return
+        entry.table = table
+        self.metrics['builds'] += 1
+        logger.info(f"🗂️ Snapshot de usuarios: {table.size} filas en {table.build_ms}ms")
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            tables = [entry.table for entry in self.entries.values() if entry.table]
+        stats = dict(self.metrics, ttl=self.ttl, max_users=self.max_users, snapshots=len(tables))
+        if tables:
+            now = time.time()
+            stats.update({
+                'rows': sum(table.size for table in tables),
+                'oldest_age_seconds': round(now - min(table.built_at for table in tables), 1),
+                'memory_bytes': sum(table.memory_bytes() for table in tables)
+            })
+        return stats